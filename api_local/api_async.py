@@ -0,0 +1,527 @@
+# api_async.py
+# Versão ASGI de api_local.py: mesmas rotas e mesmas respostas, com sessões assíncronas do SQLAlchemy.
+# Rodar com: hypercorn api_async:app --bind 0.0.0.0:5000
+from quart import Quart, jsonify, request, redirect, Response
+from sqlalchemy.exc import IntegrityError
+
+from models_local import *
+from models_async import async_session
+from sqlalchemy import select
+# Paginação, streaming e validação vêm de api_local.py, para as duas versões não divergirem;
+# importá-lo também roda o init_db
+from api_local import parametros_paginacao, quer_stream, parametro_expand, ler_usuario, lote_json, \
+    TAMANHO_LOTE_STREAM
+
+app = Quart(__name__)
+app.config['SECRET_KEY'] = 'chave_secretinha'
+
+# ---------------- STREAMING ----------------
+def resposta_em_stream(consulta, serializar=lambda obj: obj.serialize()):
+    # Cursor assíncrono lido em lotes (yield_per): cada lote é escrito antes do próximo ser buscado
+    async def gerar():
+        db_session = async_session()
+        try:
+            resultado = await db_session.stream(consulta.execution_options(yield_per=TAMANHO_LOTE_STREAM))
+            yield '['
+            separador = ''
+            async for lote in resultado.scalars().partitions():
+                yield separador + lote_json(lote, serializar, app.json.dumps)
+                separador = ','
+            yield ']'
+        finally:
+            await db_session.close()
+    return Response(gerar(), mimetype='application/json')
+
+@app.route('/')
+async def index():
+    """
+        API para gerenciar uma biblioteca integrada a um banco de dados
+
+    """
+    return redirect('/livros')
+@app.route('/livros', methods=['POST'])
+async def post_livro():
+    """
+            Cadastrar livros
+
+            ### Endpoint:
+                POST /livros
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**
+    """
+    db_session = async_session()
+    try:
+        dados_livro = await request.get_json()
+        # Captura os valores dos campos do formulário
+        titulo = dados_livro['titulo']
+        autor = dados_livro["autor"]
+        ISBN = dados_livro["ISBN"]
+        resumo = dados_livro["resumo"]
+
+        # Validação de cada campo
+        if not titulo:
+            return jsonify({"mensagem": "erro no titulo"})
+        if not autor:
+            return jsonify({"mensagem": "erro no autor"})
+        if not ISBN:
+            return jsonify({"mensagem": "erro no ISBN"})
+        if not resumo:
+            return jsonify({"mensagem": "erro no resumo"})
+
+        # Se todos os campos estiverem preenchidos, cria o Livro
+        form_evento = Livro(
+            titulo=titulo,
+            autor=autor,
+            ISBN=ISBN,
+            resumo=resumo
+        )
+        # run_sync executa o método síncrono do modelo (save + índice de busca) na sessão assíncrona
+        await db_session.run_sync(form_evento.save)
+        return jsonify({'result': 'Livro criado com sucesso!'}), 200
+    except ValueError:
+        return jsonify({"mensagem": "formato invalido"})
+    finally:
+        await db_session.close()
+
+@app.route('/livros', methods=['GET'])
+async def get_livro():
+    """
+            Consultar livros
+
+            ### Endpoint:
+                GET /livros?limit=<n>&after=<id_livro>
+                GET /livros?stream=true
+
+            ### Parâmetros:
+            - `limit` **(int)**: **quantidade máxima de livros na página (padrão 100, máximo 1000)**
+            - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
+            - `stream` **(bool)**: **devolve todos os livros em um array JSON transmitido em lotes, sem paginação**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com a lista de livros da página e o `next_cursor` (`null` na última página)
+        """
+    db_session = async_session()
+    try:
+        if quer_stream(request.args):
+            return resposta_em_stream(select(Livro).order_by(Livro.id_livro))
+        limite, cursor = parametros_paginacao(request.args)
+        lista, proximo_cursor = await db_session.run_sync(paginar, select(Livro), Livro.id_livro, limite, cursor)
+        resultados = []
+        for livro in lista:
+            resultados.append(livro.serialize())
+        return jsonify({"livros": resultados, "next_cursor": proximo_cursor})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+
+@app.route('/livros/busca', methods=['GET'])
+async def busca_livro():
+    """
+            Buscar livros por texto
+
+            ### Endpoint:
+                GET /livros/busca?q=<termos>&limit=<n>
+
+            ### Parâmetros:
+            - `q` **(str)**: **palavras procuradas no título, autor e resumo**
+            - `limit` **(int)**: **quantidade máxima de livros (padrão 100, máximo 1000)**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com a lista de livros encontrados, do mais relevante para o menos relevante
+        """
+    db_session = async_session()
+    try:
+        termo = request.args.get('q', '').strip()
+        if not termo:
+            return jsonify({"mensagem": "Informe o parâmetro q."}), 400
+        limite, _ = parametros_paginacao(request.args)
+        lista = await db_session.run_sync(buscar_livros, termo, limite)
+        return jsonify({"livros": [livro.serialize() for livro in lista]})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+
+@app.route('/livros/<int:id_livro>', methods=['PUT'])
+async def put_livro(id_livro):
+    """
+            Editar livros
+
+            ### Endpoint:
+                PUT /livros/<id_livro>
+
+            ### Parâmetros:
+            - `id_livro` **(str)**: **string para ser convertida a inteiro**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**
+        """
+    db_session = async_session()
+    try:
+        livro = (await db_session.execute(select(Livro).where(Livro.id_livro == id_livro))).scalar()
+
+        if livro is None:
+            return jsonify({"mensagem": "Livro não encontrado."})
+
+        dados_livro = await request.get_json()
+        # Captura os valores dos campos do formulário
+        livro.titulo = dados_livro['titulo']
+        livro.autor = dados_livro["autor"]
+        livro.ISBN = dados_livro["ISBN"]
+        livro.resumo = dados_livro["resumo"]
+
+        await db_session.run_sync(livro.save)
+        return jsonify({"mensagem": "Livro atualizado com sucesso!"})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+@app.route('/livros/<int:id_livro>', methods=['DELETE'])
+async def delete_livro(id_livro):
+    db_session = async_session()
+    try:
+        var_livro = (await db_session.execute(select(Livro).where(Livro.id_livro == id_livro))).scalar()
+        await db_session.run_sync(var_livro.delete)
+        return jsonify({"mensagem": "Livro deletado com sucesso!"})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+@app.route('/usuarios', methods=['POST'])
+async def post_usuario():
+    """
+        Cadastrar usuario
+
+        ### Endpoint:
+            POST /usuarios
+
+        ### Erros possíveis:
+        - **Bad Request**: *status code* **400**
+
+        ### Retorna:
+        - **JSON** mensagem de **sucesso**
+    """
+    db_session = async_session()
+    try:
+        dados_usuario = await request.get_json()
+        # Captura os valores dos campos do formulário
+        usuario = ler_usuario(dados_usuario)
+        if usuario is None:
+            return jsonify({'result': 'Error. Integrity Error (faltam informações) '}), 400
+        else:
+            nome, cpf_f, endereco = usuario
+            post = Usuario(nome=nome, CPF=cpf_f, endereco=endereco)
+            await db_session.run_sync(post.save)
+            return jsonify({'mensagem': 'Usuario criado com sucesso!'}), 200
+    except ValueError:
+        return jsonify({"mensagem": "formato invalido"})
+    except IntegrityError:
+        return jsonify({"mensagem": "CPF inválido"})
+    except TypeError:
+        return jsonify({'mensagem': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+@app.route('/usuarios', methods=['GET'])
+async def get_usuario():
+    """
+        Consultar usuarios
+
+        ### Endpoint:
+            GET /usuarios?limit=<n>&after=<id_usuario>
+
+        ### Parâmetros:
+        - `limit` **(int)**: **quantidade máxima de usuarios na página (padrão 100, máximo 1000)**
+        - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
+
+        ### Erros possíveis:
+        - **Bad Request**: *status code* **400**
+
+        ### Retorna:
+        - **JSON** com a lista de usuarios da página e o `next_cursor` (`null` na última página)
+    """
+    db_session = async_session()
+    try:
+        limite, cursor = parametros_paginacao(request.args)
+        lista, proximo_cursor = await db_session.run_sync(paginar, select(Usuario), Usuario.id_usuario, limite, cursor)
+        resultados = []
+        for usuario in lista:
+            resultados.append(usuario.serialize())
+        return jsonify({"usuarios": resultados, "next_cursor": proximo_cursor})
+    except ValueError:
+        return jsonify({"mensagem": "formato invalido"}), 400
+    finally:
+        await db_session.close()
+
+
+@app.route('/usuarios/<int:id_usuario>', methods=['PUT'])
+async def put_usuario(id_usuario):
+    """
+            Editar usuarios
+
+            ### Endpoint:
+                PUT /usuarios/<id_user>
+
+            ### Parâmetros:
+            - `id_user` **(str)**: **string para ser convertida a inteiro**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**
+    """
+    db_session = async_session()
+    try:
+        usuario = (await db_session.execute(select(Usuario).where(Usuario.id_usuario == id_usuario))).scalar()
+
+        if usuario is None:
+            return jsonify({"mensagem": "usuario não encontrado."})
+
+        dados_usuario = await request.get_json()
+        # Captura os valores dos campos do formulário
+        usuario.nome = dados_usuario['nome']
+        usuario.CPF = dados_usuario["CPF"]
+        usuario.endereco = dados_usuario["endereco"]
+
+        await db_session.run_sync(usuario.save)
+        return jsonify({'result': 'Usuario editado com sucesso!'}), 200
+
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'mensagem': 'Error. (faltam informações ou informações corretas)'}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+@app.route('/usuarios/<int:id_usuario>', methods=['DELETE'])
+async def delete_usuario(id_usuario):
+    db_session = async_session()
+    try:
+        var_usuario = (await db_session.execute(select(Usuario).where(Usuario.id_usuario == id_usuario))).scalar()
+        await db_session.run_sync(var_usuario.delete)
+
+        return jsonify({"mensagem": "usuario deletado com sucesso!"})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+@app.route('/emprestimos', methods=['POST'])
+async def post_emprestimo():
+    """
+            Cadastrar emprestimos
+
+            ### Endpoint:
+                POST /emprestimos
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**
+    """
+    db_session = async_session()
+    try:
+        dados_emprestimo = await request.get_json()
+
+        # Captura os valores dos campos do formulário
+        data_emprestimo = dados_emprestimo['data_emprestimo']
+        data_devolucao = dados_emprestimo["data_devolucao"]
+        livro_id = dados_emprestimo["livro_id"]
+        usuario_id = dados_emprestimo["usuario_id"]
+
+        # Verifica se os valores "livro_id" e "usuario_id" já estão cadastrados
+        livro = (await db_session.execute(select(Livro).where(Livro.id_livro == livro_id))).scalar()
+        usuario = (await db_session.execute(select(Usuario).where(Usuario.id_usuario == usuario_id))).scalar()
+
+        if not livro:
+            if not usuario:
+                return jsonify({"mensagem": "Livro e Usuário não encontrados."}), 404
+            else:
+                return jsonify({"mensagem": "Livro não encontrado."}), 404
+        if not usuario:
+            return jsonify({"mensagem": "Usuário não encontrado."}), 404
+
+        # Verifica se o livro e o usuário já estão cadastrados em um empréstimo
+        emprestimo_existente = (await db_session.execute(
+            select(Emprestimo).where(
+                (Emprestimo.livro_id == livro_id) &
+                (Emprestimo.usuario_id == usuario_id)
+            )
+        )).scalar()
+
+        if emprestimo_existente:
+            return jsonify({"mensagem": "Este livro já está emprestado para este usuário."}), 409
+
+        # Cria a instância do empréstimo
+        novo_emprestimo = Emprestimo(
+            data_emprestimo=data_emprestimo,
+            data_devolucao=data_devolucao,
+            livro_id=livro_id,
+            usuario_id=usuario_id
+        )
+        db_session.add(novo_emprestimo)
+        await db_session.commit()
+
+        return jsonify({"mensagem": "Empréstimo criado com sucesso!"}), 201
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+
+@app.route('/emprestimos', methods=['GET'])
+async def get_emprestimo():
+    """
+            Consultar emprestimos
+
+            ### Endpoint:
+                GET /emprestimos?limit=<n>&after=<id_emprestimo>
+                GET /emprestimos?stream=true
+
+            ### Parâmetros:
+            - `limit` **(int)**: **quantidade máxima de emprestimos na página (padrão 100, máximo 1000)**
+            - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
+            - `stream` **(bool)**: **devolve todos os emprestimos em um array JSON transmitido em lotes, sem paginação**
+            - `expand` **(str)**: **`livro`, `usuario` ou `livro,usuario`: embute os dados relacionados no lugar dos ids**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com a lista de emprestimos da página e o `next_cursor` (`null` na última página)
+    """
+    db_session = async_session()
+    try:
+        expandir = parametro_expand(request.args)
+        # joinedload traz as relações na mesma consulta; carregamento preguiçoso não funciona em sessão assíncrona
+        consulta = select(Emprestimo).options(*opcoes_expandir(expandir))
+        if quer_stream(request.args):
+            return resposta_em_stream(consulta.order_by(Emprestimo.id_emprestimo),
+                                      lambda emprestimo: emprestimo.serialize(expandir))
+        limite, cursor = parametros_paginacao(request.args)
+        lista, proximo_cursor = await db_session.run_sync(paginar, consulta, Emprestimo.id_emprestimo, limite, cursor)
+        resultados = []
+        for emprestimo in lista:
+            resultados.append(emprestimo.serialize(expandir))
+        return jsonify({"emprestimos": resultados, "next_cursor": proximo_cursor})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+
+@app.route('/emprestimos/<int:id_emprestimo>', methods=['PUT'])
+async def put_emprestimo(id_emprestimo):
+    """
+            Editar emprestimos
+
+            ### Endpoint:
+                PUT /emprestimos/<id_emp>
+
+            ### Parâmetros:
+            - `id_emp` **(str)**: **string para ser convertida a inteiro**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**
+        """
+    db_session = async_session()
+    try:
+        emprestimo = (await db_session.execute(
+            select(Emprestimo).where(Emprestimo.id_emprestimo == id_emprestimo))).scalar()
+
+        if emprestimo is None:
+            return jsonify({"mensagem": "emprestimo não encontrado."})
+
+        dados_emprestimo = await request.get_json()
+        # Captura os valores dos campos do formulário
+        emprestimo.data_emprestimo = dados_emprestimo['data_emprestimo']
+        emprestimo.data_devolucao = dados_emprestimo["data_devolucao"]
+        emprestimo.livro_id = dados_emprestimo["livro_id"]
+        emprestimo.usuario_id = dados_emprestimo["usuario_id"]
+
+        await db_session.run_sync(emprestimo.save)
+
+        return jsonify({"mensagem": "emprestimo atualizado com sucesso!"})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(f"erro no {e}")}), 500
+    finally:
+        await db_session.close()
+
+
+@app.route('/emprestimos/<int:id_emprestimo>', methods=['DELETE'])
+async def delete_emprestimo(id_emprestimo):
+    db_session = async_session()
+    try:
+        var_emprestimo = (await db_session.execute(
+            select(Emprestimo).where(Emprestimo.id_emprestimo == id_emprestimo))).scalar()
+        await db_session.run_sync(var_emprestimo.delete)
+
+        return jsonify({"mensagem": "emprestimo deletado com sucesso!"})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except TypeError:
+        return jsonify({'result': 'Error. Integrity Error (faltam informações ou informações corretas) '}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        await db_session.close()
+
+if __name__ == '__main__':
+    app.run(debug=True)
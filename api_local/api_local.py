@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, redirect
+from flask import Flask, jsonify, request, redirect, Response, stream_with_context
 from flask_pydantic_spec import FlaskPydanticSpec
 from sqlalchemy.exc import IntegrityError
 
@@ -11,6 +11,69 @@ spec = FlaskPydanticSpec('flask',
                          version='1.0.0')
 spec.register(app)
 app.config['SECRET_KEY'] = 'chave_secretinha'
+# Cria as tabelas e o índice de busca que ainda não existirem
+init_db()
+
+# ---------------- PAGINAÇÃO ----------------
+# Os auxiliares abaixo recebem request.args / o corpo já lido, sem depender do request do Flask:
+# api_async.py (Quart) importa os mesmos
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 1000
+
+def parametros_paginacao(args):
+    # Lê `limit` e `after` da query string; valores inválidos geram ValueError (400)
+    limite = int(args.get('limit', LIMITE_PADRAO))
+    cursor = args.get('after')
+    if cursor is not None:
+        cursor = int(cursor)
+    if limite < 1:
+        raise ValueError("limit deve ser maior que zero")
+    return min(limite, LIMITE_MAXIMO), cursor
+
+# ---------------- STREAMING ----------------
+TAMANHO_LOTE_STREAM = 500
+
+def quer_stream(args):
+    return args.get('stream', '').lower() in ('1', 'true', 'sim')
+
+def lote_json(lote, serializar, dumps):
+    # Um lote do array transmitido: os objetos serializados, separados por vírgula
+    return ','.join(dumps(serializar(obj)) for obj in lote)
+
+def resposta_em_stream(consulta, serializar=lambda obj: obj.serialize()):
+    # Lê as linhas em lotes (yield_per) e escreve o array JSON enquanto percorre o cursor,
+    # assim a memória não cresce junto com a tabela
+    def gerar():
+        db_session = local_session()
+        try:
+            resultado = db_session.execute(consulta.execution_options(yield_per=TAMANHO_LOTE_STREAM))
+            yield '['
+            separador = ''
+            for lote in resultado.scalars().partitions():
+                yield separador + lote_json(lote, serializar, app.json.dumps)
+                separador = ','
+            yield ']'
+        finally:
+            db_session.close()
+    return Response(stream_with_context(gerar()), mimetype='application/json')
+
+def parametro_expand(args):
+    # Lê `expand` (ex.: ?expand=livro,usuario); nomes desconhecidos geram ValueError (400)
+    expandir = [nome.strip() for nome in args.get('expand', '').split(',') if nome.strip()]
+    for nome in expandir:
+        if nome not in RELACOES_EMPRESTIMO:
+            raise ValueError(f"expand inválido: {nome}")
+    return expandir
+
+# ---------------- VALIDAÇÃO ----------------
+def ler_usuario(dados_usuario):
+    # (nome, CPF formatado, endereço) do corpo do cadastro, ou None se faltar campo ou o CPF não tiver 11 dígitos
+    nome = dados_usuario['nome']
+    cpf = str(dados_usuario["CPF"])
+    endereco = dados_usuario["endereco"]
+    if not nome or not cpf or not endereco or len(cpf) != 11:
+        return None
+    return nome, '{0}.{1}.{2}-{3}'.format(cpf[:3], cpf[3:6], cpf[6:9], cpf[9:]), endereco
 
 @app.route('/')
 def index():
@@ -71,26 +134,30 @@ def get_livro():
             Consultar livros
 
             ### Endpoint:
-                GET /livros
-                GET /livros/<status>
+                GET /livros?limit=<n>&after=<id_livro>
+                GET /livros?stream=true
 
             ### Parâmetros:
-            - `status` **(str)**: **string para ser convertida a boolean**
+            - `limit` **(int)**: **quantidade máxima de livros na página (padrão 100, máximo 1000)**
+            - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
+            - `stream` **(bool)**: **devolve todos os livros em um array JSON transmitido em lotes, sem paginação**
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
 
             ### Retorna:
-            - **JSON** com a lista de livros e dados
-            - **JSON** com a lista de livros e dados que possuam o `status` igual ao recebido de parâmetro
+            - **JSON** com a lista de livros da página e o `next_cursor` (`null` na última página)
         """
     db_session = local_session()
     try:
-        lista = db_session.execute(select(Livro)).scalars().all()
+        if quer_stream(request.args):
+            return resposta_em_stream(select(Livro).order_by(Livro.id_livro))
+        limite, cursor = parametros_paginacao(request.args)
+        lista, proximo_cursor = paginar(db_session, select(Livro), Livro.id_livro, limite, cursor)
         resultados = []
         for livro in lista:
             resultados.append(livro.serialize())
-        return jsonify(resultados)
+        return jsonify({"livros": resultados, "next_cursor": proximo_cursor})
     except ValueError:
         return jsonify({"mensagem": "Formato inválido."}), 400
     except TypeError:
@@ -101,6 +168,40 @@ def get_livro():
         db_session.close()
 
 
+@app.route('/livros/busca', methods=['GET'])
+def busca_livro():
+    """
+            Buscar livros por texto
+
+            ### Endpoint:
+                GET /livros/busca?q=<termos>&limit=<n>
+
+            ### Parâmetros:
+            - `q` **(str)**: **palavras procuradas no título, autor e resumo**
+            - `limit` **(int)**: **quantidade máxima de livros (padrão 100, máximo 1000)**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com a lista de livros encontrados, do mais relevante para o menos relevante
+        """
+    db_session = local_session()
+    try:
+        termo = request.args.get('q', '').strip()
+        if not termo:
+            return jsonify({"mensagem": "Informe o parâmetro q."}), 400
+        limite, _ = parametros_paginacao(request.args)
+        lista = buscar_livros(db_session, termo, limite)
+        return jsonify({"livros": [livro.serialize() for livro in lista]})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
+
 @app.route('/livros/<int:id_livro>', methods=['PUT'])
 def put_livro(id_livro):
     """
@@ -185,14 +286,11 @@ def post_usuario():
     try:
         dados_usuario = request.get_json()
         # Captura os valores dos campos do formulário
-        nome = dados_usuario['nome']
-        CPF = dados_usuario["CPF"]
-        endereco = dados_usuario["endereco"]
-        cpf = str(CPF)
-        if not nome or not cpf or not endereco or len(cpf) != 11:
+        usuario = ler_usuario(dados_usuario)
+        if usuario is None:
             return jsonify({'result': 'Error. Integrity Error (faltam informações) '}), 400
         else:
-            cpf_f = '{0}.{1}.{2}-{3}'.format(cpf[:3], cpf[3:6], cpf[6:9], cpf[9:])
+            nome, cpf_f, endereco = usuario
             post = Usuario(nome=nome, CPF=cpf_f, endereco=endereco)
             post.save(db_session)
             db_session.close()
@@ -211,26 +309,33 @@ def post_usuario():
 @app.route('/usuarios', methods=['GET'])
 def get_usuario():
     """
-        Consultar emprestimos
+        Consultar usuarios
 
         ### Endpoint:
-            GET /emprestimos
+            GET /usuarios?limit=<n>&after=<id_usuario>
+
+        ### Parâmetros:
+        - `limit` **(int)**: **quantidade máxima de usuarios na página (padrão 100, máximo 1000)**
+        - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
 
         ### Erros possíveis:
         - **Bad Request**: *status code* **400**
 
         ### Retorna:
-        - **JSON** com a lista de emprestimos
+        - **JSON** com a lista de usuarios da página e o `next_cursor` (`null` na última página)
     """
     db_session = local_session()
     try:
-        lista = db_session.execute(select(Usuario)).scalars().all()
+        limite, cursor = parametros_paginacao(request.args)
+        lista, proximo_cursor = paginar(db_session, select(Usuario), Usuario.id_usuario, limite, cursor)
         resultados = []
         for usuario in lista:
             resultados.append(usuario.serialize())
-        return jsonify(resultados)
+        return jsonify({"usuarios": resultados, "next_cursor": proximo_cursor})
     except ValueError:
-        return jsonify({"mensagem": "formato invalido"})
+        return jsonify({"mensagem": "formato invalido"}), 400
+    finally:
+        db_session.close()
 
 
 @app.route('/usuarios/<int:id_usuario>', methods=['PUT'])
@@ -372,21 +477,34 @@ def get_emprestimo():
             Consultar emprestimos
 
             ### Endpoint:
-                GET /emprestimos
+                GET /emprestimos?limit=<n>&after=<id_emprestimo>
+                GET /emprestimos?stream=true
+
+            ### Parâmetros:
+            - `limit` **(int)**: **quantidade máxima de emprestimos na página (padrão 100, máximo 1000)**
+            - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
+            - `stream` **(bool)**: **devolve todos os emprestimos em um array JSON transmitido em lotes, sem paginação**
+            - `expand` **(str)**: **`livro`, `usuario` ou `livro,usuario`: embute os dados relacionados no lugar dos ids**
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
 
             ### Retorna:
-            - **JSON** com a lista de emprestimos
+            - **JSON** com a lista de emprestimos da página e o `next_cursor` (`null` na última página)
     """
     db_session = local_session()
     try:
-        lista = db_session.execute(select(Emprestimo)).scalars().all()
+        expandir = parametro_expand(request.args)
+        consulta = select(Emprestimo).options(*opcoes_expandir(expandir))
+        if quer_stream(request.args):
+            return resposta_em_stream(consulta.order_by(Emprestimo.id_emprestimo),
+                                      lambda emprestimo: emprestimo.serialize(expandir))
+        limite, cursor = parametros_paginacao(request.args)
+        lista, proximo_cursor = paginar(db_session, consulta, Emprestimo.id_emprestimo, limite, cursor)
         resultados = []
         for emprestimo in lista:
-            resultados.append(emprestimo.serialize())
-        return jsonify(resultados)
+            resultados.append(emprestimo.serialize(expandir))
+        return jsonify({"emprestimos": resultados, "next_cursor": proximo_cursor})
     except ValueError:
         return jsonify({"mensagem": "Formato inválido."}), 400
     except TypeError:
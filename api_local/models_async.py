@@ -0,0 +1,26 @@
+# models_async.py
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from models_local import PERFIL_SQLITE, POOL_SQLITE
+
+
+# Mesma engine de models_local.py, mas com o driver aiosqlite: as consultas rodam em uma thread do driver
+# e o loop de eventos continua atendendo outras requisições enquanto espera o banco
+def criar_engine_async(url, perfil=PERFIL_SQLITE, pool=POOL_SQLITE):
+    nova_engine = create_async_engine(url, poolclass=AsyncAdaptedQueuePool, **pool)
+
+    @event.listens_for(nova_engine.sync_engine, 'connect')
+    def aplicar_perfil(conexao_dbapi, registro):
+        cursor = conexao_dbapi.cursor()
+        for pragma, valor in perfil.items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
+        cursor.close()
+
+    return nova_engine
+
+
+engine_async = criar_engine_async('sqlite+aiosqlite:///banco_livro.db')
+# expire_on_commit=False: depois do commit os objetos continuam legíveis sem um novo SELECT (que exigiria await)
+async_session = async_sessionmaker(engine_async, expire_on_commit=False)
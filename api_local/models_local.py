@@ -1,9 +1,42 @@
 # models_livro.py
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
-from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base, relationship
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, select, text, event
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base, relationship, joinedload
+from sqlalchemy.pool import QueuePool
+import os
+
+# Perfil do SQLite aplicado em toda conexão nova; cada valor pode ser trocado por variável de ambiente.
+# WAL deixa leitores e o escritor trabalharem ao mesmo tempo, busy_timeout espera o lock em vez de falhar
+# com "database is locked" e synchronous=NORMAL (seguro com WAL) evita um fsync a cada commit
+PERFIL_SQLITE = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024)),  # negativo = KiB
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+# Pool fixo de conexões reaproveitadas: cada conexão guarda o próprio cache de páginas e o mmap,
+# e o limite evita abrir mais conexões do que threads atendendo requisições
+POOL_SQLITE = {
+    'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', 8)),
+    'max_overflow': int(os.environ.get('SQLITE_POOL_OVERFLOW', 4)),
+    'pool_timeout': 30,
+}
+
+def criar_engine(url, perfil=PERFIL_SQLITE, pool=POOL_SQLITE):
+    nova_engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=QueuePool, **pool)
+
+    @event.listens_for(nova_engine, 'connect')
+    def aplicar_perfil(conexao_dbapi, registro):
+        cursor = conexao_dbapi.cursor()
+        for pragma, valor in perfil.items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
+        cursor.close()
+
+    return nova_engine
 
 # Configuração do banco de dados
-engine = create_engine('sqlite:///banco_livro.db', connect_args={"check_same_thread": False})
+engine = criar_engine('sqlite:///banco_livro.db')
 local_session = scoped_session(sessionmaker(bind=engine))
 
 Base = declarative_base()
@@ -14,7 +47,7 @@ class Livro(Base):
     titulo = Column(String, nullable=False, index=True)
     autor = Column(String, nullable=False, index=True)
     ISBN = Column(String(13), nullable=False, index=True)
-    resumo = Column(String, index=True)
+    resumo = Column(String)
 
     def __repr__(self):
         return f'<Livro(Título={self.titulo}, id{self.id_livro})>'
@@ -22,6 +55,8 @@ class Livro(Base):
     def save(self, db_session):
         try:
             db_session.add(self)
+            db_session.flush()
+            indexar_livro(db_session, self)
             db_session.commit()
         except:
             db_session.rollback()
@@ -29,6 +64,7 @@ class Livro(Base):
 
     def delete(self, db_session):
         try:
+            desindexar_livro(db_session, self.id_livro)
             db_session.delete(self)
             db_session.commit()
         except:
@@ -112,7 +148,7 @@ class Emprestimo(Base):
             db_session.rollback()
             raise
 
-    def serialize(self):
+    def serialize(self, expandir=()):
         var_emprestimo = {
             'id_emprestimo': self.id_emprestimo,
             'data_emprestimo': self.data_emprestimo,
@@ -120,11 +156,70 @@ class Emprestimo(Base):
             'livro': self.livro_id,
             'usuario': self.usuario_id
         }
+        # `expandir` troca os ids pelos dados do livro/usuário (carregados com opcoes_expandir)
+        if 'livro' in expandir:
+            var_emprestimo['livro'] = self.livros.serialize() if self.livros else None
+        if 'usuario' in expandir:
+            var_emprestimo['usuario'] = self.usuarios.serialize() if self.usuarios else None
         return var_emprestimo
 
+# Relacionamentos de Emprestimo que podem ser embutidos na resposta (?expand=livro,usuario)
+RELACOES_EMPRESTIMO = {'livro': Emprestimo.livros, 'usuario': Emprestimo.usuarios}
+
+def opcoes_expandir(expandir):
+    # joinedload: livro e usuário vêm na mesma consulta dos empréstimos, sem N+1
+    return [joinedload(RELACOES_EMPRESTIMO[nome]) for nome in expandir]
+
+# Busca textual: tabela FTS5 com titulo, autor e resumo, mantida junto com Livro.save/delete
+def indexar_livro(db_session, livro):
+    desindexar_livro(db_session, livro.id_livro)
+    db_session.execute(
+        text("INSERT INTO livros_fts (rowid, titulo, autor, resumo) VALUES (:id, :titulo, :autor, :resumo)"),
+        {"id": livro.id_livro, "titulo": livro.titulo, "autor": livro.autor, "resumo": livro.resumo or ''}
+    )
+
+def desindexar_livro(db_session, id_livro):
+    db_session.execute(text("DELETE FROM livros_fts WHERE rowid = :id"), {"id": id_livro})
+
+def buscar_livros(db_session, termo, limite):
+    # Cada palavra vira um prefixo entre aspas para que a sintaxe do FTS5 não quebre a consulta
+    termos = ' '.join('"%s"*' % palavra.replace('"', '""') for palavra in termo.split())
+    consulta = select(Livro).from_statement(text(
+        "SELECT livros.* FROM livros_fts JOIN livros ON livros.id_livro = livros_fts.rowid "
+        "WHERE livros_fts MATCH :termos "
+        "ORDER BY bm25(livros_fts, 10.0, 5.0, 1.0) LIMIT :limite"
+    ))
+    return db_session.execute(consulta, {"termos": termos, "limite": limite}).scalars().all()
+
+# Paginação por chave (keyset): o custo de cada página não depende da profundidade
+def paginar(db_session, consulta, coluna_id, limite, cursor=None):
+    if cursor is not None:
+        consulta = consulta.where(coluna_id > cursor)
+    consulta = consulta.order_by(coluna_id).limit(limite + 1)
+    itens = db_session.execute(consulta).scalars().all()
+    proximo_cursor = None
+    if len(itens) > limite:
+        itens = itens[:limite]
+        proximo_cursor = getattr(itens[-1], coluna_id.key)
+    return itens, proximo_cursor
+
 # Função para criar as tabelas
 def init_db():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conexao:
+        # O B-tree de resumo saiu do modelo (não serve para busca por palavra), mas create_all não apaga
+        # índices de bancos já criados
+        conexao.execute(text('DROP INDEX IF EXISTS ix_livros_resumo'))
+        existe = conexao.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'livros_fts'")).first()
+        if not existe:
+            conexao.execute(text(
+                "CREATE VIRTUAL TABLE livros_fts USING fts5("
+                "titulo, autor, resumo, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+            conexao.execute(text(
+                "INSERT INTO livros_fts (rowid, titulo, autor, resumo) "
+                "SELECT id_livro, titulo, autor, coalesce(resumo, '') FROM livros"
+            ))
 
 
 if __name__ == '__main__':
@@ -1,10 +1,26 @@
-from flask import Flask, jsonify, request, redirect
+from flask import Flask, jsonify, request, redirect, Response, stream_with_context, g
 from flask_pydantic_spec import FlaskPydanticSpec
 from sqlalchemy.exc import IntegrityError
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, create_access_token
+from sqlalchemy.orm.exc import StaleDataError
+from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, get_jwt, create_access_token
 from functools import wraps
-from models_local import Usuario, Livro, local_session, init_db, Emprestimo
-from sqlalchemy import select
+import time
+from datetime import timedelta, datetime, timezone, date
+from models_local import Usuario, Livro, local_session, init_db, Emprestimo, paginar, buscar_livros, \
+    opcoes_expandir, RELACOES_EMPRESTIMO, inserir_livros, isbns_cadastrados, engine, versoes_tabelas, \
+    ouvintes_alteracao, emitir_token_renovacao, usar_token_renovacao, TokenRevogado, revogar_familia, agora_utc, \
+    violacao_integridade, registrar_emprestimo, registrar_devolucao, ajustar_exemplares, ler_data, listar_atrasados, \
+    EstatisticaLivro, EstatisticaUsuario, EstatisticaDia, reconstruir_estatisticas, formatar_data, \
+    ExemplarIndisponivel, limpar_tokens_revogados
+from cache_respostas import CacheLRU
+from senhas import SobrecargaSenha
+from filtro_bloom import FiltroBloom
+import threading
+import json
+import csv
+import io
+import zlib
+from sqlalchemy import select, func
 
 app = Flask(__name__)
 spec = FlaskPydanticSpec('flask',
@@ -12,23 +28,322 @@ spec = FlaskPydanticSpec('flask',
                          version='1.0.0')
 spec.register(app)
 app.config["JWT_SECRET_KEY"] = "senha_SECRETINHA"
+# Validade dos refresh tokens emitidos no /login e renovados em /token/refresh
+app.config["REFRESH_TOKEN_VALIDADE"] = timedelta(days=30)
+# Tamanho do filtro de Bloom da denylist, de quanto em quanto tempo ele busca revogações feitas
+# por outros processos e de quanto em quanto tempo é refeito só com as revogações ainda não vencidas
+app.config["REVOGACAO_CAPACIDADE"] = 100_000
+app.config["REVOGACAO_SINCRONIZAR_A_CADA"] = 5
+app.config["REVOGACAO_RECONSTRUIR_A_CADA"] = 3600
+# Cache de respostas das leituras: qualquer objeto com obter/renovar/guardar/invalidar/estatisticas
+# (ex.: cache_respostas.SemCache() para desligar). O ttl é o atraso máximo para uma escrita feita por
+# outro worker aparecer; as deste processo invalidam o cache no commit
+app.config["CACHE_RESPOSTAS"] = CacheLRU(limite_bytes=32 * 1024 * 1024, ttl=5)
 jwt = JWTManager(app)
+# Cria as tabelas e o índice de busca que ainda não existirem
+init_db()
+
+# ---------------- REVOGAÇÃO DE TOKENS ----------------
+# O filtro de Bloom em memória responde "com certeza não revogado" sem I/O para quase todo token;
+# só quando ele diz "talvez" a tabela tokens_revogados é consultada
+class Denylist:
+    def __init__(self, capacidade, intervalo, intervalo_reconstrucao):
+        self.capacidade = capacidade
+        self.filtro = FiltroBloom(capacidade)
+        self.intervalo = intervalo
+        self.intervalo_reconstrucao = intervalo_reconstrucao
+        self.ultimo_id = 0
+        self.proxima_sincronizacao = 0.0
+        self.proxima_reconstrucao = 0.0
+        self._lock = threading.Lock()
+
+    def sincronizar(self, forcar=False):
+        # Acrescenta ao filtro os jtis revogados desde a última leitura (inclusive por outros processos)
+        agora = time.monotonic()
+        if not forcar and agora < self.proxima_sincronizacao:
+            return
+        with self._lock:
+            # Outra thread pode ter sincronizado enquanto esta esperava a trava
+            if not forcar and agora < self.proxima_sincronizacao:
+                return
+            if agora >= self.proxima_reconstrucao or self.filtro.quantidade >= self.filtro.capacidade:
+                self._reconstruir()
+                self.proxima_reconstrucao = agora + self.intervalo_reconstrucao
+            else:
+                # Conexão própria: fechar a scoped_session aqui desanexaria os objetos do handler em andamento
+                with engine.connect() as conexao:
+                    novos = conexao.execute(
+                        select(TokenRevogado.id_revogacao, TokenRevogado.jti)
+                        .where(TokenRevogado.id_revogacao > self.ultimo_id, TokenRevogado.expira_em > agora_utc())
+                        .order_by(TokenRevogado.id_revogacao)
+                    ).all()
+                for id_revogacao, jti in novos:
+                    self.filtro.adicionar(jti)
+                    self.ultimo_id = id_revogacao
+            self.proxima_sincronizacao = agora + self.intervalo
+
+    def _reconstruir(self):
+        # Um filtro de Bloom só cresce: apaga as revogações vencidas e monta um filtro novo com as que
+        # restam, maior que a capacidade configurada se elas não couberem nela. Chamada com a trava
+        with engine.begin() as conexao:
+            limpar_tokens_revogados(conexao)
+            vivos = conexao.execute(
+                select(TokenRevogado.id_revogacao, TokenRevogado.jti)
+                .where(TokenRevogado.expira_em > agora_utc())
+                .order_by(TokenRevogado.id_revogacao)
+            ).all()
+            ultimo_id = conexao.execute(select(func.max(TokenRevogado.id_revogacao))).scalar() or 0
+        filtro = FiltroBloom(max(self.capacidade, 2 * len(vivos)))
+        for _, jti in vivos:
+            filtro.adicionar(jti)
+        self.filtro = filtro
+        self.ultimo_id = ultimo_id
+
+    def revogado(self, jti):
+        self.sincronizar()
+        if jti not in self.filtro:
+            return False
+        with engine.connect() as conexao:
+            return conexao.execute(select(TokenRevogado.id_revogacao).where(TokenRevogado.jti == jti)).first() is not None
+
+    def revogar(self, db_session, jti, expira_em):
+        db_session.add(TokenRevogado(jti=jti, expira_em=expira_em))
+        db_session.commit()
+        # Com a trava: uma reconstrução em andamento não troca o filtro por um que ainda não tem este jti
+        with self._lock:
+            self.filtro.adicionar(jti)
+
+denylist = Denylist(app.config["REVOGACAO_CAPACIDADE"], app.config["REVOGACAO_SINCRONIZAR_A_CADA"],
+                    app.config["REVOGACAO_RECONSTRUIR_A_CADA"])
+
+def chave_papel(id_usuario, papel_versao):
+    # Entrada da denylist que revoga de uma vez todos os access tokens emitidos com esta versão de papel
+    return f'papel:{id_usuario}:{papel_versao}'
+
+def revogar_papel(db_session, usuario):
+    # Chamada antes de trocar o papel (ou apagar o usuário), com a versão ainda gravada; entra no mesmo
+    # commit da alteração. Vale até o último token dessa versão expirar
+    validade = app.config["JWT_ACCESS_TOKEN_EXPIRES"] or app.config["REFRESH_TOKEN_VALIDADE"]
+    db_session.add(TokenRevogado(jti=chave_papel(usuario.id_usuario, usuario.papel_versao),
+                                 expira_em=agora_utc() + validade))
+
+@jwt.token_in_blocklist_loader
+def token_revogado(jwt_header, jwt_payload):
+    # O token cai pelo próprio jti (logout) ou pela versão de papel com que foi emitido (troca de papel)
+    chave = chave_papel(jwt_payload["sub"], jwt_payload.get("papel_versao"))
+    return denylist.revogado(jwt_payload["jti"]) or denylist.revogado(chave)
+
+# ---------------- USUÁRIO AUTENTICADO ----------------
+def usuario_atual():
+    # Carrega o usuário do token no máximo uma vez por requisição e guarda em flask.g;
+    # usa a sessão da thread (scoped_session), a mesma que os handlers recebem de local_session()
+    if 'usuario_atual' not in g:
+        db_session = local_session()
+        g.usuario_atual = db_session.execute(
+            select(Usuario).where(Usuario.id_usuario == int(get_jwt_identity()))
+        ).scalar()
+    return g.usuario_atual
 
 # ---------------- DECORADOR ADMIN ----------------
+# O papel viaja no token (claim "papel") e a autorização não consulta o banco. Trocar o papel de um usuário
+# (ou apagá-lo) grava chave_papel da versão antiga na denylist, no mesmo commit: os tokens emitidos antes
+# passam a receber 401 e o cliente faz /token/refresh, que emite um token com o papel novo. No processo que
+# fez a troca isso vale na hora; nos outros workers, em até REVOGACAO_SINCRONIZAR_A_CADA segundos
+def token_de_admin():
+    return get_jwt().get('papel') == 'admin'
+
 def admin_required(fn):
     @wraps(fn)
     @jwt_required()
     def wrapper(*args, **kwargs):
-        db = local_session()
+        if token_de_admin():
+            return fn(*args, **kwargs)
+        return jsonify({"msg": "Acesso negado: apenas administradores"}), 403
+    return wrapper
+
+# ---------------- PAGINAÇÃO ----------------
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 1000
+
+def parametros_paginacao(ler_cursor=int):
+    # Lê `limit` e `after` da query string; valores inválidos geram ValueError (400)
+    limite = int(request.args.get('limit', LIMITE_PADRAO))
+    cursor = request.args.get('after')
+    if cursor is not None:
+        cursor = ler_cursor(cursor)
+    if limite < 1:
+        raise ValueError("limit deve ser maior que zero")
+    return min(limite, LIMITE_MAXIMO), cursor
+
+# ---------------- ETAG ----------------
+def etag_listagem(db_session, tabelas, escopo=None):
+    # A tag combina as versões das tabelas lidas e, nas listagens que variam por usuário, o usuário do token;
+    # a URL completa (limit, after, expand...) já diferencia as representações de cada cliente
+    versoes = versoes_tabelas(db_session, tabelas)
+    etag = '-'.join(f'{tabela}.{versao}' for tabela, versao in zip(tabelas, versoes))
+    return etag if escopo is None else f'{etag}-u{escopo}'
+
+def nao_modificado(etag):
+    # Resposta 304 quando o If-None-Match do cliente ainda corresponde à versão atual
+    if request.if_none_match.contains_weak(etag):
+        resposta = Response(status=304)
+        resposta.set_etag(etag, weak=True)
+        return resposta
+    return None
+
+def com_etag(resposta, etag):
+    resposta.set_etag(etag, weak=True)
+    resposta.headers['Vary'] = 'Authorization'
+    return resposta
+
+def etag_registro(registro):
+    # ETag forte de um registro: a coluna `versao` (version_id_col), também devolvida no JSON
+    return str(registro.versao)
+
+def falha_precondicao(registro=None):
+    # 412 quando o If-Match não bate com a versão atual (ou quando a versão mudou entre a leitura e o
+    # UPDATE, o StaleDataError do ORM); o cliente relê o registro em vez de sobrescrever a outra edição
+    resposta = jsonify({"mensagem": "O registro foi alterado por outra requisição. Leia a versão atual e tente de novo."})
+    resposta.status_code = 412
+    if registro is not None:
+        resposta.set_etag(etag_registro(registro))
+    return resposta
+
+def precondicao_falhou(registro):
+    # Sem If-Match a edição segue incondicional (o UPDATE ainda confere a versão lida nesta requisição)
+    if request.if_match and not request.if_match.contains(etag_registro(registro)):
+        return falha_precondicao(registro)
+    return None
+
+# ---------------- CACHE DE RESPOSTAS ----------------
+def papel_da_requisicao():
+    # Escopo do cache pelo claim do token; o token de um admin rebaixado já foi barrado pela denylist
+    return 'admin' if token_de_admin() else 'usuario'
+
+def versoes_atuais(tabelas):
+    # Conexão própria: fechar a scoped_session aqui desanexaria o usuário que os handlers guardam em g
+    with engine.connect() as conexao:
+        return tuple(versoes_tabelas(conexao, tabelas))
+
+def cache_resposta(tabelas, por_usuario=False):
+    # Guarda o corpo das respostas 200 por rota + query string + papel de quem chama
+    # (e pelo próprio usuário quando a resposta de quem não é admin só mostra os dados dele);
+    # as entradas das tabelas alteradas são descartadas depois de cada commit.
+    # Um acerto dentro do TTL não toca no banco: o papel vem do token e as versões das tabelas só são
+    # relidas quando o TTL da entrada vence (um commit de outro worker não passa pelo after_commit deste)
+    def decorador(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = app.config["CACHE_RESPOSTAS"]
+            papel = papel_da_requisicao()
+            escopo = papel if papel == 'admin' or not por_usuario else f'{papel}:{get_jwt_identity()}'
+            consulta = '&'.join(sorted(request.query_string.decode().split('&')))
+            chave = f'{request.path}?{consulta}#{escopo}'
+            versoes = None
+            em_cache = cache.obter(chave)
+            if em_cache:
+                corpo, cabecalhos, conferir = em_cache
+                if conferir:
+                    versoes = versoes_atuais(tabelas)
+                if not conferir or cache.renovar(chave, versoes):
+                    # make_conditional responde 304 se o If-None-Match bater com o ETag guardado
+                    return Response(corpo, headers=cabecalhos).make_conditional(request)
+            if versoes is None:
+                # Lidas antes do handler: um commit no meio faz a entrada ser descartada na próxima conferência
+                versoes = versoes_atuais(tabelas)
+            resposta = app.make_response(fn(*args, **kwargs))
+            if resposta.status_code == 200 and not resposta.is_streamed:
+                cache.guardar(chave, resposta.get_data(), dict(resposta.headers), tabelas, versoes)
+            return resposta
+        return wrapper
+    return decorador
+
+ouvintes_alteracao.append(lambda tabelas: app.config["CACHE_RESPOSTAS"].invalidar(tabelas))
+
+# ---------------- STREAMING ----------------
+TAMANHO_LOTE_STREAM = 500
+
+def quer_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'sim')
+
+def resposta_em_stream(consulta, serializar=lambda obj: obj.serialize()):
+    # Lê as linhas em lotes (yield_per) e escreve o array JSON enquanto percorre o cursor,
+    # assim a memória não cresce junto com a tabela
+    def gerar():
+        db_session = local_session()
         try:
-            id = get_jwt_identity()
-            usuario = db.execute(select(Usuario).where(Usuario.id_usuario == id)).scalar()
-            if usuario and usuario.papel == 'admin':
-                return fn(*args, **kwargs)
-            return jsonify({"msg": "Acesso negado: apenas administradores"}), 403
+            resultado = db_session.execute(consulta.execution_options(yield_per=TAMANHO_LOTE_STREAM))
+            yield '['
+            separador = ''
+            for lote in resultado.scalars().partitions():
+                pedaco = ','.join(app.json.dumps(serializar(obj)) for obj in lote)
+                yield separador + pedaco
+                separador = ','
+            yield ']'
         finally:
-            db.close()
-    return wrapper
+            db_session.close()
+    return Response(stream_with_context(gerar()), mimetype='application/json')
+
+def parametro_expand():
+    # Lê `expand` (ex.: ?expand=livro,usuario); nomes desconhecidos geram ValueError (400)
+    expandir = [nome.strip() for nome in request.args.get('expand', '').split(',') if nome.strip()]
+    for nome in expandir:
+        if nome not in RELACOES_EMPRESTIMO:
+            raise ValueError(f"expand inválido: {nome}")
+    return expandir
+
+# ---------------- EXPORTAÇÃO ----------------
+TAMANHO_LOTE_EXPORTACAO = 5000
+FORMATOS_EXPORTACAO = ['application/x-ndjson', 'text/csv']
+
+def formato_exportacao():
+    # Sem cabeçalho Accept exporta NDJSON; com Accept incompatível devolve None (406)
+    if not request.headers.get('Accept'):
+        return FORMATOS_EXPORTACAO[0]
+    return request.accept_mimetypes.best_match(FORMATOS_EXPORTACAO)
+
+def comprimir_gzip(pedacos):
+    compressor = zlib.compressobj(wbits=31)  # 31 = cabeçalho gzip
+    for pedaco in pedacos:
+        comprimido = compressor.compress(pedaco)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
+def resposta_exportacao(tabela, formato, nome_arquivo):
+    # Lê tuplas direto do cursor do servidor (stream_results), sem montar objetos do ORM,
+    # e escreve CSV/NDJSON lote a lote; a memória fica constante qualquer que seja o tamanho da tabela
+    colunas = [coluna.name for coluna in tabela.columns]
+
+    def gerar():
+        with engine.connect() as conexao:
+            resultado = conexao.execution_options(stream_results=True, yield_per=TAMANHO_LOTE_EXPORTACAO).execute(
+                select(tabela).order_by(*tabela.primary_key.columns)
+            )
+            if formato == 'text/csv':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerow(colunas)
+                yield buffer.getvalue().encode()
+            for lote in resultado.partitions():
+                buffer = io.StringIO()
+                if formato == 'text/csv':
+                    csv.writer(buffer).writerows(lote)
+                else:
+                    for linha in lote:
+                        buffer.write(json.dumps(dict(zip(colunas, linha)), default=str, ensure_ascii=False))
+                        buffer.write('\n')
+                yield buffer.getvalue().encode()
+
+    extensao = 'csv' if formato == 'text/csv' else 'ndjson'
+    cabecalhos = {
+        'Content-Disposition': f'attachment; filename={nome_arquivo}.{extensao}',
+        'Vary': 'Accept, Accept-Encoding',
+    }
+    corpo = gerar()
+    if request.accept_encodings['gzip']:
+        corpo = comprimir_gzip(corpo)
+        cabecalhos['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(corpo), mimetype=formato, headers=cabecalhos)
 
 @app.route('/')
 def index():
@@ -38,6 +353,12 @@ def index():
     """
     return redirect('/livros')
 
+def criar_access_token(usuario):
+    return create_access_token(
+        identity=str(usuario.id_usuario),
+        additional_claims={"papel": usuario.papel, "papel_versao": usuario.papel_versao}
+    )
+
 @app.route('/login', methods=['POST'])
 def login():
     dados = request.get_json()
@@ -47,10 +368,88 @@ def login():
         try:
             user = db_session.execute(select(Usuario).where(Usuario.nome == nome)).scalar()
             if user and user.check_password(senha):
-                access_token = create_access_token(identity=str(user.id_usuario))
-                return jsonify(access_token=access_token), 200
+                if user.precisa_rehash():
+                    # Hash gravado com algoritmo/custo antigo: refaz com o método configurado
+                    user.set_senha_hash(senha)
+                    user.save(db_session)
+                access_token = criar_access_token(user)
+                refresh_token = emitir_token_renovacao(db_session, user.id_usuario, app.config["REFRESH_TOKEN_VALIDADE"])
+                db_session.commit()
+                return jsonify(access_token=access_token, refresh_token=refresh_token), 200
             return jsonify({"mensagem": "Credenciais inválidas."}), 401
+        except SobrecargaSenha:
+            return jsonify({"mensagem": "Muitos logins simultâneos, tente novamente."}), 503, {"Retry-After": "1"}
+        except Exception as e:
+            return jsonify({"mensagem": str(e)}), 500
+
+@app.route('/token/refresh', methods=['POST'])
+def token_refresh():
+    """
+            Renovar o access token
+
+            ### Endpoint:
+                POST /token/refresh
+
+            ### Corpo da Requisição (JSON):
+            {
+                "refresh_token": "<token recebido no /login ou na última renovação>"
+            }
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+            - **Unauthorized**: *status code* **401** (token inválido, expirado ou já usado)
+
+            ### Retorna:
+            - **JSON** com um novo `access_token` e o próximo `refresh_token` (o enviado deixa de valer)
+    """
+    dados = request.get_json(silent=True) or {}
+    refresh_token = dados.get('refresh_token')
+    if not isinstance(refresh_token, str) or not refresh_token:
+        return jsonify({"mensagem": "Informe o refresh_token."}), 400
+    with local_session() as db_session:
+        try:
+            resultado = usar_token_renovacao(db_session, refresh_token)
+            if resultado is None:
+                return jsonify({"mensagem": "Refresh token inválido ou expirado."}), 401
+            registro, usuario = resultado
+            access_token = criar_access_token(usuario)
+            novo_refresh_token = emitir_token_renovacao(
+                db_session, usuario.id_usuario, app.config["REFRESH_TOKEN_VALIDADE"], registro.familia
+            )
+            db_session.commit()
+            return jsonify(access_token=access_token, refresh_token=novo_refresh_token), 200
         except Exception as e:
+            db_session.rollback()
+            return jsonify({"mensagem": str(e)}), 500
+
+@app.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """
+            Encerrar a sessão
+
+            ### Endpoint:
+                POST /logout
+
+            ### Corpo da Requisição (JSON, opcional):
+            {
+                "refresh_token": "<refresh token da sessão, para revogá-lo também>"
+            }
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**; o access token usado deixa de ser aceito
+    """
+    dados = request.get_json(silent=True) or {}
+    claims = get_jwt()
+    with local_session() as db_session:
+        try:
+            if isinstance(dados.get('refresh_token'), str):
+                revogar_familia(db_session, dados['refresh_token'])
+            expira_em = datetime.fromtimestamp(claims["exp"], timezone.utc).replace(tzinfo=None)
+            denylist.revogar(db_session, claims["jti"], expira_em)
+            return jsonify({"mensagem": "Sessão encerrada."}), 200
+        except Exception as e:
+            db_session.rollback()
             return jsonify({"mensagem": str(e)}), 500
 
 @app.route('/livros', methods=['POST'])
@@ -65,6 +464,7 @@ def post_livro():
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
+            - **Conflict**: *status code* **409** (já existe um livro com este ISBN)
 
             ### Retorna:
             - **JSON** mensagem de **sucesso**
@@ -78,6 +478,8 @@ def post_livro():
         ISBN = dados_livro.get("ISBN")
         resumo = dados_livro.get("resumo")
 
+        exemplares = ler_exemplares(dados_livro)
+
         # Validação de campos obrigatórios
         if not all([titulo, autor, ISBN, resumo]):
             return jsonify({"mensagem": "Todos os campos são obrigatórios"}), 400
@@ -88,43 +490,169 @@ def post_livro():
             autor=autor,
             ISBN=ISBN,
             resumo=resumo,
-            status=True
+            status=exemplares > 0,
+            exemplares=exemplares,
+            exemplares_disponiveis=exemplares
         )
         form_evento.save(db_session)
         db_session.close()
         return jsonify({'result': 'Livro criado com sucesso!'}), 200
+    except IntegrityError:
+        # Índice único de ISBN: cobre também duas requisições simultâneas com o mesmo ISBN
+        return jsonify({"mensagem": "Já existe um livro com este ISBN."}), 409
     except ValueError:
         return jsonify({"mensagem": "formato invalido"}), 400
     finally:
         db_session.close()
 
+def ler_exemplares(dados_livro, padrao=1):
+    # Quantidade de exemplares físicos (opcional, padrão 1); inválida gera ValueError (400)
+    exemplares = dados_livro.get('exemplares', padrao)
+    if isinstance(exemplares, bool) or not isinstance(exemplares, int) or exemplares < 0:
+        raise ValueError("exemplares deve ser um inteiro maior ou igual a zero")
+    return exemplares
+
+TAMANHO_LOTE_BULK = 1000
+
+class CorpoInvalido(ValueError):
+    """JSON malformado no corpo do bulk; `linha` é a linha do corpo (a partir de 1) onde a leitura falhou."""
+
+    def __init__(self, linha, erro):
+        super().__init__(f"JSON inválido na linha {linha}: {erro}")
+        self.linha = linha
+
+def ler_linhas_bulk():
+    # Aceita um array JSON ou NDJSON (um objeto JSON por linha)
+    corpo = request.get_data(as_text=True)
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        linhas = []
+        for numero, linha in enumerate(corpo.splitlines(), 1):
+            if linha.strip():
+                try:
+                    linhas.append(json.loads(linha))
+                except json.JSONDecodeError as erro:
+                    raise CorpoInvalido(numero, erro.msg)
+        return linhas
+    try:
+        linhas = json.loads(corpo)
+    except json.JSONDecodeError as erro:
+        raise CorpoInvalido(erro.lineno, erro.msg)
+    if not isinstance(linhas, list):
+        raise ValueError("o corpo deve ser uma lista de livros")
+    return linhas
+
+def validar_livro(dados_livro):
+    if not isinstance(dados_livro, dict):
+        return None
+    livro = {campo: dados_livro.get(campo) for campo in ('titulo', 'autor', 'ISBN', 'resumo')}
+    if not all(livro.values()) or not all(isinstance(valor, str) for valor in livro.values()):
+        return None
+    if len(livro['ISBN']) > 13:
+        return None
+    try:
+        livro['exemplares'] = livro['exemplares_disponiveis'] = ler_exemplares(dados_livro)
+    except ValueError:
+        return None
+    livro['status'] = livro['exemplares'] > 0
+    return livro
+
+@app.route('/livros/bulk', methods=['POST'])
+@admin_required
+@jwt_required()
+def post_livro_bulk():
+    """
+            Cadastrar livros em lote
+
+            ### Endpoint:
+                POST /livros/bulk
+
+            ### Corpo da Requisição:
+            - array JSON de livros (`application/json`) ou um livro por linha (`application/x-ndjson`)
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400** (corpo que não é uma lista/NDJSON válido; JSON malformado
+              devolve também a `linha` do corpo onde a leitura falhou)
+
+            ### Retorna:
+            - **JSON** com os totais e o resultado de cada linha: `criado` (com `id_livro`),
+              `isbn_duplicado` ou `invalido`
+    """
+    db_session = local_session()
+    try:
+        linhas = ler_linhas_bulk()
+        resultados = []
+        totais = {"criado": 0, "isbn_duplicado": 0, "invalido": 0}
+        isbns_vistos = set()
+        for inicio in range(0, len(linhas), TAMANHO_LOTE_BULK):
+            lote = [(inicio + i, validar_livro(dados)) for i, dados in enumerate(linhas[inicio:inicio + TAMANHO_LOTE_BULK])]
+            existentes = isbns_cadastrados(db_session, [livro['ISBN'] for _, livro in lote if livro])
+            novos = []
+            for numero, livro in lote:
+                if livro is None:
+                    resultados.append({"linha": numero, "status": "invalido"})
+                elif livro['ISBN'] in existentes or livro['ISBN'] in isbns_vistos:
+                    resultados.append({"linha": numero, "status": "isbn_duplicado"})
+                else:
+                    isbns_vistos.add(livro['ISBN'])
+                    novos.append((numero, livro))
+            if novos:
+                ids = inserir_livros(db_session, [livro for _, livro in novos])
+                for (numero, _), id_livro in zip(novos, ids):
+                    if id_livro is None:
+                        # Gravado por outra requisição entre a conferência e o INSERT
+                        resultados.append({"linha": numero, "status": "isbn_duplicado"})
+                    else:
+                        resultados.append({"linha": numero, "status": "criado", "id_livro": id_livro})
+        resultados.sort(key=lambda resultado: resultado['linha'])
+        for resultado in resultados:
+            totais[resultado['status']] += 1
+        return jsonify({"totais": totais, "resultados": resultados}), 200
+    except CorpoInvalido as e:
+        return jsonify({"mensagem": str(e), "linha": e.linha}), 400
+    except ValueError:
+        return jsonify({"mensagem": "formato invalido"}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
 @app.route('/livros', methods=['GET'])
 @jwt_required()
+@cache_resposta(['livros'])
 def get_livro():
     """
             Consultar livros
 
             ### Endpoint:
-                GET /livros
-                GET /livros/<status>
+                GET /livros?limit=<n>&after=<id_livro>
+                GET /livros?stream=true
 
             ### Parâmetros:
-            - `status` **(str)**: **string para ser convertida a boolean**
+            - `limit` **(int)**: **quantidade máxima de livros na página (padrão 100, máximo 1000)**
+            - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
+            - `stream` **(bool)**: **devolve todos os livros em um array JSON transmitido em lotes, sem paginação**
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
+            - **Not Modified**: *status code* **304** (o `ETag` enviado em `If-None-Match` ainda é o atual)
 
             ### Retorna:
-            - **JSON** com a lista de livros e dados
-            - **JSON** com a lista de livros e dados que possuam o `status` igual ao recebido de parâmetro
+            - **JSON** com a lista de livros da página e o `next_cursor` (`null` na última página)
         """
     db_session = local_session()
     try:
-        lista = db_session.execute(select(Livro)).scalars().all()
+        etag = etag_listagem(db_session, ['livros'])
+        resposta = nao_modificado(etag)
+        if resposta:
+            return resposta
+        if quer_stream():
+            return com_etag(resposta_em_stream(select(Livro).order_by(Livro.id_livro)), etag)
+        limite, cursor = parametros_paginacao()
+        lista, proximo_cursor = paginar(db_session, select(Livro), Livro.id_livro, limite, cursor)
         resultados = []
         for livro in lista:
             resultados.append(livro.serialize())
-        return jsonify(resultados)
+        return com_etag(jsonify({"livros": resultados, "next_cursor": proximo_cursor}), etag)
     except ValueError:
         return jsonify({"mensagem": "Formato inválido."}), 400
     except TypeError:
@@ -134,6 +662,46 @@ def get_livro():
     finally:
         db_session.close()
 
+@app.route('/livros/busca', methods=['GET'])
+@jwt_required()
+@cache_resposta(['livros'])
+def busca_livro():
+    """
+            Buscar livros por texto
+
+            ### Endpoint:
+                GET /livros/busca?q=<termos>&limit=<n>
+
+            ### Parâmetros:
+            - `q` **(str)**: **palavras procuradas no título, autor e resumo**
+            - `limit` **(int)**: **quantidade máxima de livros (padrão 100, máximo 1000)**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+            - **Not Modified**: *status code* **304** (o `ETag` enviado em `If-None-Match` ainda é o atual)
+
+            ### Retorna:
+            - **JSON** com a lista de livros encontrados, do mais relevante para o menos relevante
+        """
+    db_session = local_session()
+    try:
+        termo = request.args.get('q', '').strip()
+        if not termo:
+            return jsonify({"mensagem": "Informe o parâmetro q."}), 400
+        etag = etag_listagem(db_session, ['livros'])
+        resposta = nao_modificado(etag)
+        if resposta:
+            return resposta
+        limite, _ = parametros_paginacao()
+        lista = buscar_livros(db_session, termo, limite)
+        return com_etag(jsonify({"livros": [livro.serialize() for livro in lista]}), etag)
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
 @app.route('/livros/<int:id_livro>', methods=['PUT'])
 @admin_required
 @jwt_required()
@@ -146,12 +714,15 @@ def put_livro(id_livro):
 
             ### Parâmetros:
             - `id_livro` **(str)**: **string para ser convertida a inteiro**
+            - `If-Match` **(header, opcional)**: **`versao` lida do livro; só grava se ainda for a atual**
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
+            - **Conflict**: *status code* **409** (`exemplares` menor que a quantidade emprestada, ou ISBN de outro livro)
+            - **Precondition Failed**: *status code* **412** (o livro foi alterado depois da versão enviada)
 
             ### Retorna:
-            - **JSON** mensagem de **sucesso**
+            - **JSON** mensagem de **sucesso**, com a nova versão no `ETag`
         """
     db_session = local_session()
     try:
@@ -161,6 +732,10 @@ def put_livro(id_livro):
         if livro is None:
             return jsonify({"mensagem": "Livro não encontrado."})
 
+        conflito = precondicao_falhou(livro)
+        if conflito:
+            return conflito
+
         dados_livro = request.get_json()
         # Captura os valores dos campos do formulário
         titulo = dados_livro['titulo']
@@ -173,9 +748,24 @@ def put_livro(id_livro):
         livro.ISBN = ISBN
         livro.resumo = resumo
 
+        # `exemplares` (opcional) muda o total em um UPDATE condicional, na mesma transação do save
+        if 'exemplares' in dados_livro:
+            exemplares = ler_exemplares(dados_livro)
+            if not ajustar_exemplares(db_session, id_livro, exemplares):
+                db_session.rollback()
+                return jsonify({"mensagem": "Há mais exemplares emprestados do que o novo total."}), 409
+            # O UPDATE condicional não passa pelo ORM; repetir o total no objeto faz o save incrementar a versão
+            livro.exemplares = exemplares
+
         # Save changes to the database
         livro.save(db_session)
-        return jsonify({"mensagem": "Livro atualizado com sucesso!"})
+        resposta = jsonify({"mensagem": "Livro atualizado com sucesso!"})
+        resposta.set_etag(etag_registro(livro))
+        return resposta
+    except StaleDataError:
+        return falha_precondicao()
+    except IntegrityError:
+        return jsonify({"mensagem": "Já existe um livro com este ISBN."}), 409
     except ValueError:
         return jsonify({"mensagem": "Formato inválido."}), 400
     except TypeError:
@@ -193,6 +783,9 @@ def delete_livro(id_livro):
         var_livro = db_session.execute(var_livro).scalar()
         var_livro.delete(db_session)
         return jsonify({"mensagem": "Livro deletado com sucesso!"})
+    except IntegrityError:
+        # Com as chaves estrangeiras ativas, o banco não deixa apagar quem ainda é referenciado por empréstimos
+        return jsonify({"mensagem": "Livro possui empréstimos e não pode ser deletado."}), 409
     except ValueError:
         return jsonify({"mensagem": "Formato inválido."}), 400
     except TypeError:
@@ -262,6 +855,9 @@ def post_usuario():
     except IntegrityError:
         db_session.rollback()
         return jsonify({"mensagem": "Erro de integridade (CPF duplicado ou inválido)."}), 400
+    except SobrecargaSenha:
+        db_session.rollback()
+        return jsonify({"mensagem": "Servidor ocupado, tente novamente."}), 503, {"Retry-After": "1"}
     except Exception as e:
         db_session.rollback()
         return jsonify({"mensagem": f"Erro interno: {str(e)}"}), 500
@@ -271,6 +867,7 @@ def post_usuario():
 
 @app.route('/usuarios', methods=['GET'])
 @jwt_required()
+@cache_resposta(['usuarios'], por_usuario=True)
 def get_usuario():
     """
         Consultar usuários
@@ -278,37 +875,45 @@ def get_usuario():
         ### Endpoint:
             GET /usuarios
 
+        ### Parâmetros:
+        - `limit` **(int)**: **quantidade máxima de usuários na página (apenas admin)**
+        - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior (apenas admin)**
+
         ### Comportamento:
-        - Usuários com papel 'admin' podem visualizar todos os usuários.
+        - Usuários com papel 'admin' podem visualizar todos os usuários, paginados.
         - Usuários com papel 'cliente' ou 'usuario' podem visualizar apenas seus próprios dados.
 
         ### Erros possíveis:
         - **Bad Request**: *status code* **400**
         - **Forbidden**: *status code* **403** (caso o usuário não tenha permissão)
         - **Internal Server Error**: *status code* **500**
+        - **Not Modified**: *status code* **304** (o `ETag` enviado em `If-None-Match` ainda é o atual)
 
         ### Retorna:
         - **JSON** com a lista de usuários (para admin) ou dados do usuário autenticado (para cliente/usuario)
     """
     with local_session() as db_session:
         try:
-            # Obtém o ID do usuário autenticado a partir do JWT
-            current_user_id = get_jwt_identity()
-            # Busca o usuário autenticado no banco de dados para verificar o papel
-            usuario_autenticado = db_session.execute(
-                select(Usuario).where(Usuario.id_usuario == current_user_id)
-            ).scalars().first()
+            etag = etag_listagem(db_session, ['usuarios'], get_jwt_identity())
+            resposta = nao_modificado(etag)
+            if resposta:
+                return resposta
+
+            # Usuário autenticado, carregado uma única vez por requisição
+            usuario_autenticado = usuario_atual()
             if not usuario_autenticado:
                 return jsonify({"mensagem": "Usuário não encontrado."}), 404
 
             # Verifica o papel do usuário
             if usuario_autenticado.papel == 'admin':
-                # Admin pode ver todos os usuários
-                lista = db_session.execute(select(Usuario)).scalars().all()
-                return jsonify([usuario.serialize() for usuario in lista])
+                # Admin pode ver todos os usuários, página por página
+                limite, cursor = parametros_paginacao()
+                lista, proximo_cursor = paginar(db_session, select(Usuario), Usuario.id_usuario, limite, cursor)
+                return com_etag(jsonify({"usuarios": [usuario.serialize() for usuario in lista],
+                                         "next_cursor": proximo_cursor}), etag)
             else:
                 # Usuários normais (cliente ou usuario) veem apenas os seus próprios dados
-                return jsonify(usuario_autenticado.serialize())
+                return com_etag(jsonify(usuario_autenticado.serialize()), etag)
 
         except ValueError:
             return jsonify({"mensagem": "Formato inválido."}), 400
@@ -329,12 +934,15 @@ def put_usuario_admin(id_usuario):
 
             ### Parâmetros:
             - `id_user` **(str)**: **string para ser convertida a inteiro**
+            - `papel` **(str, opcional no corpo)**: **novo papel; tokens emitidos antes da troca passam a receber 401**
+            - `If-Match` **(header, opcional)**: **`versao` lida do usuário; só grava se ainda for a atual**
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
+            - **Precondition Failed**: *status code* **412** (o usuário foi alterado depois da versão enviada)
 
             ### Retorna:
-            - **JSON** mensagem de **sucesso**
+            - **JSON** mensagem de **sucesso**, com a nova versão no `ETag`
     """
     with local_session() as db_session:
         try:
@@ -344,6 +952,10 @@ def put_usuario_admin(id_usuario):
             if usuario is None:
                 return jsonify({"mensagem": "usuario não encontrado."})
 
+            conflito = precondicao_falhou(usuario)
+            if conflito:
+                return conflito
+
             dados_usuario = request.get_json()
             # Captura os valores dos campos do formulário
             nome = dados_usuario['nome']
@@ -357,9 +969,9 @@ def put_usuario_admin(id_usuario):
             # Formata CPF
             cpf_formatado = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
 
-            # Verifica duplicidade de CPF
+            # Verifica duplicidade de CPF (em outro usuário: manter o próprio CPF não é conflito)
             usuario_existente = db_session.execute(
-                select(Usuario).where(Usuario.CPF == cpf_formatado)
+                select(Usuario).where(Usuario.CPF == cpf_formatado, Usuario.id_usuario != usuario.id_usuario)
             ).scalar()
             if usuario_existente:
                 return jsonify({"mensagem": "Usuário com este CPF já existe."}), 400
@@ -367,10 +979,21 @@ def put_usuario_admin(id_usuario):
             usuario.nome = nome
             usuario.CPF = cpf_formatado
             usuario.endereco = endereco
+            papel_trocado = 'papel' in dados_usuario and dados_usuario['papel'] != usuario.papel
+            if papel_trocado:
+                # Revoga os tokens da versão atual e incrementa a versão, tudo no commit do save
+                revogar_papel(db_session, usuario)
+                usuario.set_papel(dados_usuario['papel'])
 
             usuario.save(db_session)
-            return jsonify({'result': 'Usuario editado com sucesso!'}), 200
-
+            if papel_trocado:
+                denylist.sincronizar(forcar=True)
+            resposta = jsonify({'result': 'Usuario editado com sucesso!'})
+            resposta.set_etag(etag_registro(usuario))
+            return resposta, 200
+
+        except StaleDataError:
+            return falha_precondicao()
         except ValueError:
             return jsonify({"mensagem": "Formato inválido."}), 400
         except TypeError:
@@ -400,15 +1023,15 @@ def put_usuario():
     """
     with local_session() as db_session:
         try:
-            # Obtém o ID do usuário autenticado a partir do JWT
-            current_user_id = get_jwt_identity()
-            # Busca o usuário autenticado no banco de dados para verificar o papel
-            usuario_autenticado = db_session.execute(
-                select(Usuario).where(Usuario.CPF == current_user_id)
-            ).scalars().first()
+            # Usuário autenticado, carregado uma única vez por requisição
+            usuario_autenticado = usuario_atual()
             if not usuario_autenticado:
                 return jsonify({"mensagem": "Usuário não encontrado."}), 404
 
+            conflito = precondicao_falhou(usuario_autenticado)
+            if conflito:
+                return conflito
+
             dados_usuario = request.get_json()
             # Captura os valores dos campos do formulário
             nome = dados_usuario['nome']
@@ -422,9 +1045,9 @@ def put_usuario():
             # Formata CPF
             cpf_formatado = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
 
-            # Verifica duplicidade de CPF
+            # Verifica duplicidade de CPF (em outro usuário: manter o próprio CPF não é conflito)
             usuario_existente = db_session.execute(
-                select(Usuario).where(Usuario.CPF == cpf_formatado)
+                select(Usuario).where(Usuario.CPF == cpf_formatado, Usuario.id_usuario != usuario_autenticado.id_usuario)
             ).scalar()
             if usuario_existente:
                 return jsonify({"mensagem": "Usuário com este CPF já existe."}), 400
@@ -434,8 +1057,12 @@ def put_usuario():
             usuario_autenticado.endereco = endereco
 
             usuario_autenticado.save(db_session)
-            return jsonify({'result': 'Usuario editado com sucesso!'}), 200
+            resposta = jsonify({'result': 'Usuario editado com sucesso!'})
+            resposta.set_etag(etag_registro(usuario_autenticado))
+            return resposta, 200
 
+        except StaleDataError:
+            return falha_precondicao()
         except ValueError:
             return jsonify({"mensagem": "Formato inválido."}), 400
         except TypeError:
@@ -451,9 +1078,15 @@ def delete_usuario(id_usuario):
     try:
         var_usuario = select(Usuario).where(Usuario.id_usuario == id_usuario)
         var_usuario = db_session.execute(var_usuario).scalar()
+        # Os access tokens ainda válidos do usuário apagado saem junto (mesmo commit do delete)
+        revogar_papel(db_session, var_usuario)
         var_usuario.delete(db_session)
+        denylist.sincronizar(forcar=True)
 
         return jsonify({"mensagem": "usuario deletado com sucesso!"})
+    except IntegrityError:
+        # Com as chaves estrangeiras ativas, o banco não deixa apagar quem ainda é referenciado por empréstimos
+        return jsonify({"mensagem": "Usuário possui empréstimos e não pode ser deletado."}), 409
     except ValueError:
         return jsonify({"mensagem": "Formato inválido."}), 400
     except TypeError:
@@ -474,61 +1107,48 @@ def post_emprestimo():
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
+            - **Not Found**: *status code* **404** (livro ou usuário inexistente)
+            - **Conflict**: *status code* **409** (livro já emprestado para este usuário e ainda não devolvido,
+              ou nenhum exemplar disponível)
 
             ### Retorna:
             - **JSON** mensagem de **sucesso**
     """
     db_session = local_session()
     try:
-        # Obtém o ID do usuário autenticado a partir do JWT
-        current_user_id = get_jwt_identity()
-        # Busca o usuário autenticado no banco de dados para verificar o papel
-        usuario_autenticado = db_session.execute(
-            select(Usuario).where(Usuario.id_usuario == current_user_id)
-        ).scalars().first()
-        if not usuario_autenticado:
-            return jsonify({"mensagem": "Usuário não encontrado."}), 404
-
         dados_emprestimo = request.get_json()
 
         # Captura os valores dos campos do formulário
-        data_emprestimo = dados_emprestimo['data_emprestimo']
-        data_devolucao = dados_emprestimo["data_devolucao"]
+        data_emprestimo = ler_data(dados_emprestimo['data_emprestimo'])
+        data_devolucao = ler_data(dados_emprestimo["data_devolucao"])
         livro_id = dados_emprestimo["livro_id"]
-        usuario_id = current_user_id
+        usuario_id = int(get_jwt_identity())
 
-        # Verifica se os valores "livro_id" e "usuario_id" já estão cadastrados
-        livro = db_session.execute(select(Livro).where(Livro.id_livro == livro_id)).scalar()
-        usuario = db_session.execute(select(Usuario).where(Usuario.id_usuario == usuario_id)).scalar()
-
-        if not livro:
-            if not usuario:
-                return jsonify({"mensagem": "Livro e Usuário não encontrados."}), 404
-            else:
-                return jsonify({"mensagem": "Livro não encontrado."}), 404
-        if not usuario:
-            return jsonify({"mensagem": "Usuário não encontrado."}), 404
-
-        # Verifica se o livro e o usuário já estão cadastrados em um empréstimo
-        emprestimo_existente = db_session.execute(
-            select(Emprestimo).where(
-                (Emprestimo.livro_id == livro_id) &
-                (Emprestimo.usuario_id == usuario_id)
-            )
-        ).scalar()
-
-        if emprestimo_existente:
-            return jsonify({"mensagem": "Este livro já está emprestado para este usuário."}), 409
-
-        # Cria a instância do empréstimo
+        # Um UPDATE condicional retira o exemplar e um único INSERT grava o empréstimo, na mesma transação:
+        # as chaves estrangeiras recusam usuário inexistente e o índice único parcial recusa um segundo
+        # empréstimo em aberto do mesmo livro para o mesmo usuário (o exemplar volta no rollback)
         novo_emprestimo = Emprestimo(
             data_emprestimo=data_emprestimo,
             data_devolucao=data_devolucao,
             livro_id=livro_id,
             usuario_id=usuario_id
         )
-        db_session.add(novo_emprestimo)
-        db_session.commit()
+        try:
+            if not registrar_emprestimo(db_session, novo_emprestimo):
+                # Só no caminho de erro: diferencia livro inexistente de livro sem exemplar na estante
+                if db_session.get(Livro, livro_id) is None:
+                    return jsonify({"mensagem": "Livro não encontrado."}), 404
+                return jsonify({"mensagem": "Nenhum exemplar disponível deste livro."}), 409
+        except IntegrityError as erro:
+            violacao = violacao_integridade(erro)
+            if violacao == 'unicidade':
+                return jsonify({"mensagem": "Este livro já está emprestado para este usuário."}), 409
+            if violacao != 'chave_estrangeira':
+                raise
+            # Só no caminho de erro: descobre qual das referências não existe para manter a mensagem
+            if db_session.get(Usuario, usuario_id) is None:
+                return jsonify({"mensagem": "Usuário não encontrado."}), 404
+            return jsonify({"mensagem": "Livro não encontrado."}), 404
 
         return jsonify({"mensagem": "Empréstimo criado com sucesso!"}), 201
     except ValueError:
@@ -540,42 +1160,85 @@ def post_emprestimo():
     finally:
         db_session.close()
 
+@app.route('/emprestimos/<int:id_emprestimo>/devolucao', methods=['POST'])
+@jwt_required()
+def post_devolucao(id_emprestimo):
+    """
+            Registrar devolução
+
+            ### Endpoint:
+                POST /emprestimos/<id_emprestimo>/devolucao
+
+            ### Parâmetros:
+            - `id_emprestimo` **(int)**: **empréstimo em aberto do usuário do token (qualquer um, para admin)**
+
+            ### Erros possíveis:
+            - **Not Found**: *status code* **404** (empréstimo inexistente, de outro usuário ou já devolvido)
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**; o exemplar volta a ficar disponível
+    """
+    db_session = local_session()
+    try:
+        usuario_id = None if token_de_admin() else int(get_jwt_identity())
+        if not registrar_devolucao(db_session, id_emprestimo, date.today(), usuario_id):
+            return jsonify({"mensagem": "Empréstimo em aberto não encontrado."}), 404
+        return jsonify({"mensagem": "Devolução registrada com sucesso!"}), 200
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
 @app.route('/emprestimos', methods=['GET'])
 @jwt_required()
+@cache_resposta(['emprestimos', 'livros', 'usuarios'], por_usuario=True)
 def get_emprestimo():
     """
             Consultar emprestimos
 
             ### Endpoint:
-                GET /emprestimos
+                GET /emprestimos?limit=<n>&after=<id_emprestimo>
+                GET /emprestimos?stream=true
+
+            ### Parâmetros:
+            - `limit` **(int)**: **quantidade máxima de emprestimos na página (padrão 100, máximo 1000)**
+            - `after` **(int)**: **cursor devolvido em `next_cursor` pela página anterior**
+            - `stream` **(bool)**: **devolve todos os emprestimos em um array JSON transmitido em lotes, sem paginação**
+            - `expand` **(str)**: **`livro`, `usuario` ou `livro,usuario`: embute os dados relacionados no lugar dos ids**
 
             ### Erros possíveis:
             - **Bad Request**: *status code* **400**
+            - **Not Modified**: *status code* **304** (o `ETag` enviado em `If-None-Match` ainda é o atual)
 
             ### Retorna:
-            - **JSON** com a lista de emprestimos
+            - **JSON** com a lista de emprestimos da página e o `next_cursor` (`null` na última página)
     """
     db_session = local_session()
     try:
-        # Obtém o ID do usuário autenticado a partir do JWT
-        current_user_id = get_jwt_identity()
-        # Busca o usuário autenticado no banco de dados para verificar o papel
-        usuario_autenticado = db_session.execute(
-            select(Usuario).where(Usuario.id_usuario == current_user_id)
-        ).scalars().first()
+        limite, cursor = parametros_paginacao()
+        expandir = parametro_expand()
+        # Dados expandidos também entram na versão: a resposta muda se o livro/usuário mudar
+        tabelas = ['emprestimos'] + [RELACOES_EMPRESTIMO[nome].property.target.name for nome in expandir]
+        etag = etag_listagem(db_session, tabelas, get_jwt_identity())
+        resposta = nao_modificado(etag)
+        if resposta:
+            return resposta
+        # Usuário autenticado, carregado uma única vez por requisição
+        usuario_autenticado = usuario_atual()
         if not usuario_autenticado:
             return jsonify({"mensagem": "Usuário não encontrado."}), 404
         # Verifica o papel do usuário
+        consulta = select(Emprestimo).options(*opcoes_expandir(expandir))
+        if usuario_autenticado.papel != 'admin':
+            consulta = consulta.where(Emprestimo.usuario_id == usuario_autenticado.id_usuario)
+        if quer_stream():
+            return com_etag(resposta_em_stream(consulta.order_by(Emprestimo.id_emprestimo),
+                                               lambda emprestimo: emprestimo.serialize(expandir)), etag)
+        lista, proximo_cursor = paginar(db_session, consulta, Emprestimo.id_emprestimo, limite, cursor)
         resultados = []
-        if usuario_autenticado.papel == 'admin':
-            lista = db_session.execute(select(Emprestimo)).scalars().all()
-            for emprestimo in lista:
-                resultados.append(emprestimo.serialize())
-        else:
-            lista = db_session.execute(select(Emprestimo).where(Emprestimo.usuario_id == current_user_id)).scalars().all()
-            for emprestimo in lista:
-                resultados.append(emprestimo.serialize())
-        return jsonify(resultados)
+        for emprestimo in lista:
+            resultados.append(emprestimo.serialize(expandir))
+        return com_etag(jsonify({"emprestimos": resultados, "next_cursor": proximo_cursor}), etag)
     except ValueError:
         return jsonify({"mensagem": "Formato inválido."}), 400
     except TypeError:
@@ -585,25 +1248,104 @@ def get_emprestimo():
     finally:
         db_session.close()
 
+@app.route('/emprestimos/atrasados', methods=['GET'])
+@jwt_required()
+def get_emprestimos_atrasados():
+    """
+            Consultar empréstimos atrasados
+
+            ### Endpoint:
+                GET /emprestimos/atrasados?limit=<n>&after=<cursor>&data=<DD/MM/AAAA>
+
+            ### Parâmetros:
+            - `data` **(str)**: **data de referência (padrão: hoje); atrasado é o empréstimo em aberto com devolução prevista antes dela**
+            - `limit` **(int)**: **quantidade máxima de empréstimos na página (padrão 100, máximo 1000)**
+            - `after` **(str)**: **cursor devolvido em `next_cursor` pela página anterior**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+            - **Not Modified**: *status code* **304** (o `ETag` enviado em `If-None-Match` ainda é o atual)
+
+            ### Retorna:
+            - **JSON** com os empréstimos atrasados (todos para admin, só os do usuário para os demais), do mais
+              antigo para o mais recente, cada um com `dias_atraso`, e o `next_cursor` (`null` na última página)
+    """
+    db_session = local_session()
+    try:
+        referencia = ler_data(request.args['data']) if 'data' in request.args else date.today()
+        limite, cursor = parametros_paginacao(ler_cursor=str)
+        # A lista muda com a data de referência mesmo sem escrita no banco: ela entra no ETag
+        # (e por isso esta rota não passa pelo cache_resposta, que só expira com commits)
+        etag = etag_listagem(db_session, ['emprestimos'], f'{get_jwt_identity()}-{referencia.isoformat()}')
+        resposta = nao_modificado(etag)
+        if resposta:
+            return resposta
+        usuario_id = None if token_de_admin() else int(get_jwt_identity())
+        lista, proximo_cursor = listar_atrasados(db_session, referencia, limite, cursor, usuario_id)
+        resultados = []
+        for emprestimo in lista:
+            resultado = emprestimo.serialize()
+            resultado['dias_atraso'] = (referencia - emprestimo.data_devolucao).days
+            resultados.append(resultado)
+        return com_etag(jsonify({"emprestimos": resultados, "next_cursor": proximo_cursor}), etag)
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
 
 @app.route('/emprestimos/<int:id_emprestimo>', methods=['PUT'])
 @admin_required
 @jwt_required()
 def put_emprestimo_admin(id_emprestimo):
+    """
+            Editar empréstimos (admin)
+
+            ### Endpoint:
+                PUT /emprestimos/<id_emprestimo>
+
+            ### Parâmetros:
+            - `id_emprestimo` **(str)**: **string para ser convertida a inteiro**
+            - `If-Match` **(header, opcional)**: **`versao` lida do empréstimo; só grava se ainda for a atual**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+            - **Not Found**: *status code* **404**
+            - **Conflict**: *status code* **409** (empréstimo em aberto movido para um livro sem exemplar disponível,
+              ou para um livro que o usuário já tem emprestado)
+            - **Precondition Failed**: *status code* **412** (o empréstimo foi alterado depois da versão enviada)
+
+            ### Retorna:
+            - **JSON** mensagem de **sucesso**, com a nova versão no `ETag`
+    """
     with local_session() as db_session:
         try:
             emprestimo = db_session.execute(select(Emprestimo).where(Emprestimo.id_emprestimo == id_emprestimo)).scalar()
             if not emprestimo:
                 return jsonify({"mensagem": "Empréstimo não encontrado."}), 404
 
+            conflito = precondicao_falhou(emprestimo)
+            if conflito:
+                return conflito
+
             dados_emprestimo = request.get_json()
-            emprestimo.data_emprestimo = dados_emprestimo['data_emprestimo']
-            emprestimo.data_devolucao = dados_emprestimo['data_devolucao']
+            emprestimo.data_emprestimo = ler_data(dados_emprestimo['data_emprestimo'])
+            emprestimo.data_devolucao = ler_data(dados_emprestimo['data_devolucao'])
             emprestimo.livro_id = dados_emprestimo['livro_id']
             emprestimo.usuario_id = dados_emprestimo['usuario_id']
 
             emprestimo.save(db_session)
-            return jsonify({"mensagem": "Empréstimo atualizado com sucesso!"}), 200
+            resposta = jsonify({"mensagem": "Empréstimo atualizado com sucesso!"})
+            resposta.set_etag(etag_registro(emprestimo))
+            return resposta, 200
+        except StaleDataError:
+            return falha_precondicao()
+        except ExemplarIndisponivel:
+            return jsonify({"mensagem": "Nenhum exemplar disponível deste livro."}), 409
+        except IntegrityError:
+            # ux_emprestimos_ativos: o usuário já tem este livro em aberto
+            return jsonify({"mensagem": "O usuário já tem um empréstimo em aberto deste livro."}), 409
         except ValueError:
             return jsonify({"mensagem": "Formato inválido."}), 400
         except TypeError:
@@ -618,27 +1360,31 @@ def put_emprestimo_admin(id_emprestimo):
 def put_emprestimo():
     with local_session() as db_session:
         try:
-            # Obtém o ID do usuário autenticado a partir do JWT
-            current_user_id = get_jwt_identity()
-            # Busca o usuário autenticado no banco de dados para verificar o papel
-            usuario_autenticado = db_session.execute(
-                select(Usuario).where(Usuario.id_usuario == current_user_id)
-            ).scalars().first()
+            # Usuário autenticado, carregado uma única vez por requisição
+            usuario_autenticado = usuario_atual()
             if not usuario_autenticado:
                 return jsonify({"mensagem": "Usuário não encontrado."}), 404
 
-            emprestimo = db_session.execute(select(Emprestimo).where(Emprestimo.id_emprestimo == current_user_id)).scalar()
+            emprestimo = db_session.execute(select(Emprestimo).where(Emprestimo.id_emprestimo == usuario_autenticado.id_usuario)).scalar()
             if not emprestimo:
                 return jsonify({"mensagem": "Empréstimo não encontrado."}), 404
 
             dados_emprestimo = request.get_json()
-            emprestimo.data_emprestimo = dados_emprestimo['data_emprestimo']
-            emprestimo.data_devolucao = dados_emprestimo['data_devolucao']
+            emprestimo.data_emprestimo = ler_data(dados_emprestimo['data_emprestimo'])
+            emprestimo.data_devolucao = ler_data(dados_emprestimo['data_devolucao'])
             emprestimo.livro_id = dados_emprestimo['livro_id']
-            emprestimo.usuario_id = current_user_id
+            emprestimo.usuario_id = usuario_autenticado.id_usuario
 
             emprestimo.save(db_session)
             return jsonify({"mensagem": "Empréstimo atualizado com sucesso!"}), 200
+        except StaleDataError:
+            # Outra requisição (ex.: a edição de um admin) gravou o empréstimo entre a leitura e o UPDATE
+            return falha_precondicao()
+        except ExemplarIndisponivel:
+            return jsonify({"mensagem": "Nenhum exemplar disponível deste livro."}), 409
+        except IntegrityError:
+            # ux_emprestimos_ativos: o usuário já tem este livro em aberto
+            return jsonify({"mensagem": "O usuário já tem um empréstimo em aberto deste livro."}), 409
         except ValueError:
             return jsonify({"mensagem": "Formato inválido."}), 400
         except TypeError:
@@ -649,6 +1395,214 @@ def put_emprestimo():
             db_session.close()
 
 
+@app.route('/export/livros', methods=['GET'])
+@admin_required
+def export_livros():
+    """
+            Exportar o catálogo de livros
+
+            ### Endpoint:
+                GET /export/livros
+
+            ### Cabeçalhos:
+            - `Accept`: **`application/x-ndjson` (padrão) ou `text/csv`**
+            - `Accept-Encoding`: **com `gzip` a saída é comprimida enquanto é transmitida**
+
+            ### Erros possíveis:
+            - **Not Acceptable**: *status code* **406**
+
+            ### Retorna:
+            - **CSV** ou **NDJSON** com todos os livros, transmitido em lotes
+    """
+    formato = formato_exportacao()
+    if formato is None:
+        return jsonify({"mensagem": "Formatos disponíveis: " + ", ".join(FORMATOS_EXPORTACAO)}), 406
+    return resposta_exportacao(Livro.__table__, formato, 'livros')
+
+@app.route('/export/emprestimos', methods=['GET'])
+@admin_required
+def export_emprestimos():
+    """
+            Exportar o histórico de emprestimos
+
+            ### Endpoint:
+                GET /export/emprestimos
+
+            ### Cabeçalhos:
+            - `Accept`: **`application/x-ndjson` (padrão) ou `text/csv`**
+            - `Accept-Encoding`: **com `gzip` a saída é comprimida enquanto é transmitida**
+
+            ### Erros possíveis:
+            - **Not Acceptable**: *status code* **406**
+
+            ### Retorna:
+            - **CSV** ou **NDJSON** com todos os emprestimos, transmitido em lotes
+    """
+    formato = formato_exportacao()
+    if formato is None:
+        return jsonify({"mensagem": "Formatos disponíveis: " + ", ".join(FORMATOS_EXPORTACAO)}), 406
+    return resposta_exportacao(Emprestimo.__table__, formato, 'emprestimos')
+
+@app.route('/cache/estatisticas', methods=['GET'])
+@admin_required
+def estatisticas_cache():
+    """
+            Estatísticas do cache de respostas
+
+            ### Endpoint:
+                GET /cache/estatisticas
+
+            ### Retorna:
+            - **JSON** com itens, bytes usados, acertos, falhas, taxa de acerto, despejos e invalidações
+    """
+    return jsonify(app.config["CACHE_RESPOSTAS"].estatisticas())
+
+# ---------------- ESTATÍSTICAS DE CIRCULAÇÃO ----------------
+# As rotas leem as tabelas de estatísticas (mantidas a cada empréstimo/devolução) pelos seus índices:
+# o custo depende do tamanho da resposta, não do histórico de empréstimos
+RANKING_PADRAO = 10
+
+def parametro_limite(padrao):
+    limite = int(request.args.get('limit', padrao))
+    if limite < 1:
+        raise ValueError("limit deve ser maior que zero")
+    return min(limite, LIMITE_MAXIMO)
+
+@app.route('/estatisticas/livros', methods=['GET'])
+@jwt_required()
+@cache_resposta(['emprestimos', 'livros'])
+def estatisticas_livros():
+    """
+            Livros mais emprestados
+
+            ### Endpoint:
+                GET /estatisticas/livros?limit=<n>
+
+            ### Parâmetros:
+            - `limit` **(int)**: **tamanho do ranking (padrão 10, máximo 1000)**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com os livros em ordem decrescente de empréstimos (total e em aberto)
+    """
+    db_session = local_session()
+    try:
+        linhas = db_session.execute(
+            select(EstatisticaLivro, Livro.titulo, Livro.autor)
+            .join(Livro, Livro.id_livro == EstatisticaLivro.livro_id)
+            .order_by(EstatisticaLivro.emprestimos.desc(), EstatisticaLivro.livro_id.desc())
+            .limit(parametro_limite(RANKING_PADRAO))
+        ).all()
+        livros = [{
+            'livro': estatistica.livro_id,
+            'titulo': titulo,
+            'autor': autor,
+            'emprestimos': estatistica.emprestimos,
+            'emprestimos_abertos': estatistica.emprestimos_abertos,
+        } for estatistica, titulo, autor in linhas]
+        return jsonify({"livros": livros})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.route('/estatisticas/usuarios', methods=['GET'])
+@jwt_required()
+@cache_resposta(['emprestimos', 'usuarios'], por_usuario=True)
+def estatisticas_usuarios():
+    """
+            Empréstimos em aberto por usuário
+
+            ### Endpoint:
+                GET /estatisticas/usuarios?limit=<n>
+
+            ### Parâmetros:
+            - `limit` **(int)**: **quantidade de usuários (padrão 10, máximo 1000)**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com os usuários que têm mais empréstimos em aberto (admin) ou só com o próprio usuário (demais)
+    """
+    db_session = local_session()
+    try:
+        consulta = select(EstatisticaUsuario, Usuario.nome).join(Usuario, Usuario.id_usuario == EstatisticaUsuario.usuario_id)
+        if token_de_admin():
+            consulta = (consulta.where(EstatisticaUsuario.emprestimos_abertos > 0)
+                        .order_by(EstatisticaUsuario.emprestimos_abertos.desc(), EstatisticaUsuario.usuario_id.desc())
+                        .limit(parametro_limite(RANKING_PADRAO)))
+        else:
+            consulta = consulta.where(EstatisticaUsuario.usuario_id == int(get_jwt_identity()))
+        usuarios = [{
+            'usuario': estatistica.usuario_id,
+            'nome': nome,
+            'emprestimos': estatistica.emprestimos,
+            'emprestimos_abertos': estatistica.emprestimos_abertos,
+        } for estatistica, nome in db_session.execute(consulta).all()]
+        return jsonify({"usuarios": usuarios})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.route('/estatisticas/dias', methods=['GET'])
+@jwt_required()
+def estatisticas_dias():
+    """
+            Empréstimos e devoluções por dia
+
+            ### Endpoint:
+                GET /estatisticas/dias?inicio=<DD/MM/AAAA>&fim=<DD/MM/AAAA>
+
+            ### Parâmetros:
+            - `inicio` **(str)**: **primeiro dia (padrão: 30 dias antes de `fim`)**
+            - `fim` **(str)**: **último dia (padrão: hoje)**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com os dias do período que tiveram movimento, em ordem cronológica
+    """
+    db_session = local_session()
+    try:
+        # Sem cache_resposta: o período padrão muda com a data, não só com os commits
+        fim = ler_data(request.args['fim']) if 'fim' in request.args else date.today()
+        inicio = ler_data(request.args['inicio']) if 'inicio' in request.args else fim - timedelta(days=30)
+        if inicio > fim:
+            raise ValueError("inicio depois de fim")
+        linhas = db_session.execute(
+            select(EstatisticaDia).where(EstatisticaDia.dia.between(inicio, fim)).order_by(EstatisticaDia.dia)
+        ).scalars()
+        dias = [{
+            'dia': formatar_data(estatistica.dia),
+            'emprestimos': estatistica.emprestimos,
+            'devolucoes': estatistica.devolucoes,
+        } for estatistica in linhas]
+        return jsonify({"dias": dias})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.cli.command('reconstruir-estatisticas')
+def comando_reconstruir_estatisticas():
+    """Recalcula as estatísticas de circulação a partir de todos os empréstimos."""
+    # Uso: cd api_token && flask --app api_local reconstruir-estatisticas
+    inicio = time.perf_counter()
+    with engine.begin() as conexao:
+        reconstruir_estatisticas(conexao)
+    print(f"Estatísticas reconstruídas em {time.perf_counter() - inicio:.1f} s")
+
 @app.route('/emprestimos/<int:id_emprestimo>', methods=['DELETE'])
 def delete_emprestimo(id_emprestimo):
     db_session = local_session()
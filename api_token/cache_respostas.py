@@ -0,0 +1,107 @@
+# cache_respostas.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """Cache de respostas em memória: LRU limitado em bytes, com invalidação por tabela.
+
+    Cada entrada guarda as versões das tabelas lidas. Dentro do TTL ela é servida sem consultar o banco;
+    vencido o TTL, quem chama relê as versões e confirma a entrada com `renovar` (mais TTL segundos) ou a
+    descarta. Commits deste processo já invalidam pela tabela; o TTL limita quanto tempo um commit feito
+    em outro processo leva para aparecer.
+    """
+
+    def __init__(self, limite_bytes, ttl):
+        self.limite_bytes = limite_bytes
+        self.ttl = ttl
+        self._itens = OrderedDict()  # chave -> (corpo, cabecalhos, tabelas, versoes, conferir_em, tamanho)
+        self._lock = threading.Lock()
+        self.bytes_usados = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.despejos = 0
+        self.invalidacoes = 0
+
+    def obter(self, chave):
+        # (corpo, cabecalhos, conferir) ou None; conferir=True pede `renovar` antes de usar a entrada
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(chave)
+            conferir = item[4] <= time.monotonic()
+            if not conferir:
+                self.acertos += 1
+            return item[0], item[1], conferir
+
+    def renovar(self, chave, versoes):
+        # Confirma a entrada se as versões das tabelas não mudaram; senão a descarta e devolve False
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or item[3] != versoes:
+                if item is not None:
+                    self._remover(chave)
+                self.falhas += 1
+                return False
+            self._itens[chave] = item[:4] + (time.monotonic() + self.ttl, item[5])
+            self.acertos += 1
+            return True
+
+    def guardar(self, chave, corpo, cabecalhos, tabelas, versoes):
+        tamanho = len(corpo) + len(chave)
+        if tamanho > self.limite_bytes:
+            return
+        with self._lock:
+            if chave in self._itens:
+                self._remover(chave)
+            self._itens[chave] = (corpo, cabecalhos, frozenset(tabelas), versoes, time.monotonic() + self.ttl, tamanho)
+            self.bytes_usados += tamanho
+            while self.bytes_usados > self.limite_bytes:
+                self._remover(next(iter(self._itens)))
+                self.despejos += 1
+
+    def invalidar(self, tabelas):
+        with self._lock:
+            chaves = [chave for chave, item in self._itens.items() if item[2] & tabelas]
+            for chave in chaves:
+                self._remover(chave)
+            self.invalidacoes += len(chaves)
+
+    def _remover(self, chave):
+        self.bytes_usados -= self._itens.pop(chave)[5]
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'itens': len(self._itens),
+                'bytes_usados': self.bytes_usados,
+                'limite_bytes': self.limite_bytes,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+                'despejos': self.despejos,
+                'invalidacoes': self.invalidacoes,
+            }
+
+
+class SemCache:
+    """Implementação vazia, para desligar o cache sem mexer nas rotas."""
+
+    def obter(self, chave):
+        return None
+
+    def renovar(self, chave, versoes):
+        return False
+
+    def guardar(self, chave, corpo, cabecalhos, tabelas, versoes):
+        pass
+
+    def invalidar(self, tabelas):
+        pass
+
+    def estatisticas(self):
+        return {}
@@ -0,0 +1,33 @@
+# filtro_bloom.py
+import hashlib
+import math
+
+
+class FiltroBloom:
+    """Conjunto probabilístico: `in` nunca dá falso negativo, e dá falso positivo com a taxa escolhida."""
+
+    def __init__(self, capacidade, taxa_falso_positivo=0.01):
+        self.capacidade = capacidade
+        self.bits = max(8, int(-capacidade * math.log(taxa_falso_positivo) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.bits / capacidade * math.log(2)))
+        self._vetor = bytearray((self.bits + 7) // 8)
+        self.quantidade = 0
+
+    def _posicoes(self, chave):
+        # Duplo hashing (Kirsch-Mitzenmacher): dois valores de 64 bits geram as k posições
+        resumo = hashlib.blake2b(chave.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(resumo[:8], 'little')
+        h2 = int.from_bytes(resumo[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.num_hashes)]
+
+    def adicionar(self, chave):
+        for posicao in self._posicoes(chave):
+            self._vetor[posicao >> 3] |= 1 << (posicao & 7)
+        self.quantidade += 1
+
+    def __contains__(self, chave):
+        vetor = self._vetor
+        for posicao in self._posicoes(chave):
+            if not vetor[posicao >> 3] & (1 << (posicao & 7)):
+                return False
+        return True
@@ -1,22 +1,84 @@
 # models_app.py
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean
-from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base, relationship
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Index, select, insert, update, delete, text, Boolean, Date, DateTime, inspect, event, tuple_, func, case, union_all, literal_column
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base, relationship, joinedload
+from sqlalchemy.pool import QueuePool
+import os
+import hashlib
+import logging
+import secrets
+from datetime import date, datetime, timedelta, timezone
+from senhas import gerar_hash, verificar_hash, hash_desatualizado
+
+# Perfil do SQLite aplicado em toda conexão nova; cada valor pode ser trocado por variável de ambiente.
+# WAL deixa leitores e o escritor trabalharem ao mesmo tempo, busy_timeout espera o lock em vez de falhar
+# com "database is locked" e synchronous=NORMAL (seguro com WAL) evita um fsync a cada commit.
+# foreign_keys=ON faz o SQLite conferir as ForeignKey dos modelos (por padrão ele só as guarda no esquema)
+PERFIL_SQLITE = {
+    'foreign_keys': os.environ.get('SQLITE_FOREIGN_KEYS', 'ON'),
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024)),  # negativo = KiB
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+# Pool fixo de conexões reaproveitadas: cada conexão guarda o próprio cache de páginas e o mmap,
+# e o limite evita abrir mais conexões do que threads atendendo requisições
+POOL_SQLITE = {
+    'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', 8)),
+    'max_overflow': int(os.environ.get('SQLITE_POOL_OVERFLOW', 4)),
+    'pool_timeout': 30,
+}
+
+def criar_engine(url, perfil=PERFIL_SQLITE, pool=POOL_SQLITE):
+    nova_engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=QueuePool, **pool)
+
+    @event.listens_for(nova_engine, 'connect')
+    def aplicar_perfil(conexao_dbapi, registro):
+        cursor = conexao_dbapi.cursor()
+        for pragma, valor in perfil.items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
+        cursor.close()
+
+    return nova_engine
 
 # Configuração do banco de dados
-engine = create_engine('sqlite:///banco_local.db', connect_args={"check_same_thread": False})
+engine = criar_engine('sqlite:///banco_local.db')
 local_session = scoped_session(sessionmaker(bind=engine))
+# Avisos das migrações do init_db (vão para o log de erros do gunicorn, não para o stdout)
+log = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Formato das datas na API (entrada e saída); no banco elas ficam como Date (AAAA-MM-DD no SQLite)
+FORMATO_DATA = '%d/%m/%Y'
+
+def ler_data(valor):
+    # Data em DD/MM/AAAA vinda da requisição; formato inválido gera ValueError (400 nos handlers)
+    if isinstance(valor, date):
+        return valor
+    return datetime.strptime(valor, FORMATO_DATA).date()
+
+def formatar_data(valor):
+    return valor.strftime(FORMATO_DATA) if valor is not None else None
+
 class Livro(Base):
     __tablename__ = 'livros'
     id_livro = Column(Integer, primary_key=True)
     titulo = Column(String, nullable=False, index=True)
     autor = Column(String, nullable=False, index=True)
-    ISBN = Column(String(13), nullable=False, index=True)
-    resumo = Column(String, index=True)
-    status = Column(Boolean, nullable=False, default=True)
+    ISBN = Column(String(13), nullable=False, index=True, unique=True)  # o banco barra ISBN repetido (409 na API)
+    resumo = Column(String)
+    status = Column(Boolean, nullable=False, default=True)  # True enquanto houver exemplar disponível
+    # Exemplares físicos: o total e quantos estão na estante. Só mudam por UPDATE condicional
+    # (retirar_exemplar/devolver_exemplar), nunca lendo o valor e gravando de volta
+    exemplares = Column(Integer, nullable=False, default=1, server_default='1')
+    exemplares_disponiveis = Column(Integer, nullable=False, default=1, server_default='1')
+    # Versão do registro (controle otimista): o ORM grava com "WHERE versao = <lida>" e incrementa.
+    # Retiradas e devoluções não mudam a versão, senão toda edição de um livro popular daria conflito
+    versao = Column(Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': versao}
 
     def __repr__(self):
         return f'<Livro(Título={self.titulo}, id{self.id_livro})>'
@@ -24,6 +86,9 @@ class Livro(Base):
     def save(self, db_session):
         try:
             db_session.add(self)
+            db_session.flush()
+            indexar_livro(db_session, self)
+            incrementar_versao(db_session, self.__tablename__)
             db_session.commit()
         except:
             db_session.rollback()
@@ -31,7 +96,10 @@ class Livro(Base):
 
     def delete(self, db_session):
         try:
+            desindexar_livro(db_session, self.id_livro)
+            db_session.execute(delete(EstatisticaLivro).where(EstatisticaLivro.livro_id == self.id_livro))
             db_session.delete(self)
+            incrementar_versao(db_session, self.__tablename__)
             db_session.commit()
         except:
             db_session.rollback()
@@ -45,6 +113,9 @@ class Livro(Base):
             'ISBN': self.ISBN,
             'resumo': self.resumo,
             'status': self.status,
+            'exemplares': self.exemplares,
+            'exemplares_disponiveis': self.exemplares_disponiveis,
+            'versao': self.versao,
         }
         return var_livro
 
@@ -52,11 +123,16 @@ class Livro(Base):
 class Usuario(Base):
     __tablename__ = 'usuarios'
     id_usuario = Column(Integer, primary_key=True)
-    nome = Column(String, nullable=False)
+    nome = Column(String, nullable=False, index=True)  # usado no login
     CPF = Column(String, nullable=False, unique=True)
     endereco = Column(String)
     senha_hash = Column(String, nullable=False)
     papel = Column(String)
+    # Incrementada a cada troca de papel: tokens emitidos com versão anterior deixam de valer
+    papel_versao = Column(Integer, nullable=False, default=0, server_default='0')
+    # Versão do registro (controle otimista), a mesma do Livro
+    versao = Column(Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': versao}
 
     def __repr__(self):
         return f'<Usuário(nome={self.nome}, id{self.id_usuario})>'
@@ -64,6 +140,7 @@ class Usuario(Base):
     def save(self, db_session):
         try:
             db_session.add(self)
+            incrementar_versao(db_session, self.__tablename__)
             db_session.commit()
         except:
             db_session.rollback()
@@ -71,17 +148,29 @@ class Usuario(Base):
 
     def delete(self, db_session):
         try:
+            # Os refresh tokens do usuário saem junto; empréstimos continuam impedindo a exclusão (IntegrityError)
+            db_session.execute(delete(TokenRenovacao).where(TokenRenovacao.usuario_id == self.id_usuario))
+            db_session.execute(delete(EstatisticaUsuario).where(EstatisticaUsuario.usuario_id == self.id_usuario))
             db_session.delete(self)
+            incrementar_versao(db_session, self.__tablename__)
             db_session.commit()
         except:
             db_session.rollback()
             raise
 
     def set_senha_hash(self, senha):
-        self.senha_hash = generate_password_hash(senha)
+        self.senha_hash = gerar_hash(senha)
 
     def check_password(self, senha):
-        return check_password_hash(self.senha_hash, senha)
+        return verificar_hash(self.senha_hash, senha)
+
+    def precisa_rehash(self):
+        return hash_desatualizado(self.senha_hash)
+
+    def set_papel(self, papel):
+        if papel != self.papel:
+            self.papel = papel
+            self.papel_versao = (self.papel_versao or 0) + 1
 
     def serialize(self):
         var_usuario = {
@@ -90,28 +179,56 @@ class Usuario(Base):
             'CPF': self.CPF,
             'endereco': self.endereco,
             'senha_hash': self.senha_hash,
-            'papel': self.papel
+            'papel': self.papel,
+            'versao': self.versao
         }
         return var_usuario
 
 
+class ExemplarIndisponivel(Exception):
+    """O livro para onde o empréstimo em aberto foi movido não tem exemplar na estante; a rota responde 409."""
+
+
 class Emprestimo(Base):
     __tablename__ = 'emprestimos'
     id_emprestimo = Column(Integer, primary_key=True)
-    data_emprestimo = Column(String, nullable=False, index=True)
-    data_devolucao = Column(String, nullable=False, index=True)
-    data_devolvido = Column(String, index=True)
+    data_emprestimo = Column(Date, nullable=False, index=True)
+    data_devolucao = Column(Date, nullable=False, index=True)
+    data_devolvido = Column(Date)  # NULL enquanto aberto; as consultas de abertos usam os índices parciais abaixo
     livro_id = Column(Integer, ForeignKey('livros.id_livro'))
     livros = relationship('Livro')
     usuario_id = Column(Integer, ForeignKey('usuarios.id_usuario'))
     usuarios = relationship('Usuario')
+    # Versão do registro (controle otimista), a mesma do Livro
+    versao = Column(Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': versao}
+    # Um mesmo livro só pode ter um empréstimo em aberto (sem data_devolvido) por usuário;
+    # o banco garante isso mesmo com duas requisições simultâneas
+    __table_args__ = (
+        Index('ux_emprestimos_ativos', livro_id, usuario_id, unique=True,
+              sqlite_where=data_devolvido.is_(None), postgresql_where=data_devolvido.is_(None)),
+        # Só os empréstimos em aberto, em ordem de devolução prevista: a consulta de atrasados lê o começo
+        # do índice até a data de referência, sem tocar no histórico de empréstimos já devolvidos
+        Index('ix_emprestimos_abertos_devolucao', data_devolucao, id_emprestimo,
+              sqlite_where=data_devolvido.is_(None), postgresql_where=data_devolvido.is_(None)),
+    )
 
     def __repr__(self):
         return f'<Empréstimo(livro={self.livro_id}, usuario{self.usuario_id})>'
 
     def save(self, db_session):
         try:
+            # Um empréstimo novo soma nas estatísticas; um já gravado troca os valores antigos pelos novos
+            antes = valores_estatisticas(self, antes=True) if inspect(self).persistent else None
+            # Trocar o livro de um empréstimo em aberto move o exemplar: retira um do livro novo (ou falha
+            # sem mexer em nada) e devolve o do livro antigo, na mesma transação da edição
+            if antes is not None and antes[3] is None and self.data_devolvido is None and antes[0] != self.livro_id:
+                if not retirar_exemplar(db_session, self.livro_id):
+                    raise ExemplarIndisponivel()
+                devolver_exemplar(db_session, antes[0])
             db_session.add(self)
+            atualizar_estatisticas(db_session, antes, valores_estatisticas(self))
+            incrementar_versao(db_session, self.__tablename__)
             db_session.commit()
         except:
             db_session.rollback()
@@ -119,26 +236,567 @@ class Emprestimo(Base):
 
     def delete(self, db_session):
         try:
+            # Apagar um empréstimo ainda aberto devolve o exemplar à estante
+            if self.data_devolvido is None:
+                devolver_exemplar(db_session, self.livro_id)
+            atualizar_estatisticas(db_session, antes=valores_estatisticas(self, antes=True))
             db_session.delete(self)
+            incrementar_versao(db_session, self.__tablename__)
             db_session.commit()
         except:
             db_session.rollback()
             raise
 
-    def serialize(self):
+    def serialize(self, expandir=()):
         var_emprestimo = {
             'id_emprestimo': self.id_emprestimo,
-            'data_emprestimo': self.data_emprestimo,
-            'data_devolucao': self.data_devolucao,
-            'data_devolvido': self.data_devolvido,
+            'data_emprestimo': formatar_data(self.data_emprestimo),
+            'data_devolucao': formatar_data(self.data_devolucao),
+            'data_devolvido': formatar_data(self.data_devolvido),
             'livro': self.livro_id,
-            'usuario': self.usuario_id
+            'usuario': self.usuario_id,
+            'versao': self.versao
         }
+        # `expandir` troca os ids pelos dados do livro/usuário (carregados com opcoes_expandir)
+        if 'livro' in expandir:
+            var_emprestimo['livro'] = self.livros.serialize() if self.livros else None
+        if 'usuario' in expandir:
+            usuario = self.usuarios.serialize() if self.usuarios else None
+            if usuario:
+                usuario.pop('senha_hash', None)
+            var_emprestimo['usuario'] = usuario
         return var_emprestimo
 
+
+# Refresh tokens opacos e rotativos: só o SHA-256 é gravado (o token tem 256 bits aleatórios, então um
+# hash rápido basta) e cada uso gera o próximo token da mesma família
+class TokenRenovacao(Base):
+    __tablename__ = 'tokens_renovacao'
+    id_token = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    familia = Column(String(32), nullable=False, index=True)
+    usuario_id = Column(Integer, ForeignKey('usuarios.id_usuario'), nullable=False, index=True)
+    expira_em = Column(DateTime, nullable=False)
+    usado = Column(Boolean, nullable=False, default=False)
+    usuario = relationship('Usuario')
+
+    def __repr__(self):
+        return f'<TokenRenovacao(usuario={self.usuario_id}, familia={self.familia})>'
+
+def agora_utc():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def emitir_token_renovacao(db_session, usuario_id, validade, familia=None):
+    # Adiciona o token à sessão; quem chama faz o commit. Aproveita para apagar os tokens vencidos do
+    # usuário (pelo índice de usuario_id): vencido não renova nem serve para detectar reuso
+    db_session.execute(delete(TokenRenovacao).where(TokenRenovacao.usuario_id == usuario_id,
+                                                    TokenRenovacao.expira_em <= agora_utc()))
+    token = secrets.token_urlsafe(32)
+    db_session.add(TokenRenovacao(
+        token_hash=hash_token(token),
+        familia=familia or secrets.token_hex(16),
+        usuario_id=usuario_id,
+        expira_em=agora_utc() + validade
+    ))
+    return token
+
+def usar_token_renovacao(db_session, token):
+    # Uma consulta indexada (token + usuário) e um UPDATE condicional que só marca o token como usado
+    # se ninguém o usou antes; devolve (registro, usuario) ou None. Reuso de um token já trocado
+    # indica vazamento: a família inteira é apagada
+    linha = db_session.execute(
+        select(TokenRenovacao, Usuario).join(TokenRenovacao.usuario).where(TokenRenovacao.token_hash == hash_token(token))
+    ).first()
+    if linha is None:
+        return None
+    registro, usuario = linha
+    if registro.expira_em <= agora_utc():
+        return None
+    marcado = db_session.execute(
+        update(TokenRenovacao)
+        .where(TokenRenovacao.id_token == registro.id_token, TokenRenovacao.usado.is_(False))
+        .values(usado=True)
+    ).rowcount
+    if not marcado:
+        db_session.execute(delete(TokenRenovacao).where(TokenRenovacao.familia == registro.familia))
+        db_session.commit()
+        return None
+    return registro, usuario
+
+
+# Denylist de access tokens revogados (pelo jti); as linhas podem ser apagadas depois de expira_em
+class TokenRevogado(Base):
+    __tablename__ = 'tokens_revogados'
+    id_revogacao = Column(Integer, primary_key=True)
+    jti = Column(String(36), nullable=False, unique=True)
+    expira_em = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<TokenRevogado(jti={self.jti})>'
+
+def limpar_tokens_revogados(conexao):
+    # Apaga as revogações vencidas (o token já expirou, a entrada não barra mais nada). A de maior id fica:
+    # sem AUTOINCREMENT o SQLite reaproveitaria o id, e a Denylist lê só os ids acima do último que viu
+    maior_id = select(func.max(TokenRevogado.id_revogacao)).scalar_subquery()
+    conexao.execute(delete(TokenRevogado).where(TokenRevogado.expira_em <= agora_utc(),
+                                                TokenRevogado.id_revogacao < maior_id))
+
+def revogar_familia(db_session, token):
+    # Invalida todos os refresh tokens da família do token informado apagando as linhas (um token que
+    # não existe mais recebe o mesmo 401 de um revogado); quem chama faz o commit
+    familia = select(TokenRenovacao.familia).where(TokenRenovacao.token_hash == hash_token(token)).scalar_subquery()
+    db_session.execute(delete(TokenRenovacao).where(TokenRenovacao.familia == familia))
+
+
+# Contador de versão por tabela: incrementado na mesma transação de cada escrita (save/delete),
+# serve de ETag para as listagens sem precisar ler as linhas
+class VersaoTabela(Base):
+    __tablename__ = 'versoes_tabelas'
+    tabela = Column(String, primary_key=True)
+    versao = Column(Integer, nullable=False, default=0)
+
+def incrementar_versao(db_session, tabela):
+    db_session.execute(
+        update(VersaoTabela).where(VersaoTabela.tabela == tabela).values(versao=VersaoTabela.versao + 1)
+    )
+    db_session.info.setdefault('tabelas_alteradas', set()).add(tabela)
+
+# Funções chamadas com o conjunto de tabelas alteradas logo depois de cada commit (ex.: cache de respostas)
+ouvintes_alteracao = []
+
+@event.listens_for(local_session, 'after_commit')
+def avisar_alteracao(db_session):
+    tabelas = db_session.info.pop('tabelas_alteradas', None)
+    if tabelas:
+        for ouvinte in ouvintes_alteracao:
+            ouvinte(tabelas)
+
+@event.listens_for(local_session, 'after_rollback')
+def descartar_alteracao(db_session):
+    db_session.info.pop('tabelas_alteradas', None)
+
+def versoes_tabelas(db_session, tabelas):
+    versoes = dict(db_session.execute(
+        select(VersaoTabela.tabela, VersaoTabela.versao).where(VersaoTabela.tabela.in_(tabelas))
+    ).all())
+    return [versoes.get(tabela, 0) for tabela in tabelas]
+
+# Relacionamentos de Emprestimo que podem ser embutidos na resposta (?expand=livro,usuario)
+RELACOES_EMPRESTIMO = {'livro': Emprestimo.livros, 'usuario': Emprestimo.usuarios}
+
+def opcoes_expandir(expandir):
+    # joinedload: livro e usuário vêm na mesma consulta dos empréstimos, sem N+1
+    return [joinedload(RELACOES_EMPRESTIMO[nome]) for nome in expandir]
+
+# Estoque de exemplares: cada operação é um único UPDATE condicional, então duas retiradas simultâneas
+# do último exemplar não conseguem as duas passar (o banco serializa a escrita na mesma linha)
+def retirar_exemplar(db_session, livro_id):
+    resultado = db_session.execute(
+        update(Livro)
+        .where(Livro.id_livro == livro_id, Livro.exemplares_disponiveis > 0)
+        .values(exemplares_disponiveis=Livro.exemplares_disponiveis - 1,
+                status=Livro.exemplares_disponiveis > 1)
+        .execution_options(synchronize_session=False)
+    )
+    incrementar_versao(db_session, Livro.__tablename__)
+    return resultado.rowcount == 1
+
+def devolver_exemplar(db_session, livro_id):
+    resultado = db_session.execute(
+        update(Livro)
+        .where(Livro.id_livro == livro_id, Livro.exemplares_disponiveis < Livro.exemplares)
+        .values(exemplares_disponiveis=Livro.exemplares_disponiveis + 1, status=True)
+        .execution_options(synchronize_session=False)
+    )
+    incrementar_versao(db_session, Livro.__tablename__)
+    return resultado.rowcount == 1
+
+def ajustar_exemplares(db_session, livro_id, exemplares):
+    # Muda o total sem deixar menos exemplares do que os que estão emprestados
+    diferenca = exemplares - Livro.exemplares
+    resultado = db_session.execute(
+        update(Livro)
+        .where(Livro.id_livro == livro_id, Livro.exemplares_disponiveis + diferenca >= 0)
+        .values(exemplares=exemplares, exemplares_disponiveis=Livro.exemplares_disponiveis + diferenca,
+                status=Livro.exemplares_disponiveis + diferenca > 0)
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount == 1
+
+def registrar_emprestimo(db_session, emprestimo):
+    # Retira o exemplar e grava o empréstimo na mesma transação; devolve False (e desfaz tudo)
+    # quando o livro não tem exemplar disponível ou não existe
+    try:
+        if not retirar_exemplar(db_session, emprestimo.livro_id):
+            db_session.rollback()
+            return False
+        db_session.add(emprestimo)
+        atualizar_estatisticas(db_session, depois=valores_estatisticas(emprestimo))
+        incrementar_versao(db_session, Emprestimo.__tablename__)
+        db_session.commit()
+        return True
+    except:
+        db_session.rollback()
+        raise
+
+def registrar_devolucao(db_session, id_emprestimo, data_devolvido, usuario_id=None):
+    # Fecha o empréstimo só se ainda estiver aberto (e, se informado, for do usuário) e devolve o exemplar
+    try:
+        condicoes = [Emprestimo.id_emprestimo == id_emprestimo, Emprestimo.data_devolvido.is_(None)]
+        if usuario_id is not None:
+            condicoes.append(Emprestimo.usuario_id == usuario_id)
+        linha = db_session.execute(
+            update(Emprestimo).where(*condicoes)
+            .values(data_devolvido=data_devolvido, versao=Emprestimo.versao + 1)
+            .returning(Emprestimo.livro_id, Emprestimo.usuario_id, Emprestimo.data_emprestimo)
+        ).first()
+        if linha is None:
+            db_session.rollback()
+            return False
+        livro_id, usuario_id, data_emprestimo = linha
+        devolver_exemplar(db_session, livro_id)
+        atualizar_estatisticas(db_session, (livro_id, usuario_id, data_emprestimo, None),
+                               (livro_id, usuario_id, data_emprestimo, data_devolvido))
+        incrementar_versao(db_session, Emprestimo.__tablename__)
+        db_session.commit()
+        return True
+    except:
+        db_session.rollback()
+        raise
+
+def recalcular_exemplares(conexao):
+    # Reconstrói exemplares_disponiveis a partir dos empréstimos em aberto (migração e correção manual);
+    # um livro com mais empréstimos abertos do que exemplares passa a ter exatamente esse total
+    abertos = ("(SELECT count(*) FROM emprestimos "
+               "WHERE emprestimos.livro_id = livros.id_livro AND emprestimos.data_devolvido IS NULL)")
+    conexao.execute(text(f"UPDATE livros SET exemplares = max(exemplares, {abertos})"))
+    conexao.execute(text(
+        f"UPDATE livros SET exemplares_disponiveis = exemplares - {abertos}, status = exemplares > {abertos}"
+    ))
+
+# ---------------- ESTATÍSTICAS DE CIRCULAÇÃO ----------------
+# Contadores mantidos na mesma transação de cada escrita de empréstimo (atualizar_estatisticas), para os
+# painéis lerem só as linhas que mostram em vez de agregar a tabela de empréstimos inteira.
+# Sem ForeignKey: a linha de um livro/usuário sai junto com ele (Livro.delete, Usuario.delete)
+class EstatisticaLivro(Base):
+    __tablename__ = 'estatisticas_livros'
+    livro_id = Column(Integer, primary_key=True)
+    emprestimos = Column(Integer, nullable=False, default=0)
+    emprestimos_abertos = Column(Integer, nullable=False, default=0)
+    # "Mais emprestados" lê o fim deste índice, sem ordenar a tabela
+    __table_args__ = (Index('ix_estatisticas_livros_ranking', emprestimos, livro_id),)
+
+
+class EstatisticaUsuario(Base):
+    __tablename__ = 'estatisticas_usuarios'
+    usuario_id = Column(Integer, primary_key=True)
+    emprestimos = Column(Integer, nullable=False, default=0)
+    emprestimos_abertos = Column(Integer, nullable=False, default=0)
+    __table_args__ = (Index('ix_estatisticas_usuarios_abertos', emprestimos_abertos, usuario_id),)
+
+
+class EstatisticaDia(Base):
+    __tablename__ = 'estatisticas_dias'
+    dia = Column(Date, primary_key=True)
+    emprestimos = Column(Integer, nullable=False, default=0)  # empréstimos com data_emprestimo no dia
+    devolucoes = Column(Integer, nullable=False, default=0)  # devoluções registradas no dia
+
+
+def valores_estatisticas(emprestimo, antes=False):
+    # (livro, usuário, data do empréstimo, data da devolução) que o empréstimo conta nas estatísticas;
+    # antes=True pega os valores ainda gravados no banco de um objeto alterado nesta sessão
+    estado = inspect(emprestimo)
+    valores = []
+    for nome in ('livro_id', 'usuario_id', 'data_emprestimo', 'data_devolvido'):
+        historico = estado.attrs[nome].history
+        valores.append(historico.deleted[0] if antes and historico.deleted else getattr(emprestimo, nome))
+    return tuple(valores)
+
+# Um upsert por tabela, montado uma vez e executado só com os parâmetros: roda em toda retirada e devolução
+comandos_soma = {}
+
+def somar_estatistica(db_session, modelo, chave, deltas, limpar=False):
+    # Upsert: cria a linha com os deltas ou soma os deltas à linha existente, em um único comando.
+    # limpar=True (um empréstimo saiu da contagem) apaga a linha se todos os contadores chegaram a zero
+    comando = comandos_soma.get(modelo)
+    if comando is None:
+        tabela = modelo.__table__
+        comando = insert_sqlite(tabela)
+        comando = comandos_soma[modelo] = comando.on_conflict_do_update(
+            index_elements=list(chave),
+            set_={coluna: tabela.c[coluna] + comando.excluded[coluna] for coluna in deltas}
+        )
+    db_session.execute(comando, {**chave, **deltas})
+    if limpar:
+        db_session.execute(delete(modelo).where(
+            *(getattr(modelo, coluna) == valor for coluna, valor in chave.items()),
+            *(getattr(modelo, coluna) == 0 for coluna in deltas)
+        ))
+
+def atualizar_estatisticas(db_session, antes=None, depois=None):
+    # Tira das estatísticas o empréstimo como estava (`antes`) e soma como ficou (`depois`), cada um no
+    # formato de valores_estatisticas; só as linhas cujo saldo mudou são gravadas. Quem chama faz o commit
+    livros, usuarios, dias = {}, {}, {}
+    for valores, sinal in ((antes, -1), (depois, 1)):
+        if valores is None:
+            continue
+        livro_id, usuario_id, data_emprestimo, data_devolvido = valores
+        aberto = sinal if data_devolvido is None else 0
+        for contadores, chave in ((livros, livro_id), (usuarios, usuario_id)):
+            if chave is not None:
+                emprestimos, abertos = contadores.get(chave, (0, 0))
+                contadores[chave] = (emprestimos + sinal, abertos + aberto)
+        emprestimos, devolucoes = dias.get(data_emprestimo, (0, 0))
+        dias[data_emprestimo] = (emprestimos + sinal, devolucoes)
+        if data_devolvido is not None:
+            emprestimos, devolucoes = dias.get(data_devolvido, (0, 0))
+            dias[data_devolvido] = (emprestimos, devolucoes + sinal)
+    for livro_id, (emprestimos, abertos) in livros.items():
+        if emprestimos or abertos:
+            somar_estatistica(db_session, EstatisticaLivro, {'livro_id': livro_id},
+                              {'emprestimos': emprestimos, 'emprestimos_abertos': abertos}, emprestimos < 0)
+    for usuario_id, (emprestimos, abertos) in usuarios.items():
+        if emprestimos or abertos:
+            somar_estatistica(db_session, EstatisticaUsuario, {'usuario_id': usuario_id},
+                              {'emprestimos': emprestimos, 'emprestimos_abertos': abertos}, emprestimos < 0)
+    for dia, (emprestimos, devolucoes) in dias.items():
+        if emprestimos or devolucoes:
+            somar_estatistica(db_session, EstatisticaDia, {'dia': dia},
+                              {'emprestimos': emprestimos, 'devolucoes': devolucoes}, emprestimos < 0 or devolucoes < 0)
+
+def reconstruir_estatisticas(conexao):
+    # Recalcula as três tabelas a partir de todos os empréstimos (migração, carga em massa ou correção manual)
+    aberto = case((Emprestimo.data_devolvido.is_(None), 1), else_=0)
+    for modelo in (EstatisticaLivro, EstatisticaUsuario, EstatisticaDia):
+        conexao.execute(delete(modelo))
+    conexao.execute(insert(EstatisticaLivro).from_select(
+        ['livro_id', 'emprestimos', 'emprestimos_abertos'],
+        select(Emprestimo.livro_id, func.count(), func.sum(aberto))
+        .where(Emprestimo.livro_id.is_not(None)).group_by(Emprestimo.livro_id)
+    ))
+    conexao.execute(insert(EstatisticaUsuario).from_select(
+        ['usuario_id', 'emprestimos', 'emprestimos_abertos'],
+        select(Emprestimo.usuario_id, func.count(), func.sum(aberto))
+        .where(Emprestimo.usuario_id.is_not(None)).group_by(Emprestimo.usuario_id)
+    ))
+    eventos = union_all(
+        select(Emprestimo.data_emprestimo.label('dia'), literal_column('1').label('emprestimos'),
+               literal_column('0').label('devolucoes')),
+        select(Emprestimo.data_devolvido, literal_column('0'), literal_column('1'))
+        .where(Emprestimo.data_devolvido.is_not(None)),
+    ).subquery()
+    conexao.execute(insert(EstatisticaDia).from_select(
+        ['dia', 'emprestimos', 'devolucoes'],
+        select(eventos.c.dia, func.sum(eventos.c.emprestimos), func.sum(eventos.c.devolucoes)).group_by(eventos.c.dia)
+    ))
+    incrementar_versao(conexao, Emprestimo.__tablename__)
+
+def violacao_integridade(erro):
+    # Classifica um IntegrityError em 'chave_estrangeira' ou 'unicidade' (SQLite pela mensagem, Postgres pelo código)
+    codigo = getattr(erro.orig, 'pgcode', None)
+    mensagem = str(erro.orig)
+    if codigo == '23503' or 'FOREIGN KEY constraint failed' in mensagem:
+        return 'chave_estrangeira'
+    if codigo == '23505' or 'UNIQUE constraint failed' in mensagem:
+        return 'unicidade'
+    return None
+
+# Busca textual: tabela FTS5 com titulo, autor e resumo, mantida junto com Livro.save/delete
+def indexar_livro(db_session, livro):
+    desindexar_livro(db_session, livro.id_livro)
+    db_session.execute(
+        text("INSERT INTO livros_fts (rowid, titulo, autor, resumo) VALUES (:id, :titulo, :autor, :resumo)"),
+        {"id": livro.id_livro, "titulo": livro.titulo, "autor": livro.autor, "resumo": livro.resumo or ''}
+    )
+
+def desindexar_livro(db_session, id_livro):
+    db_session.execute(text("DELETE FROM livros_fts WHERE rowid = :id"), {"id": id_livro})
+
+def buscar_livros(db_session, termo, limite):
+    # Cada palavra vira um prefixo entre aspas para que a sintaxe do FTS5 não quebre a consulta
+    termos = ' '.join('"%s"*' % palavra.replace('"', '""') for palavra in termo.split())
+    consulta = select(Livro).from_statement(text(
+        "SELECT livros.* FROM livros_fts JOIN livros ON livros.id_livro = livros_fts.rowid "
+        "WHERE livros_fts MATCH :termos "
+        "ORDER BY bm25(livros_fts, 10.0, 5.0, 1.0) LIMIT :limite"
+    ))
+    return db_session.execute(consulta, {"termos": termos, "limite": limite}).scalars().all()
+
+# Carga em lote: um INSERT de várias linhas (com RETURNING dos ids) e uma única transação por lote.
+# ON CONFLICT DO NOTHING pula o ISBN que outra requisição gravou depois da conferência do lote; a linha
+# pulada volta como None (os ISBNs de um lote são distintos, então o RETURNING é casado pelo ISBN)
+def inserir_livros(db_session, linhas):
+    try:
+        inseridos = dict(db_session.execute(
+            insert_sqlite(Livro).on_conflict_do_nothing().returning(Livro.ISBN, Livro.id_livro),
+            linhas
+        ).all())
+        ids = [inseridos.get(linha['ISBN']) for linha in linhas]
+        if inseridos:
+            db_session.execute(
+                text("INSERT INTO livros_fts (rowid, titulo, autor, resumo) VALUES (:id, :titulo, :autor, :resumo)"),
+                [{"id": id_livro, "titulo": linha['titulo'], "autor": linha['autor'], "resumo": linha['resumo'] or ''}
+                 for id_livro, linha in zip(ids, linhas) if id_livro is not None]
+            )
+            incrementar_versao(db_session, Livro.__tablename__)
+        db_session.commit()
+        return ids
+    except:
+        db_session.rollback()
+        raise
+
+def isbns_cadastrados(db_session, isbns):
+    return set(db_session.execute(select(Livro.ISBN).where(Livro.ISBN.in_(isbns))).scalars())
+
+# Paginação por chave (keyset): o custo de cada página não depende da profundidade
+def paginar(db_session, consulta, coluna_id, limite, cursor=None):
+    if cursor is not None:
+        consulta = consulta.where(coluna_id > cursor)
+    consulta = consulta.order_by(coluna_id).limit(limite + 1)
+    itens = db_session.execute(consulta).scalars().all()
+    proximo_cursor = None
+    if len(itens) > limite:
+        itens = itens[:limite]
+        proximo_cursor = getattr(itens[-1], coluna_id.key)
+    return itens, proximo_cursor
+
+def listar_atrasados(db_session, referencia, limite, cursor=None, usuario_id=None):
+    # Empréstimos em aberto com devolução prevista antes de `referencia`, do mais atrasado para o menos.
+    # Filtro e ordem são os do índice parcial ix_emprestimos_abertos_devolucao, então cada página lê só
+    # as suas linhas do índice; o cursor "AAAA-MM-DD.id" continua de onde a página anterior parou
+    consulta = select(Emprestimo).where(Emprestimo.data_devolvido.is_(None),
+                                        Emprestimo.data_devolucao < referencia)
+    if usuario_id is not None:
+        consulta = consulta.where(Emprestimo.usuario_id == usuario_id)
+    if cursor is not None:
+        data_cursor, id_cursor = cursor.split('.')
+        consulta = consulta.where(tuple_(Emprestimo.data_devolucao, Emprestimo.id_emprestimo) >
+                                  tuple_(date.fromisoformat(data_cursor), int(id_cursor)))
+    consulta = consulta.order_by(Emprestimo.data_devolucao, Emprestimo.id_emprestimo).limit(limite + 1)
+    itens = db_session.execute(consulta).scalars().all()
+    proximo_cursor = None
+    if len(itens) > limite:
+        itens = itens[:limite]
+        proximo_cursor = f'{itens[-1].data_devolucao.isoformat()}.{itens[-1].id_emprestimo}'
+    return itens, proximo_cursor
+
+# create_all não altera tabelas que já existem: adiciona as colunas e índices novos dos modelos
+def migrar_colunas(conexao):
+    # Devolve as colunas adicionadas como "tabela.coluna", para o init_db preencher o que precisar
+    inspetor = inspect(conexao)
+    adicionadas = set()
+    for tabela in Base.metadata.sorted_tables:
+        existentes = {coluna['name'] for coluna in inspetor.get_columns(tabela.name)}
+        for coluna in tabela.columns:
+            if coluna.name in existentes:
+                continue
+            definicao = conexao.dialect.ddl_compiler(conexao.dialect, None).get_column_specification(coluna)
+            conexao.execute(text(f'ALTER TABLE {tabela.name} ADD COLUMN {definicao}'))
+            adicionadas.add(f'{tabela.name}.{coluna.name}')
+        for indice in tabela.indexes:
+            if indice.name == 'ux_emprestimos_ativos':
+                migrar_emprestimos_ativos(conexao, indice)
+            else:
+                indice.create(conexao, checkfirst=True)
+    return adicionadas
+
+def migrar_emprestimos_ativos(conexao, indice):
+    # Bancos anteriores podem ter o mesmo livro em aberto duas vezes para o mesmo usuário (ou ganhar agora
+    # a coluna data_devolvido, com todo o histórico em aberto); aí o índice único não pode ser criado.
+    # Como em migrar_isbn_unico: avisa e tenta de novo na próxima inicialização, depois da correção
+    existe = conexao.execute(text(
+        "SELECT 1 FROM pragma_index_list('emprestimos') WHERE name = 'ux_emprestimos_ativos'")).first()
+    if existe:
+        return
+    repetidos = conexao.execute(text(
+        "SELECT livro_id, usuario_id FROM emprestimos WHERE data_devolvido IS NULL "
+        "GROUP BY livro_id, usuario_id HAVING count(*) > 1 LIMIT 10")).all()
+    if repetidos:
+        log.warning("Empréstimos em aberto repetidos (livro, usuário): %s; ux_emprestimos_ativos não foi criado "
+                    "até a correção", ', '.join(f'({livro_id}, {usuario_id})' for livro_id, usuario_id in repetidos))
+        return
+    indice.create(conexao)
+
+def migrar_isbn_unico(conexao):
+    # Bancos anteriores têm ix_livros_ISBN sem UNIQUE, e create_all não recria índice que já existe.
+    # Com ISBNs repetidos já gravados o índice único não pode ser criado: avisa e tenta de novo na próxima
+    # inicialização, depois que os repetidos forem corrigidos
+    unico = conexao.execute(text(
+        "SELECT \"unique\" FROM pragma_index_list('livros') WHERE name = 'ix_livros_ISBN'")).scalar()
+    if unico:
+        return
+    repetidos = conexao.execute(text(
+        'SELECT "ISBN" FROM livros GROUP BY "ISBN" HAVING count(*) > 1 LIMIT 10')).scalars().all()
+    if repetidos:
+        log.warning("ISBNs repetidos (%s); ix_livros_ISBN segue sem UNIQUE até a correção", ', '.join(repetidos))
+        return
+    conexao.execute(text('DROP INDEX IF EXISTS "ix_livros_ISBN"'))
+    conexao.execute(text('CREATE UNIQUE INDEX "ix_livros_ISBN" ON livros ("ISBN")'))
+
+# Migrações de dados que não dependem de coluna nova; a versão aplicada fica no PRAGMA user_version do banco
+VERSAO_ESQUEMA = 2
+
+def migrar_datas(conexao):
+    # Versão 1: as datas dos empréstimos eram String "DD/MM/AAAA" e passam a ser Date ("AAAA-MM-DD"), que o
+    # SQLite compara e indexa em ordem cronológica. O tipo declarado das colunas antigas fica como estava
+    # (o SQLite só o trocaria recriando a tabela) e não faz diferença: ele guarda o texto do mesmo jeito.
+    # O índice simples de data_devolvido sai: sem estatísticas o planejador o preferia ao índice parcial
+    # de atrasados, e toda consulta por data_devolvido é "IS NULL", que os índices parciais já cobrem
+    # Uma data que ler_data não entende (ex.: "31/02/2024") fica como estava e sai no log com o id do
+    # empréstimo, para correção manual, em vez de impedir a API de subir
+    conexao.execute(text('DROP INDEX IF EXISTS ix_emprestimos_data_devolvido'))
+    for coluna in ('data_emprestimo', 'data_devolucao', 'data_devolvido'):
+        linhas = conexao.execute(text(f"SELECT id_emprestimo, {coluna} FROM emprestimos WHERE {coluna} LIKE '%/%'")).all()
+        convertidas, invalidas = [], []
+        for id_emprestimo, valor in linhas:
+            try:
+                convertidas.append({'id': id_emprestimo, 'valor': ler_data(valor).isoformat()})
+            except ValueError:
+                invalidas.append(id_emprestimo)
+        if convertidas:
+            conexao.execute(text(f"UPDATE emprestimos SET {coluna} = :valor WHERE id_emprestimo = :id"), convertidas)
+        if invalidas:
+            log.warning("%s em formato inválido nos empréstimos %s; ficaram sem conversão", coluna,
+                        ', '.join(map(str, invalidas)))
+
 # Função para criar as tabelas
 def init_db():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conexao:
+        adicionadas = migrar_colunas(conexao)
+        # O B-tree de resumo saiu do modelo (não serve para busca por palavra), mas create_all não apaga
+        # índices de bancos já criados
+        conexao.execute(text('DROP INDEX IF EXISTS ix_livros_resumo'))
+        migrar_isbn_unico(conexao)
+        # Refresh tokens vencidos de quem não voltou a fazer login (os demais saem em emitir_token_renovacao)
+        conexao.execute(delete(TokenRenovacao).where(TokenRenovacao.expira_em <= agora_utc()))
+        limpar_tokens_revogados(conexao)
+        if 'livros.exemplares_disponiveis' in adicionadas:
+            recalcular_exemplares(conexao)
+        versao_esquema = conexao.execute(text('PRAGMA user_version')).scalar()
+        if versao_esquema < 1:
+            migrar_datas(conexao)
+        if versao_esquema < 2:
+            # Versão 2: tabelas de estatísticas, preenchidas com o histórico que já existe
+            reconstruir_estatisticas(conexao)
+        if versao_esquema < VERSAO_ESQUEMA:
+            conexao.execute(text(f'PRAGMA user_version = {VERSAO_ESQUEMA}'))
+        for tabela in (Livro.__tablename__, Usuario.__tablename__, Emprestimo.__tablename__):
+            conexao.execute(text("INSERT OR IGNORE INTO versoes_tabelas (tabela, versao) VALUES (:tabela, 0)"),
+                            {"tabela": tabela})
+        existe = conexao.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'livros_fts'")).first()
+        if not existe:
+            conexao.execute(text(
+                "CREATE VIRTUAL TABLE livros_fts USING fts5("
+                "titulo, autor, resumo, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+            conexao.execute(text(
+                "INSERT INTO livros_fts (rowid, titulo, autor, resumo) "
+                "SELECT id_livro, titulo, autor, coalesce(resumo, '') FROM livros"
+            ))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+# senhas.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Algoritmo e custo no formato do werkzeug ("scrypt:N:r:p" ou "pbkdf2:sha256:iteracoes").
+# Hashes gravados com outro método são refeitos no próximo login (ver Usuario.precisa_rehash)
+METODO_SENHA = os.environ.get('SENHA_METODO', 'scrypt:32768:8:1')
+
+# O hash roda em poucas threads dedicadas (hashlib libera o GIL durante o cálculo) e a fila é limitada:
+# um pico de logins espera ou recebe 503, mas não ocupa todas as threads que atendem as outras rotas.
+# Cada login na fila prende uma thread de requisição enquanto espera, então calculando + na fila cabem
+# no máximo as threads do worker menos uma (GUNICORN_THREADS, o mesmo valor do gunicorn.conf.py);
+# a espera curta devolve o 503 antes de o cliente e o timeout do gunicorn desistirem
+THREADS_REQUISICAO = int(os.environ.get('GUNICORN_THREADS', 4))
+VAGAS_SENHA = max(1, THREADS_REQUISICAO - 1)
+TRABALHADORES_SENHA = min(int(os.environ.get('SENHA_TRABALHADORES', 2)), VAGAS_SENHA)
+FILA_SENHA = int(os.environ.get('SENHA_FILA', VAGAS_SENHA - TRABALHADORES_SENHA))
+ESPERA_SENHA = float(os.environ.get('SENHA_ESPERA', 2))
+
+executor_senhas = ThreadPoolExecutor(max_workers=TRABALHADORES_SENHA, thread_name_prefix='hash-senha')
+vagas_senhas = threading.BoundedSemaphore(TRABALHADORES_SENHA + FILA_SENHA)
+
+
+class SobrecargaSenha(Exception):
+    """Fila de hash de senhas cheia (ou espera esgotada); a rota deve responder 503."""
+
+
+def _executar(funcao, *args):
+    if not vagas_senhas.acquire(blocking=False):
+        raise SobrecargaSenha()
+    try:
+        tarefa = executor_senhas.submit(funcao, *args)
+    except BaseException:
+        vagas_senhas.release()
+        raise
+    # A vaga volta quando a tarefa termina (ou é cancelada ainda na fila), e não quando a requisição
+    # desiste de esperar: o executor nunca acumula mais que TRABALHADORES_SENHA + FILA_SENHA tarefas
+    tarefa.add_done_callback(lambda _: vagas_senhas.release())
+    try:
+        return tarefa.result(timeout=ESPERA_SENHA)
+    except TimeoutError:
+        # Ainda na fila: sai dela; já calculando: termina e só então libera a vaga
+        tarefa.cancel()
+        raise SobrecargaSenha()
+
+
+def gerar_hash(senha):
+    return _executar(generate_password_hash, senha, METODO_SENHA)
+
+
+def verificar_hash(senha_hash, senha):
+    return _executar(check_password_hash, senha_hash, senha)
+
+
+def hash_desatualizado(senha_hash):
+    return not senha_hash.startswith(METODO_SENHA + '$')
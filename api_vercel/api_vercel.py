@@ -1,17 +1,57 @@
-from flask import Flask, jsonify, request, redirect
-from flask_pydantic_spec import FlaskPydanticSpec
+from flask import Flask, jsonify, request, redirect, abort
 from sqlalchemy.exc import IntegrityError
 
 from models_vercel import *
 from sqlalchemy import select
 
 app = Flask(__name__)
-spec = FlaskPydanticSpec('flask',
-                         title='Livraria API - SENAI',
-                         version='1.0.0')
-spec.register(app)
 app.config['SECRET_KEY'] = 'chave_secretinha'
 
+# ---------------- DOCUMENTAÇÃO ----------------
+# O FlaskPydanticSpec (e o pydantic que vem com ele) só é importado quando alguém abre a documentação,
+# e não em todo cold start; as rotas /apidoc/... são as mesmas que spec.register(app) criaria
+spec = None
+
+def obter_spec():
+    global spec
+    if spec is None:
+        from flask_pydantic_spec import FlaskPydanticSpec
+        spec = FlaskPydanticSpec('flask',
+                                 title='Livraria API - SENAI',
+                                 version='1.0.0')
+        spec.register(app, register_route=False)
+    return spec
+
+@app.route('/apidoc/openapi.json', endpoint='openapi')
+def openapi():
+    return jsonify(obter_spec().spec)
+
+@app.route('/apidoc/<pagina>')
+def pagina_documentacao(pagina):
+    from flask_pydantic_spec.page import PAGES
+    if pagina not in PAGES:
+        abort(404)
+    return PAGES[pagina].format(obter_spec().config)
+
+# ---------------- VALIDAÇÃO ----------------
+# Recebem request.args / o corpo já lido, sem depender do request do Flask: api_vercel_async.py (Quart)
+# importa os mesmos
+def limite_busca(args):
+    # `limit` da busca (padrão 100, máximo 1000); inválido gera ValueError (400)
+    limite = int(args.get('limit', 100))
+    if limite < 1:
+        raise ValueError("limit deve ser maior que zero")
+    return min(limite, 1000)
+
+def ler_usuario(dados_usuario):
+    # (nome, CPF formatado, endereço) do corpo do cadastro, ou None se faltar campo ou o CPF não tiver 11 dígitos
+    nome = dados_usuario['nome']
+    cpf = str(dados_usuario["CPF"])
+    endereco = dados_usuario["endereco"]
+    if not nome or not cpf or not endereco or len(cpf) != 11:
+        return None
+    return nome, '{0}.{1}.{2}-{3}'.format(cpf[:3], cpf[3:6], cpf[6:9], cpf[9:]), endereco
+
 @app.route('/')
 def index():
     """
@@ -101,6 +141,39 @@ def listar_livro():
         db_session.close()
 
 
+@app.route('/livros/busca', methods=['GET'])
+def buscar_livro():
+    """
+            Buscar livros por texto
+
+            ### Endpoint:
+                GET /livros/busca?q=<termos>&limit=<n>
+
+            ### Parâmetros:
+            - `q` **(str)**: **palavras procuradas no título, autor e resumo**
+            - `limit` **(int)**: **quantidade máxima de livros (padrão 100, máximo 1000)**
+
+            ### Erros possíveis:
+            - **Bad Request**: *status code* **400**
+
+            ### Retorna:
+            - **JSON** com a lista de livros encontrados, do mais relevante para o menos relevante
+        """
+    db_session = local_session()
+    try:
+        termo = request.args.get('q', '').strip()
+        if not termo:
+            return jsonify({"mensagem": "Informe o parâmetro q."}), 400
+        lista = buscar_livros(db_session, termo, limite_busca(request.args))
+        return jsonify({"livros": [livro.serialize() for livro in lista]})
+    except ValueError:
+        return jsonify({"mensagem": "Formato inválido."}), 400
+    except Exception as e:
+        return jsonify({"mensagem": str(e)}), 500
+    finally:
+        db_session.close()
+
+
 @app.route('/livros/<int:id_livro>', methods=['PUT'])
 def editar_livro(id_livro):
     """
@@ -185,14 +258,11 @@ def cadastrar_usuario():
     try:
         dados_usuario = request.get_json()
         # Captura os valores dos campos do formulário
-        nome = dados_usuario['nome']
-        CPF = dados_usuario["CPF"]
-        endereco = dados_usuario["endereco"]
-        cpf = str(CPF)
-        if not nome or not cpf or not endereco or len(cpf) != 11:
+        usuario = ler_usuario(dados_usuario)
+        if usuario is None:
             return jsonify({'result': 'Error. Integrity Error (faltam informações) '}), 400
         else:
-            cpf_f = '{0}.{1}.{2}-{3}'.format(cpf[:3], cpf[3:6], cpf[6:9], cpf[9:])
+            nome, cpf_f, endereco = usuario
             post = Usuario(nome=nome, CPF=cpf_f, endereco=endereco)
             post.save(db_session)
             db_session.close()
@@ -1,39 +1,120 @@
-from sqlalchemy import create_engine, Column, String, Integer, ForeignKey
+from sqlalchemy import create_engine, Column, String, Integer, ForeignKey, Index, select, func, literal_column, text
+from sqlalchemy.dialects import postgresql  # registra to_tsvector/ts_rank do Postgres
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base, relationship
-from dotenv import load_dotenv
 import os  # criar variavel de ambiente '.env'
-import configparser  # criar arquivo de configuração 'config.ini'
+import threading
+import uuid
 
 # configurar banco api_vercel
-# ler variavel de ambiente
-load_dotenv()
-# Carregue as configurações do banco de dados
-url_ = os.environ.get("DATABASE_URL")
-print(f"modo1:{url_}")
-
-# Carregue o arquivo de configuração
-config = configparser.ConfigParser()
-config.read('config.ini')
-# Obtenha as configurações do banco de dados
-database_url = config['database']['url']
-print(f"mode2:{database_url}")
-
-engine = create_engine(database_url)  # conectar Vercel
+# Na Vercel cada cold start paga a importação do módulo; por isso a leitura do .env e do config.ini
+# e a criação da engine só acontecem na primeira requisição que usa o banco (obter_engine)
+def url_banco():
+    # dotenv e configparser só são importados aqui, fora do caminho da importação
+    from dotenv import load_dotenv
+    import configparser  # criar arquivo de configuração 'config.ini'
+
+    # ler variavel de ambiente
+    load_dotenv()
+    # Carregue as configurações do banco de dados
+    url_ = os.environ.get("DATABASE_URL")
+    print(f"modo1:{url_}")
+
+    # Carregue o arquivo de configuração
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    # Obtenha as configurações do banco de dados
+    database_url = config['database']['url']
+    print(f"mode2:{database_url}")
+    return database_url
+
+
+# Modo de conexão com o banco (variável BANCO_MODO_CONEXAO):
+# - 'serverless' (padrão na Vercel): pool mínimo com pre-ping; a engine fica no módulo, então uma instância
+#   "quente" reaproveita a conexão entre invocações, e o pre-ping descarta a que o Neon fechou enquanto ela dormia
+# - 'sem_pool': NullPool, abre e fecha uma conexão por sessão (o PgBouncer do Neon é quem faz o pool)
+# - 'pool': QueuePool padrão do SQLAlchemy, para um servidor comum de longa duração
+MODO_CONEXAO = os.environ.get('BANCO_MODO_CONEXAO') or ('serverless' if os.environ.get('VERCEL') else 'pool')
+POOL_SERVERLESS = {
+    'pool_size': 1,
+    'max_overflow': 2,
+    'pool_pre_ping': True,
+    'pool_recycle': 300,  # segundos; bem antes do Neon suspender o compute ocioso
+}
+
+def argumentos_engine(url, modo=None):
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.pool import NullPool
+
+    modo = modo or MODO_CONEXAO
+    url = make_url(url)
+    argumentos = {}
+    if modo == 'sem_pool':
+        argumentos['poolclass'] = NullPool
+    elif modo == 'serverless':
+        argumentos.update(POOL_SERVERLESS)
+    elif modo != 'pool':
+        raise ValueError(f"modo de conexão desconhecido: {modo}")
+
+    # O endpoint -pooler do Neon é um PgBouncer em modo transaction: cada transação pode cair em outra
+    # conexão do servidor, então os drivers não podem guardar statements preparados no servidor.
+    # O psycopg2 não prepara statements; psycopg 3 e asyncpg precisam ter o cache desligado
+    if '-pooler' in (url.host or '') or os.environ.get('BANCO_POOLER') == '1':
+        driver = url.get_driver_name()
+        if driver == 'psycopg':
+            argumentos['connect_args'] = {'prepare_threshold': None}
+        elif driver == 'asyncpg':
+            argumentos['connect_args'] = {
+                'statement_cache_size': 0,
+                'prepared_statement_cache_size': 0,
+                # nomes únicos: outro cliente pode ter deixado um statement com o mesmo nome na conexão do servidor
+                'prepared_statement_name_func': lambda: f'__asyncpg_{uuid.uuid4()}__',
+            }
+    return argumentos
+
+
+engine = None
+trava_engine = threading.Lock()
+
+def obter_engine():
+    global engine
+    if engine is None:
+        with trava_engine:
+            if engine is None:
+                url = url_banco()
+                engine = create_engine(url, **argumentos_engine(url))  # conectar Vercel
+    return engine
 
 ## configurar a conexão de banco
 # engine = create_engine("sqlite:///banco.db")
-local_session = sessionmaker(bind=engine)
+fabrica_sessao = sessionmaker()
+
+def local_session():
+    return fabrica_sessao(bind=obter_engine())
 
 Base = declarative_base()
 # Base.query = db_session.query_property()
 
+# Busca textual no Postgres: tsvector ponderado (titulo > autor > resumo) com índice GIN na mesma expressão
+idioma_busca = literal_column("'portuguese'::regconfig")
+
+def documento_livro(titulo, autor, resumo):
+    return (
+        func.setweight(func.to_tsvector(idioma_busca, titulo), literal_column("'A'")).op('||')(
+            func.setweight(func.to_tsvector(idioma_busca, autor), literal_column("'B'"))).op('||')(
+            func.setweight(func.to_tsvector(idioma_busca, func.coalesce(resumo, literal_column("''"))),
+                           literal_column("'C'")))
+    )
+
 class Livro(Base):
     __tablename__ = 'livros'
     id_livro = Column(Integer, primary_key=True)
     titulo = Column(String, nullable=False, index=True)
     autor = Column(String, nullable=False, index=True)
     ISBN = Column(String(13), nullable=False, index=True)
-    resumo = Column(String, index=True)
+    resumo = Column(String)
+    __table_args__ = (
+        Index('ix_livros_busca', documento_livro(titulo, autor, resumo), postgresql_using='gin'),
+    )
 
     def __repr__(self):
         return f'<Livro(Título={self.titulo}, id{self.id_livro})>'
@@ -65,6 +146,18 @@ class Livro(Base):
         return var_livro
 
 
+def buscar_livros(db_session, termo, limite):
+    documento = documento_livro(Livro.titulo, Livro.autor, Livro.resumo)
+    consulta_ts = func.plainto_tsquery(idioma_busca, termo)
+    consulta = (
+        select(Livro)
+        .where(documento.op('@@')(consulta_ts))
+        .order_by(func.ts_rank(documento, consulta_ts).desc())
+        .limit(limite)
+    )
+    return db_session.execute(consulta).scalars().all()
+
+
 class Usuario(Base):
     __tablename__ = 'usuarios'
     id_usuario = Column(Integer, primary_key=True)
@@ -141,7 +234,14 @@ class Emprestimo(Base):
         return var_emprestimo
 
 def init_db():
+    engine = obter_engine()
     Base.metadata.create_all(bind=engine)
+    # create_all não cria índices novos em tabelas que já existem
+    for indice in Livro.__table__.indexes:
+        indice.create(bind=engine, checkfirst=True)
+    # ...nem apaga os que saíram do modelo, como o B-tree de resumo
+    with engine.begin() as conexao:
+        conexao.execute(text('DROP INDEX IF EXISTS ix_livros_resumo'))
 
 if __name__ == '__main__':
     init_db()
\ No newline at end of file
@@ -0,0 +1,42 @@
+# models_vercel_async.py
+import threading
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from models_vercel import url_banco, argumentos_engine
+
+
+def url_asyncpg(url):
+    # A URL do config.ini é a do psycopg2; o asyncpg não entende `sslmode` na query e recebe `ssl` como argumento
+    url = make_url(url)
+    connect_args = {}
+    sslmode = url.query.get('sslmode')
+    if sslmode:
+        url = url.difference_update_query(['sslmode'])
+        connect_args['ssl'] = sslmode
+    return url.set(drivername='postgresql+asyncpg'), connect_args
+
+
+# Como obter_engine em models_vercel.py: o .env/config.ini só é lido e a engine só é criada na primeira
+# sessão, e não na importação do módulo
+engine_async = None
+trava_engine_async = threading.Lock()
+
+def obter_engine_async():
+    global engine_async
+    if engine_async is None:
+        with trava_engine_async:
+            if engine_async is None:
+                url_async, argumentos_conexao = url_asyncpg(url_banco())
+                # Mesmo modo de conexão da engine síncrona (pool, cache de statements com o PgBouncer)
+                argumentos = argumentos_engine(url_async)
+                argumentos['connect_args'] = {**argumentos.get('connect_args', {}), **argumentos_conexao}
+                engine_async = create_async_engine(url_async, **argumentos)  # conectar Neon com asyncpg
+    return engine_async
+
+# expire_on_commit=False: depois do commit os objetos continuam legíveis sem um novo SELECT (que exigiria await)
+fabrica_sessao_async = async_sessionmaker(expire_on_commit=False)
+
+def async_session():
+    return fabrica_sessao_async(bind=obter_engine_async())
@@ -0,0 +1,158 @@
+# benchmark_asgi.py
+# Compara a api_local síncrona (Flask, servidor WSGI com uma thread por requisição) com a versão ASGI
+# (api_async.py no Quart + Hypercorn, sessões assíncronas com aiosqlite) sobre o mesmo banco e as mesmas rotas.
+# Os dois servidores sobem um de cada vez em processos separados; o cliente httpx mantém `--conexoes`
+# requisições em paralelo e mede vazão e latência de cada servidor.
+#
+# Uso: python benchmarks/benchmark_asgi.py [--conexoes 64] [--segundos 10] [--livros 20000] [--usuarios 2000]
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PASTA_API = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_local')
+
+SERVIDORES = {
+    'wsgi (flask)': lambda porta: [sys.executable, '-c',
+                                   f'from api_local import app; app.run(port={porta}, threaded=True)'],
+    'asgi (quart)': lambda porta: [sys.executable, '-m', 'hypercorn', 'api_async:app',
+                                   '--bind', f'127.0.0.1:{porta}'],
+}
+
+
+def preparar(pasta, livros, usuarios):
+    # models_local usa um caminho relativo; o banco de teste fica na pasta temporária
+    os.chdir(pasta)
+    sys.path.insert(0, PASTA_API)
+    from sqlalchemy import insert
+    from models_local import Base, Livro, Usuario, Emprestimo, engine, init_db
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Livro), [
+            {'titulo': f'Livro {i}', 'autor': f'Autor {i % 500}', 'ISBN': f'{i:013d}', 'resumo': 'resumo ' * 20}
+            for i in range(livros)
+        ])
+        conexao.execute(insert(Usuario), [
+            {'nome': f'Usuario {i}', 'email': f'usuario{i}@email.com', 'CPF': f'{i:011d}', 'endereco': 'Rua A'}
+            for i in range(usuarios)
+        ])
+        conexao.execute(insert(Emprestimo), [
+            {'data_emprestimo': '01/01/2025', 'data_devolucao': '15/01/2025',
+             'livro_id': random.randint(1, livros), 'usuario_id': i + 1}
+            for i in range(usuarios)
+        ])
+    init_db()  # cria e preenche o índice de busca
+    engine.dispose()
+
+
+def rotas(livros):
+    return [
+        lambda: f'/livros?limit=50&after={random.randint(0, livros)}',
+        lambda: f'/livros/busca?q=autor {random.randint(0, 499)}&limit=20',
+        lambda: '/usuarios?limit=50',
+        lambda: '/emprestimos?limit=50&expand=livro,usuario',
+    ]
+
+
+async def esperar_servidor(url, processo):
+    async with httpx.AsyncClient() as cliente:
+        for _ in range(200):
+            if processo.poll() is not None:
+                raise RuntimeError('servidor terminou antes de responder')
+            try:
+                await cliente.get(url + '/usuarios?limit=1')
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError('servidor não respondeu')
+
+
+async def carga(url, conexoes, segundos, livros):
+    latencias = []
+    erros = 0
+    geradores = rotas(livros)
+    limites = httpx.Limits(max_connections=conexoes, max_keepalive_connections=conexoes)
+
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=30) as cliente:
+        fim = time.monotonic() + segundos
+
+        async def trabalhador():
+            nonlocal erros
+            while time.monotonic() < fim:
+                inicio = time.perf_counter()
+                try:
+                    resposta = await cliente.get(random.choice(geradores)())
+                    if resposta.status_code >= 500:
+                        erros += 1
+                        continue
+                except httpx.HTTPError:
+                    erros += 1
+                    continue
+                latencias.append(time.perf_counter() - inicio)
+
+        await asyncio.gather(*(trabalhador() for _ in range(conexoes)))
+    return latencias, erros
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def medir(nome, comando, pasta, porta, args):
+    processo = subprocess.Popen(comando(porta), cwd=pasta, env=dict(os.environ, PYTHONPATH=PASTA_API),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{porta}'
+    try:
+        asyncio.run(esperar_servidor(url, processo))
+        asyncio.run(carga(url, args.conexoes, 1, args.livros))  # aquecimento: pool e caches de página
+        latencias, erros = asyncio.run(carga(url, args.conexoes, args.segundos, args.livros))
+    finally:
+        processo.terminate()
+        processo.wait()
+    latencias.sort()
+    return {
+        'servidor': nome,
+        'req/s': len(latencias) / args.segundos,
+        'p50 ms': percentil(latencias, 50) * 1000,
+        'p95 ms': percentil(latencias, 95) * 1000,
+        'p99 ms': percentil(latencias, 99) * 1000,
+        'erros': erros,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conexoes', type=int, default=64)
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--livros', type=int, default=20000)
+    parser.add_argument('--usuarios', type=int, default=2000)
+    parser.add_argument('--porta', type=int, default=5050)
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix='bench_asgi_')
+    try:
+        preparar(pasta, args.livros, args.usuarios)
+        resultados = [medir(nome, comando, pasta, args.porta + i, args)
+                      for i, (nome, comando) in enumerate(SERVIDORES.items())]
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    print(f'{args.conexoes} conexões, {args.segundos:.0f}s por servidor, {args.livros} livros')
+    print(f"{'servidor':<14}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'erros':>8}")
+    for r in resultados:
+        print(f"{r['servidor']:<14}{r['req/s']:>10.1f}{r['p50 ms']:>10.1f}{r['p95 ms']:>10.1f}"
+              f"{r['p99 ms']:>10.1f}{r['erros']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,573 @@
+# benchmark_carga.py
+# Teste de carga de todas as rotas da api_local (sem autenticação) e da api_token (JWT).
+# Para cada API: cria um banco numa pasta temporária, sobe o servidor em outro processo (werkzeug com threads
+# ou gunicorn com ../gunicorn.conf.py) e dispara clientes httpx simultâneos de três perfis:
+#   leitor   - listagens, busca, relatórios e estatísticas
+#   escritor - cadastros, edições, empréstimos e devoluções (na api_token, como usuário comum)
+#   admin    - edições e exclusões administrativas, exportações, login/refresh/logout
+# Cada cliente da api_token começa com POST /login e volta a ele depois de um /logout.
+#
+# Mede por rota: requisições, req/s, latência p50/p95/p99, consultas ao banco por requisição e status.
+# As consultas são contadas no servidor (before_cursor_execute da engine) e voltam no cabeçalho X-Consultas;
+# nas exportações em stream só entram as consultas feitas antes do primeiro byte.
+# O resultado vai para um JSON com o commit atual, para comparar execuções (--comparar outro.json).
+#
+# Uso: python benchmarks/benchmark_carga.py [--apis api_local,api_token] [--clientes leitor=16,escritor=8,admin=2]
+#          [--segundos 20] [--livros 20000] [--usuarios 2000] [--emprestimos 20000] [--servidor werkzeug|gunicorn]
+#          [--saida carga.json] [--comparar carga_anterior.json] [--semente 42]
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+PASTA_RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PASTA_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SENHA = 'senha-carga'
+# Linhas extras de cada tabela reservadas para as rotas DELETE (cada uma é apagada uma única vez)
+DESCARTAVEIS = 2000
+
+
+# ---------------- LADO DO SERVIDOR (roda no processo da API) ----------------
+def importar_api():
+    # Os dois apps têm módulos com o mesmo nome (api_local, models_local): cada processo importa só um
+    sys.path.insert(0, os.environ['CARGA_PASTA_API'])
+    import api_local
+    import models_local
+    return api_local, models_local
+
+
+def app_instrumentada():
+    # Fábrica usada pelo gunicorn ("benchmark_carga:app_instrumentada()") e pelo modo --interno-servir
+    from sqlalchemy import event
+    api, models = importar_api()
+    contagem = threading.local()
+
+    @event.listens_for(models.engine, 'before_cursor_execute')
+    def contar(*args):
+        contagem.consultas = getattr(contagem, 'consultas', 0) + 1
+
+    # Inserido antes dos outros before_request para zerar a contagem no início de cada requisição
+    api.app.before_request_funcs.setdefault(None, []).insert(0, lambda: setattr(contagem, 'consultas', 0))
+
+    @api.app.after_request
+    def informar(resposta):
+        resposta.headers['X-Consultas'] = str(getattr(contagem, 'consultas', 0))
+        return resposta
+
+    return api.app
+
+
+def carimbo_cpf(numero):
+    cpf = f'{numero:011d}'
+    return f'{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}'
+
+
+def livro_do_emprestimo(indice, livros):
+    # Livro e usuário de cada empréstimo semeado seguem uma fórmula, para os clientes editarem
+    # empréstimos existentes sem mudar de livro/usuário
+    return (indice * 7919) % livros + 1
+
+
+def semear(nome_api, livros, usuarios, emprestimos):
+    from sqlalchemy import insert
+    sys.path.insert(0, os.environ['CARGA_PASTA_API'])
+    import models_local as models
+    models.Base.metadata.create_all(models.engine)
+    hoje = date.today()
+    total_livros, total_usuarios = livros + DESCARTAVEIS, usuarios + DESCARTAVEIS
+    dados_livros = [{'titulo': f'Livro {i}', 'autor': f'Autor {i % 500}', 'ISBN': f'{i:013d}',
+                     'resumo': 'resumo ' * 20} for i in range(1, total_livros + 1)]
+    if nome_api == 'api_token':
+        from senhas import gerar_hash
+        senha_hash = gerar_hash(SENHA)
+        for livro in dados_livros:
+            livro['exemplares'] = livro['exemplares_disponiveis'] = 3
+        dados_usuarios = [{'nome': f'usuario{i}', 'CPF': carimbo_cpf(i), 'endereco': 'Rua A', 'senha_hash': senha_hash,
+                           'papel': 'admin' if i == 1 else 'usuario'} for i in range(1, total_usuarios + 1)]
+        dados_emprestimos = []
+        for i in range(emprestimos + DESCARTAVEIS):
+            # Os descartáveis ficam depois dos estáveis; 1 em cada 5 dos primeiros `usuarios` fica em aberto
+            # (um por usuário, então o índice único de empréstimos ativos nunca é violado)
+            inicio = hoje - timedelta(days=i % 400)
+            aberto = i < usuarios and i % 5 == 0
+            dados_emprestimos.append({
+                'data_emprestimo': inicio, 'data_devolucao': inicio + timedelta(days=14),
+                'data_devolvido': None if aberto else inicio + timedelta(days=10),
+                'livro_id': livro_do_emprestimo(i, livros), 'usuario_id': i % usuarios + 1,
+            })
+    else:
+        dados_usuarios = [{'nome': f'usuario{i}', 'email': f'usuario{i}@email.com', 'CPF': carimbo_cpf(i),
+                           'endereco': 'Rua A'} for i in range(1, total_usuarios + 1)]
+        dados_emprestimos = [{'data_emprestimo': '01/01/2025', 'data_devolucao': '15/01/2025',
+                              'livro_id': livro_do_emprestimo(i, livros), 'usuario_id': i % usuarios + 1}
+                             for i in range(emprestimos + DESCARTAVEIS)]
+    with models.engine.begin() as conexao:
+        conexao.execute(insert(models.Livro), dados_livros)
+        conexao.execute(insert(models.Usuario), dados_usuarios)
+        conexao.execute(insert(models.Emprestimo), dados_emprestimos)
+        if nome_api == 'api_token':
+            models.recalcular_exemplares(conexao)
+    models.init_db()  # índice de busca, versões das tabelas e (api_token) estatísticas
+
+
+# ---------------- LADO DO CLIENTE ----------------
+class Compartilhado:
+    # Estado comum a todos os clientes de uma API (o asyncio roda tudo numa thread, sem travas)
+    def __init__(self, args):
+        self.args = args
+        self.descartaveis = {
+            'livros': list(range(args.livros + 1, args.livros + DESCARTAVEIS + 1)),
+            'usuarios': list(range(args.usuarios + 1, args.usuarios + DESCARTAVEIS + 1)),
+            'emprestimos': list(range(args.emprestimos + 1, args.emprestimos + DESCARTAVEIS + 1)),
+        }
+        self.proximo_cpf = 90_000_000_000
+
+    def novo_cpf(self):
+        self.proximo_cpf += 1
+        return str(self.proximo_cpf)
+
+
+class Cliente:
+    def __init__(self, indice, perfil, compartilhado, semente):
+        self.indice = indice
+        self.perfil = perfil
+        self.comum = compartilhado
+        self.aleatorio = random.Random(semente * 1000 + indice)
+        # O admin entra como usuario1; os demais usam cada um o seu usuário (usuario2, usuario3, ...)
+        self.usuario_id = 1 if perfil == 'admin' else indice + 2
+        self.token = None
+        self.refresh_token = None
+        self.abertos = []
+
+    @property
+    def cabecalhos(self):
+        return {'Authorization': f'Bearer {self.token}'} if self.token else {}
+
+    def livro(self):
+        return self.aleatorio.randint(1, self.comum.args.livros)
+
+    def usuario(self):
+        return self.aleatorio.randint(1, self.comum.args.usuarios)
+
+    def emprestimo(self):
+        return self.aleatorio.randint(1, self.comum.args.emprestimos)
+
+    def descartavel(self, tabela):
+        lista = self.comum.descartaveis[tabela]
+        return lista.pop() if lista else None
+
+
+# Cada operação devolve (rota, método, url, opções do httpx, função chamada com a resposta) ou None
+# quando não há o que fazer agora (ex.: nenhuma linha descartável sobrando)
+def livro_novo(c):
+    return {'titulo': f'Carga {c.aleatorio.random()}', 'autor': f'Autor {c.aleatorio.randint(0, 499)}',
+            'ISBN': f'{c.aleatorio.randint(0, 10 ** 13 - 1):013d}', 'resumo': 'resumo da carga'}
+
+
+def dados_emprestimo(c, indice, formato):
+    inicio = date.today() - timedelta(days=indice % 400)
+    return {'data_emprestimo': inicio.strftime(formato), 'data_devolucao': (inicio + timedelta(days=14)).strftime(formato),
+            'livro_id': livro_do_emprestimo(indice, c.comum.args.livros), 'usuario_id': indice % c.comum.args.usuarios + 1}
+
+
+# api_local
+def local_index(c):
+    return 'GET /', 'GET', '/', {}, None
+
+def local_listar_livros(c):
+    return 'GET /livros', 'GET', f'/livros?limit=50&after={c.livro()}', {}, None
+
+def local_buscar_livros(c):
+    return 'GET /livros/busca', 'GET', f'/livros/busca?q=autor {c.aleatorio.randint(0, 499)}&limit=20', {}, None
+
+def local_listar_usuarios(c):
+    return 'GET /usuarios', 'GET', f'/usuarios?limit=50&after={c.usuario()}', {}, None
+
+def local_listar_emprestimos(c):
+    return 'GET /emprestimos', 'GET', f'/emprestimos?limit=50&after={c.emprestimo()}&expand=livro,usuario', {}, None
+
+def local_cadastrar_livro(c):
+    return 'POST /livros', 'POST', '/livros', {'json': livro_novo(c)}, None
+
+def local_editar_livro(c):
+    return 'PUT /livros/<id>', 'PUT', f'/livros/{c.livro()}', {'json': livro_novo(c)}, None
+
+def local_cadastrar_usuario(c):
+    return 'POST /usuarios', 'POST', '/usuarios', {'json': {'nome': 'novo', 'CPF': c.comum.novo_cpf(), 'endereco': 'Rua B'}}, None
+
+def local_editar_usuario(c):
+    id_usuario = c.usuario()
+    return ('PUT /usuarios/<id>', 'PUT', f'/usuarios/{id_usuario}',
+            {'json': {'nome': f'usuario{id_usuario}', 'CPF': c.comum.novo_cpf(), 'endereco': 'Rua C'}}, None)
+
+def local_cadastrar_emprestimo(c):
+    dados = {'data_emprestimo': '01/02/2025', 'data_devolucao': '15/02/2025', 'livro_id': c.livro(), 'usuario_id': c.usuario()}
+    return 'POST /emprestimos', 'POST', '/emprestimos', {'json': dados}, None
+
+def local_editar_emprestimo(c):
+    indice = c.emprestimo() - 1
+    return 'PUT /emprestimos/<id>', 'PUT', f'/emprestimos/{indice + 1}', {'json': dados_emprestimo(c, indice, '%d/%m/%Y')}, None
+
+def excluir(tabela, rota):
+    def operacao(c):
+        id_linha = c.descartavel(tabela)
+        if id_linha is None:
+            return None
+        return f'DELETE /{rota}/<id>', 'DELETE', f'/{rota}/{id_linha}', {}, None
+    return operacao
+
+
+# api_token
+def token_login(c):
+    def guardar(resposta):
+        if resposta.status_code == 200:
+            c.token = resposta.json()['access_token']
+            c.refresh_token = resposta.json()['refresh_token']
+    return 'POST /login', 'POST', '/login', {'json': {'nome': f'usuario{c.usuario_id}', 'senha': SENHA}}, guardar
+
+def token_refresh(c):
+    def guardar(resposta):
+        if resposta.status_code == 200:
+            c.token = resposta.json()['access_token']
+            c.refresh_token = resposta.json()['refresh_token']
+    return 'POST /token/refresh', 'POST', '/token/refresh', {'json': {'refresh_token': c.refresh_token}}, guardar
+
+def token_logout(c):
+    def sair(resposta):
+        c.token = c.refresh_token = None
+    return 'POST /logout', 'POST', '/logout', {'json': {'refresh_token': c.refresh_token}}, sair
+
+def token_listar_emprestimos(c):
+    def guardar_abertos(resposta):
+        if resposta.status_code == 200:
+            c.abertos = [e['id_emprestimo'] for e in resposta.json()['emprestimos'] if e['data_devolvido'] is None]
+    return 'GET /emprestimos', 'GET', '/emprestimos?limit=200', {}, guardar_abertos
+
+def token_atrasados(c):
+    return 'GET /emprestimos/atrasados', 'GET', '/emprestimos/atrasados?limit=50', {}, None
+
+def token_estatisticas(rota, consulta=''):
+    def operacao(c):
+        return f'GET /estatisticas/{rota}', 'GET', f'/estatisticas/{rota}{consulta}', {}, None
+    return operacao
+
+def token_emprestar(c):
+    dados = {'data_emprestimo': date.today().strftime('%d/%m/%Y'),
+             'data_devolucao': (date.today() + timedelta(days=14)).strftime('%d/%m/%Y'), 'livro_id': c.livro()}
+    return 'POST /emprestimos', 'POST', '/emprestimos', {'json': dados}, None
+
+def token_devolver(c):
+    # Sem empréstimo aberto conhecido, atualiza a lista do usuário primeiro
+    if not c.abertos:
+        return token_listar_emprestimos(c)
+    id_emprestimo = c.abertos.pop()
+    return 'POST /emprestimos/<id>/devolucao', 'POST', f'/emprestimos/{id_emprestimo}/devolucao', {}, None
+
+def token_editar_proprio_usuario(c):
+    return ('PUT /usuarios', 'PUT', '/usuarios',
+            {'json': {'nome': f'usuario{c.usuario_id}', 'CPF': c.comum.novo_cpf(), 'endereco': 'Rua C'}}, None)
+
+def token_editar_proprio_emprestimo(c):
+    # A rota edita o empréstimo com o mesmo id do usuário; mantém o livro dele
+    indice = c.usuario_id - 1
+    return 'PUT /emprestimos', 'PUT', '/emprestimos', {'json': dados_emprestimo(c, indice, '%d/%m/%Y')}, None
+
+def token_cadastrar_livro(c):
+    return 'POST /livros', 'POST', '/livros', {'json': {**livro_novo(c), 'exemplares': 3}}, None
+
+def token_cadastrar_livros_lote(c):
+    return 'POST /livros/bulk', 'POST', '/livros/bulk', {'json': [livro_novo(c) for _ in range(10)]}, None
+
+def token_editar_livro(c):
+    return 'PUT /livros/<id>', 'PUT', f'/livros/{c.livro()}', {'json': livro_novo(c)}, None
+
+def token_cadastrar_usuario(c):
+    return ('POST /usuarios', 'POST', '/usuarios',
+            {'json': {'nome': f'novo{c.comum.proximo_cpf}', 'CPF': c.comum.novo_cpf(), 'endereco': 'Rua B', 'senha': SENHA}}, None)
+
+def token_editar_usuario(c):
+    # Usuários acima dos que fazem login, com o mesmo nome (o login é pelo nome)
+    id_usuario = c.aleatorio.randint(sum(c.comum.args.clientes.values()) + 2, c.comum.args.usuarios)
+    return ('PUT /usuarios/<id>', 'PUT', f'/usuarios/{id_usuario}',
+            {'json': {'nome': f'usuario{id_usuario}', 'CPF': c.comum.novo_cpf(), 'endereco': 'Rua C'}}, None)
+
+def token_editar_emprestimo(c):
+    indice = c.emprestimo() - 1
+    dados = dados_emprestimo(c, indice, '%d/%m/%Y')
+    return 'PUT /emprestimos/<id>', 'PUT', f'/emprestimos/{indice + 1}', {'json': dados}, None
+
+def token_exportar(tabela):
+    def operacao(c):
+        return f'GET /export/{tabela}', 'GET', f'/export/{tabela}', {'headers': {'Accept': 'application/x-ndjson'}}, None
+    return operacao
+
+def token_simples(rota, url):
+    def operacao(c):
+        return rota, 'GET', url, {}, None
+    return operacao
+
+
+# Peso de cada operação por perfil: a chance de ser a próxima requisição do cliente
+PERFIS = {
+    'api_local': {
+        'leitor': [(1, local_index), (10, local_listar_livros), (6, local_buscar_livros),
+                   (4, local_listar_usuarios), (4, local_listar_emprestimos)],
+        'escritor': [(3, local_cadastrar_livro), (3, local_editar_livro), (2, local_cadastrar_usuario),
+                     (2, local_editar_usuario), (3, local_cadastrar_emprestimo), (2, local_editar_emprestimo)],
+        'admin': [(1, excluir('livros', 'livros')), (1, excluir('usuarios', 'usuarios')),
+                  (1, excluir('emprestimos', 'emprestimos')), (2, local_editar_livro), (2, local_listar_livros)],
+    },
+    'api_token': {
+        'leitor': [(1, token_simples('GET /', '/')), (10, token_simples('GET /livros', '/livros?limit=50')),
+                   (6, lambda c: local_buscar_livros(c)), (2, token_simples('GET /usuarios', '/usuarios')),
+                   (3, token_listar_emprestimos), (2, token_atrasados),
+                   (2, token_estatisticas('livros')), (1, token_estatisticas('usuarios')),
+                   (1, token_estatisticas('dias')), (1, token_refresh)],
+        'escritor': [(6, token_emprestar), (5, token_devolver), (2, token_listar_emprestimos),
+                     (1, token_editar_proprio_usuario), (1, token_editar_proprio_emprestimo), (1, token_refresh),
+                     (1, token_logout)],
+        'admin': [(3, token_cadastrar_livro), (1, token_cadastrar_livros_lote), (3, token_editar_livro),
+                  (1, token_cadastrar_usuario), (2, token_editar_usuario), (2, token_editar_emprestimo),
+                  (1, excluir('livros', 'livros')), (1, excluir('usuarios', 'usuarios')),
+                  (1, excluir('emprestimos', 'emprestimos')), (1, token_exportar('livros')),
+                  (1, token_exportar('emprestimos')), (2, token_simples('GET /cache/estatisticas', '/cache/estatisticas')),
+                  (2, token_simples('GET /usuarios', '/usuarios?limit=50')), (1, token_logout)],
+    },
+}
+
+
+class Medicoes:
+    def __init__(self):
+        self.rotas = {}
+        self.ativo = False
+
+    def registrar(self, rota, latencia, status, consultas):
+        if not self.ativo:
+            return
+        medida = self.rotas.setdefault(rota, {'latencias': [], 'consultas': 0, 'status': {}, 'erros': 0})
+        medida['status'][status] = medida['status'].get(status, 0) + 1
+        if status == 'erro' or status >= 500:
+            medida['erros'] += 1
+            return
+        medida['latencias'].append(latencia)
+        medida['consultas'] += consultas
+
+
+async def executar_cliente(cliente, http, medicoes, fim, autenticado):
+    import httpx
+    operacoes = PERFIS[cliente.comum.args.nome_api][cliente.perfil]
+    pesos = [peso for peso, _ in operacoes]
+    while time.monotonic() < fim:
+        if autenticado and cliente.token is None:
+            requisicao = token_login(cliente)
+        else:
+            requisicao = cliente.aleatorio.choices(operacoes, pesos)[0][1](cliente)
+            if requisicao is None:
+                continue
+        rota, metodo, url, opcoes, ao_responder = requisicao
+        opcoes = dict(opcoes)
+        opcoes['headers'] = {**cliente.cabecalhos, **opcoes.get('headers', {})}
+        inicio = time.perf_counter()
+        try:
+            resposta = await http.request(metodo, url, **opcoes)
+        except httpx.HTTPError:
+            medicoes.registrar(rota, 0, 'erro', 0)
+            continue
+        medicoes.registrar(rota, time.perf_counter() - inicio, resposta.status_code,
+                           int(resposta.headers.get('X-Consultas', 0)))
+        if ao_responder:
+            ao_responder(resposta)
+        if resposta.status_code == 503:
+            # Fila de hash de senhas cheia: espera como pede o Retry-After
+            await asyncio.sleep(float(resposta.headers.get('Retry-After', 1)))
+
+
+async def carga(url, args, medicoes):
+    # Aquecimento e medição são uma carga só: os clientes mantêm o login e as linhas já apagadas saem da fila
+    import httpx
+    comum = Compartilhado(args)
+    clientes = []
+    for perfil, quantidade in args.clientes.items():
+        for _ in range(quantidade):
+            clientes.append(Cliente(len(clientes), perfil, comum, args.semente))
+    limites = httpx.Limits(max_connections=len(clientes), max_keepalive_connections=len(clientes))
+
+    async def medir():
+        await asyncio.sleep(args.aquecimento)
+        medicoes.ativo = True
+
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as http:
+        fim = time.monotonic() + args.aquecimento + args.segundos
+        await asyncio.gather(medir(), *(executar_cliente(c, http, medicoes, fim, args.nome_api == 'api_token')
+                                        for c in clientes))
+
+
+async def esperar_servidor(url, processo):
+    import httpx
+    async with httpx.AsyncClient() as http:
+        for _ in range(600):
+            if processo.poll() is not None:
+                raise RuntimeError('servidor terminou antes de responder')
+            try:
+                await http.get(url + '/')
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError('servidor não respondeu')
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def resumir(medicoes, segundos):
+    rotas = {}
+    for rota, medida in sorted(medicoes.rotas.items()):
+        latencias = sorted(medida['latencias'])
+        rotas[rota] = {
+            'requisicoes': len(latencias) + medida['erros'],
+            'req_s': len(latencias) / segundos,
+            'p50_ms': percentil(latencias, 50) * 1000,
+            'p95_ms': percentil(latencias, 95) * 1000,
+            'p99_ms': percentil(latencias, 99) * 1000,
+            'consultas_por_req': medida['consultas'] / len(latencias) if latencias else 0.0,
+            'erros': medida['erros'],
+            'status': {str(status): quantidade for status, quantidade in sorted(medida['status'].items(), key=str)},
+        }
+    todas = sorted(latencia for medida in medicoes.rotas.values() for latencia in medida['latencias'])
+    consultas = sum(medida['consultas'] for medida in medicoes.rotas.values())
+    total = {
+        'requisicoes': sum(r['requisicoes'] for r in rotas.values()),
+        'req_s': len(todas) / segundos,
+        'p50_ms': percentil(todas, 50) * 1000,
+        'p95_ms': percentil(todas, 95) * 1000,
+        'p99_ms': percentil(todas, 99) * 1000,
+        'consultas_por_req': consultas / len(todas) if todas else 0.0,
+        'erros': sum(r['erros'] for r in rotas.values()),
+    }
+    return {'total': total, 'rotas': rotas}
+
+
+def comando_servidor(args, porta):
+    if args.servidor == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-c', os.path.join(PASTA_RAIZ, 'gunicorn.conf.py'),
+                'benchmark_carga:app_instrumentada()']
+    return [sys.executable, os.path.abspath(__file__), '--interno-servir', str(porta)]
+
+
+def medir_api(nome_api, args):
+    args.nome_api = nome_api
+    pasta = tempfile.mkdtemp(prefix=f'bench_carga_{nome_api}_')
+    porta = args.porta
+    ambiente = dict(os.environ, CARGA_PASTA_API=os.path.join(PASTA_RAIZ, nome_api), PYTHONPATH=PASTA_BENCHMARKS,
+                    GUNICORN_BIND=f'127.0.0.1:{porta}', GUNICORN_ACCESSLOG='')
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--interno-semear', nome_api,
+                        str(args.livros), str(args.usuarios), str(args.emprestimos)],
+                       cwd=pasta, env=ambiente, check=True, stdout=subprocess.DEVNULL)
+        processo = subprocess.Popen(comando_servidor(args, porta), cwd=pasta, env=ambiente,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f'http://127.0.0.1:{porta}'
+        try:
+            asyncio.run(esperar_servidor(url, processo))
+            medicoes = Medicoes()
+            asyncio.run(carga(url, args, medicoes))
+        finally:
+            processo.terminate()
+            processo.wait()
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+    return resumir(medicoes, args.segundos)
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PASTA_RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir(nome_api, resultado, anterior=None):
+    print(f'\n{nome_api}')
+    print(f"{'rota':<34}{'req':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'consultas':>11}{'erros':>7}")
+    linhas = list(resultado['rotas'].items()) + [('TOTAL', resultado['total'])]
+    for rota, r in linhas:
+        print(f"{rota:<34}{r['requisicoes']:>7}{r['req_s']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['consultas_por_req']:>11.1f}{r['erros']:>7}")
+        antes = (anterior or {}).get('rotas', {}).get(rota) if rota != 'TOTAL' else (anterior or {}).get('total')
+        if antes:
+            print(f"{'  (antes)':<34}{antes['requisicoes']:>7}{antes['req_s']:>9.1f}{antes['p50_ms']:>9.1f}"
+                  f"{antes['p95_ms']:>9.1f}{antes['p99_ms']:>9.1f}{antes['consultas_por_req']:>11.1f}{antes['erros']:>7}")
+
+
+def ler_clientes(texto):
+    clientes = {}
+    for parte in texto.split(','):
+        perfil, _, quantidade = parte.partition('=')
+        if perfil.strip() not in ('leitor', 'escritor', 'admin'):
+            raise argparse.ArgumentTypeError(f'perfil desconhecido: {perfil}')
+        clientes[perfil.strip()] = int(quantidade)
+    return clientes
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--interno-semear':
+        semear(sys.argv[2], *map(int, sys.argv[3:6]))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '--interno-servir':
+        app_instrumentada().run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True)
+        return
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apis', default='api_local,api_token')
+    parser.add_argument('--clientes', type=ler_clientes, default=ler_clientes('leitor=16,escritor=8,admin=2'))
+    parser.add_argument('--segundos', type=float, default=20)
+    parser.add_argument('--aquecimento', type=float, default=5)
+    parser.add_argument('--livros', type=int, default=20000)
+    parser.add_argument('--usuarios', type=int, default=2000)
+    parser.add_argument('--emprestimos', type=int, default=20000)
+    parser.add_argument('--servidor', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--porta', type=int, default=5060)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', default=os.path.join(PASTA_BENCHMARKS, 'resultados_carga.json'))
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para mostrar lado a lado')
+    args = parser.parse_args()
+    if args.usuarios < sum(args.clientes.values()) + 2:
+        parser.error('--usuarios precisa ser maior que o número de clientes (cada um faz login com o seu)')
+
+    anterior = {}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            anterior = json.load(arquivo).get('apis', {})
+
+    resultados = {}
+    for nome_api in args.apis.split(','):
+        resultados[nome_api] = medir_api(nome_api.strip(), args)
+        imprimir(nome_api, resultados[nome_api], anterior.get(nome_api))
+
+    relatorio = {
+        'commit': commit_atual(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {'clientes': args.clientes, 'segundos': args.segundos, 'livros': args.livros,
+                       'usuarios': args.usuarios, 'emprestimos': args.emprestimos, 'servidor': args.servidor,
+                       'semente': args.semente},
+        'apis': resultados,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    print(f'\nresultado salvo em {args.saida}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# benchmark_cold_start.py
+# Mede o cold start da api_vercel como na Vercel: um interpretador novo importa api_vercel.py,
+# cria a engine (sem conectar) e atende a primeira requisição. Cada rodada é um processo separado.
+# Sai com código 1 se a mediana do total passar do orçamento, para servir de verificação no CI.
+#
+# Uso: python benchmarks/benchmark_cold_start.py [--rodadas 7] [--orcamento-ms 1000] [--relatorio 15]
+#   --relatorio N: mostra os N módulos mais caros da importação (python -X importtime)
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PASTA_API = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_vercel')
+
+# Executado em cada processo novo; devolve a duração de cada fase em milissegundos
+RODADA = '''
+import json, time
+inicio = time.perf_counter()
+import api_vercel
+importado = time.perf_counter()
+api_vercel.obter_engine()
+engine = time.perf_counter()
+api_vercel.app.test_client().get('/')
+fim = time.perf_counter()
+print(json.dumps({
+    'importacao': (importado - inicio) * 1000,
+    'engine': (engine - importado) * 1000,
+    'primeira_requisicao': (fim - engine) * 1000,
+    'total': (fim - inicio) * 1000,
+}))
+'''
+
+
+def rodar(comando, **kwargs):
+    return subprocess.run([sys.executable, *comando], cwd=PASTA_API, capture_output=True, text=True,
+                          check=True, **kwargs)
+
+
+def medir_rodada():
+    saida = rodar(['-c', RODADA]).stdout
+    # models_vercel imprime as URLs ao criar a engine; a medição é a última linha
+    return json.loads(saida.strip().splitlines()[-1])
+
+
+def relatorio_importacao(quantidade):
+    # Cada linha do -X importtime: "import time: próprio | acumulado | módulo" (em microssegundos),
+    # com o nome recuado dois espaços por nível; os filhos aparecem antes da linha do módulo que os importou
+    filhos = []
+    for linha in rodar(['-X', 'importtime', '-c', 'import api_vercel']).stderr.splitlines():
+        if not linha.startswith('import time:') or 'self [us]' in linha:
+            continue
+        proprio, acumulado, nome = linha[len('import time:'):].split('|')
+        nivel = (len(nome) - len(nome.lstrip()) - 1) // 2
+        if nivel == 0:
+            if nome.strip() == 'api_vercel':
+                total = int(acumulado) / 1000
+                break
+            filhos = []
+        elif nivel == 1:
+            filhos.append((int(acumulado) / 1000, int(proprio) / 1000, nome.strip()))
+    # Módulos importados diretamente por api_vercel (e pelo que ele importa com `from ... import *`)
+    filhos.sort(reverse=True)
+    print(f"importação de api_vercel: {total:.1f} ms")
+    print(f"{'módulo':<40}{'acumulado ms':>14}{'próprio ms':>12}")
+    for acumulado, proprio, nome in filhos[:quantidade]:
+        print(f'{nome:<40}{acumulado:>14.1f}{proprio:>12.1f}')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rodadas', type=int, default=7)
+    parser.add_argument('--orcamento-ms', type=float,
+                        default=float(os.environ.get('COLD_START_ORCAMENTO_MS', 1000)))
+    parser.add_argument('--relatorio', type=int, default=15)
+    args = parser.parse_args()
+
+    if args.relatorio:
+        relatorio_importacao(args.relatorio)
+
+    rodadas = [medir_rodada() for _ in range(args.rodadas)]
+    print(f"{'fase':<22}{'mediana ms':>12}{'máximo ms':>12}")
+    for fase in ('importacao', 'engine', 'primeira_requisicao', 'total'):
+        valores = [rodada[fase] for rodada in rodadas]
+        print(f'{fase:<22}{statistics.median(valores):>12.1f}{max(valores):>12.1f}')
+
+    total = statistics.median(rodada['total'] for rodada in rodadas)
+    if total > args.orcamento_ms:
+        print(f'FALHOU: cold start de {total:.0f} ms passa do orçamento de {args.orcamento_ms:.0f} ms')
+        sys.exit(1)
+    print(f'ok: cold start de {total:.0f} ms dentro do orçamento de {args.orcamento_ms:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# benchmark_estoque.py
+# Muitos clientes disputando o mesmo livro popular (api_token/models_local.py).
+# 1) Corrida pelo estoque: cada thread tenta retirar exemplares com usuários diferentes até acabar.
+#    Compara o UPDATE condicional (registrar_emprestimo) com a leitura seguida de escrita (ler o livro,
+#    subtrair no Python e gravar), que vende o mesmo exemplar mais de uma vez.
+# 2) Vazão estável: as threads retiram e devolvem o mesmo título sem parar; mostra as operações por
+#    segundo de cada intervalo e confere no fim que disponíveis = total - empréstimos em aberto.
+#
+# Uso: python benchmarks/benchmark_estoque.py [--threads 16] [--exemplares 200] [--segundos 10]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_token'))
+
+
+def preparar(args):
+    # models_local abre banco_local.db relativo à pasta atual: o benchmark roda numa pasta temporária
+    os.chdir(tempfile.mkdtemp(prefix='bench_estoque_'))
+    import models_local
+    from sqlalchemy import insert
+    models_local.init_db()
+    usuarios = args.threads * args.exemplares
+    with models_local.engine.begin() as conexao:
+        conexao.execute(insert(models_local.Usuario), [
+            {'nome': f'usuario{i}', 'CPF': f'{i:011d}', 'endereco': 'Rua A', 'senha_hash': '-', 'papel': 'usuario'}
+            for i in range(usuarios)
+        ])
+    return models_local
+
+
+def novo_livro(m, exemplares):
+    db_session = m.local_session()
+    try:
+        livro = m.Livro(titulo='Popular', autor='Autor', ISBN='0', resumo='-',
+                        exemplares=exemplares, exemplares_disponiveis=exemplares)
+        livro.save(db_session)
+        return livro.id_livro
+    finally:
+        db_session.close()
+
+
+def emprestimo(m, livro_id, usuario_id):
+    return m.Emprestimo(data_emprestimo=date(2025, 1, 1), data_devolucao=date(2025, 1, 15),
+                        livro_id=livro_id, usuario_id=usuario_id)
+
+
+def retirar_condicional(m, livro_id, usuario_id):
+    db_session = m.local_session()
+    try:
+        return m.registrar_emprestimo(db_session, emprestimo(m, livro_id, usuario_id))
+    finally:
+        db_session.close()
+
+
+def retirar_lendo_antes(m, livro_id, usuario_id):
+    # O padrão que o UPDATE condicional substitui: lê, decide no Python e grava o valor calculado.
+    # A escrita é um UPDATE direto: pelo ORM a coluna `versao` do Livro recusaria a gravação obsoleta
+    from sqlalchemy import update
+    db_session = m.local_session()
+    try:
+        disponiveis = db_session.get(m.Livro, livro_id).exemplares_disponiveis
+        if disponiveis <= 0:
+            return False
+        time.sleep(0)  # cede a vez, como faria a latência da rede até o banco
+        db_session.execute(update(m.Livro).where(m.Livro.id_livro == livro_id)
+                           .values(exemplares_disponiveis=disponiveis - 1))
+        db_session.add(emprestimo(m, livro_id, usuario_id))
+        db_session.commit()
+        return True
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+def corrida(m, args, retirar):
+    livro_id = novo_livro(m, args.exemplares)
+    vendidos = []
+    trava = threading.Lock()
+
+    def cliente(indice):
+        # Cada thread usa a sua faixa de usuários, então o índice único nunca é o que impede a retirada
+        for tentativa in range(args.exemplares):
+            if not retirar(m, livro_id, indice * args.exemplares + tentativa + 1):
+                return
+            with trava:
+                vendidos.append(1)
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=cliente, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(vendidos), time.perf_counter() - inicio
+
+
+def vazao(m, args):
+    from sqlalchemy import select, func
+    livro_id = novo_livro(m, args.exemplares)
+    por_segundo = {}
+    trava = threading.Lock()
+    inicio = time.monotonic()
+    fim = inicio + args.segundos
+
+    def cliente(indice):
+        usuario_id = indice + 1
+        while time.monotonic() < fim:
+            db_session = m.local_session()
+            try:
+                if m.registrar_emprestimo(db_session, emprestimo(m, livro_id, usuario_id)):
+                    id_emprestimo = db_session.execute(
+                        select(m.Emprestimo.id_emprestimo).where(m.Emprestimo.livro_id == livro_id,
+                                                                 m.Emprestimo.usuario_id == usuario_id,
+                                                                 m.Emprestimo.data_devolvido.is_(None))
+                    ).scalar()
+                    m.registrar_devolucao(db_session, id_emprestimo, date(2025, 1, 15), usuario_id)
+                    segundo = int(time.monotonic() - inicio)
+                    with trava:
+                        por_segundo[segundo] = por_segundo.get(segundo, 0) + 1
+            finally:
+                db_session.close()
+
+    threads = [threading.Thread(target=cliente, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db_session = m.local_session()
+    try:
+        livro = db_session.get(m.Livro, livro_id)
+        abertos = db_session.execute(
+            select(func.count()).where(m.Emprestimo.livro_id == livro_id, m.Emprestimo.data_devolvido.is_(None))
+        ).scalar()
+        consistente = livro.exemplares_disponiveis == livro.exemplares - abertos
+    finally:
+        db_session.close()
+    intervalos = [por_segundo.get(segundo, 0) for segundo in range(int(args.segundos))]
+    return intervalos, consistente
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--exemplares', type=int, default=200)
+    parser.add_argument('--segundos', type=float, default=10)
+    args = parser.parse_args()
+    m = preparar(args)
+
+    print(f'{args.threads} threads disputando {args.exemplares} exemplares do mesmo livro')
+    for nome, retirar in (('update condicional', retirar_condicional), ('lê e grava', retirar_lendo_antes)):
+        vendidos, duracao = corrida(m, args, retirar)
+        situacao = 'ok' if vendidos == args.exemplares else f'VENDEU {vendidos - args.exemplares} A MAIS'
+        print(f'{nome:<20} retiradas={vendidos:<6} {vendidos / duracao:>8.1f} retiradas/s  {situacao}')
+
+    intervalos, consistente = vazao(m, args)
+    print(f'\nretirada + devolução por {args.segundos:.0f}s (operações por segundo de cada intervalo)')
+    print(' '.join(str(valor) for valor in intervalos))
+    print(f'mediana={statistics.median(intervalos):.0f}  mínimo={min(intervalos)}  máximo={max(intervalos)}  '
+          f'estoque {"consistente" if consistente else "INCONSISTENTE"}')
+    if not consistente:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
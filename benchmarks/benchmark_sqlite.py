@@ -0,0 +1,97 @@
+# benchmark_sqlite.py
+# Compara o SQLite com as configurações padrão e com o perfil ajustado de models_local.py
+# (WAL, busy_timeout, synchronous, mmap, cache e pool) sob leitores e escritores concorrentes.
+#
+# Uso: python benchmarks/benchmark_sqlite.py [--leitores 8] [--escritores 2] [--segundos 10] [--livros 20000]
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_token'))
+
+from sqlalchemy import create_engine, select, insert, update
+from sqlalchemy.exc import OperationalError
+from models_local import Base, Livro, criar_engine, PERFIL_SQLITE, POOL_SQLITE
+
+
+def preparar(engine, quantidade):
+    Base.metadata.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Livro), [
+            {'titulo': f'Livro {i}', 'autor': f'Autor {i % 500}', 'ISBN': f'{i:013d}', 'resumo': 'resumo ' * 20}
+            for i in range(quantidade)
+        ])
+
+
+trava_contagem = threading.Lock()
+
+
+def somar(contagem, chave):
+    with trava_contagem:
+        contagem[chave] += 1
+
+
+def leitor(engine, quantidade, fim, contagem):
+    while time.monotonic() < fim:
+        try:
+            with engine.connect() as conexao:
+                id_livro = random.randint(1, quantidade)
+                conexao.execute(select(Livro).where(Livro.id_livro == id_livro)).first()
+                conexao.execute(select(Livro).where(Livro.id_livro > id_livro).order_by(Livro.id_livro).limit(50)).all()
+            somar(contagem, 'leituras')
+        except OperationalError:
+            somar(contagem, 'erros')
+
+
+def escritor(engine, quantidade, fim, contagem):
+    while time.monotonic() < fim:
+        try:
+            with engine.begin() as conexao:
+                conexao.execute(insert(Livro).values(titulo='novo', autor='autor', ISBN='0', resumo='resumo'))
+                conexao.execute(update(Livro).where(Livro.id_livro == random.randint(1, quantidade))
+                                .values(titulo='editado'))
+            somar(contagem, 'escritas')
+        except OperationalError:
+            somar(contagem, 'erros')
+
+
+def medir(nome, fabrica_engine, args):
+    with tempfile.TemporaryDirectory() as pasta:
+        url = f"sqlite:///{os.path.join(pasta, 'benchmark.db')}"
+        engine = fabrica_engine(url)
+        preparar(engine, args.livros)
+        contagem = {'leituras': 0, 'escritas': 0, 'erros': 0}
+        fim = time.monotonic() + args.segundos
+        threads = [threading.Thread(target=leitor, args=(engine, args.livros, fim, contagem))
+                   for _ in range(args.leitores)]
+        threads += [threading.Thread(target=escritor, args=(engine, args.livros, fim, contagem))
+                    for _ in range(args.escritores)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+    print(f"{nome:<10} {contagem['leituras'] / args.segundos:>12.1f} {contagem['escritas'] / args.segundos:>12.1f}"
+          f" {contagem['erros']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite padrão x perfil ajustado')
+    parser.add_argument('--leitores', type=int, default=8)
+    parser.add_argument('--escritores', type=int, default=2)
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--livros', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{args.leitores} leitores, {args.escritores} escritores, {args.segundos:g}s")
+    print(f"{'perfil':<10} {'leituras/s':>12} {'escritas/s':>12} {'erros':>8}")
+    medir('padrao', lambda url: create_engine(url, connect_args={"check_same_thread": False}), args)
+    medir('ajustado', lambda url: criar_engine(url, PERFIL_SQLITE, POOL_SQLITE), args)
+
+
+if __name__ == '__main__':
+    main()
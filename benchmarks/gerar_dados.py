@@ -0,0 +1,292 @@
+# gerar_dados.py
+# Gera um banco sintético grande para testar as APIs em escala (api_local ou api_token):
+#   - livros com título, autor e resumo em português e ISBN-13 válido
+#   - usuários com nome, endereço e CPF válido formatado (xxx.xxx.xxx-xx)
+#   - empréstimos com popularidade dos livros em Zipf (poucos títulos concentram a maioria dos empréstimos),
+#     leitores mais e menos assíduos, devoluções adiantadas, no prazo e atrasadas, e uma fração ainda aberta
+#     depois do prazo (os atrasados). Na api_local, que não registra devolução, só as datas variam.
+# Tudo sai de um único random.Random(semente): a mesma semente e a mesma data de referência geram o mesmo banco.
+# A carga faz INSERTs em lote numa conexão sem journal e cria os índices secundários só no fim; depois o init_db
+# da API monta a busca textual e, na api_token, recalcula o estoque e as estatísticas de circulação.
+#
+# Uso: python benchmarks/gerar_dados.py --pasta /tmp/grande [--api api_token] [--livros 1000000]
+#          [--usuarios 100000] [--emprestimos 10000000] [--semente 42] [--referencia 2025-06-30]
+#          [--zipf 1.1] [--atrasados 0.05] [--senha 123456]
+# O banco é criado em <pasta>/banco_local.db (api_token) ou <pasta>/banco_livro.db (api_local), o arquivo que a
+# API abre quando roda de dentro da pasta. Na api_token o usuário 1 se chama "admin" (papel admin) e todos
+# entram com a mesma --senha.
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+import unicodedata
+from datetime import date, timedelta
+
+PASTA_RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LOTE = 50_000
+PRAZO_DIAS = 14  # entre data_emprestimo e data_devolucao
+
+NOMES = ['Ana', 'Beatriz', 'Camila', 'Daniela', 'Eduarda', 'Fernanda', 'Gabriela', 'Helena', 'Isabela', 'Júlia',
+         'Larissa', 'Luana', 'Mariana', 'Natália', 'Patrícia', 'Rafaela', 'Sofia', 'Tatiane', 'Valentina', 'Yasmin',
+         'Antônio', 'Bruno', 'Carlos', 'Diego', 'Eduardo', 'Felipe', 'Gustavo', 'Henrique', 'Igor', 'João',
+         'Leonardo', 'Lucas', 'Marcelo', 'Mateus', 'Otávio', 'Paulo', 'Rafael', 'Sérgio', 'Thiago', 'Vinícius',
+         'Cecília', 'Lívia', 'Alícia', 'Heloísa', 'Lúcia', 'Márcio', 'Fábio', 'César', 'Vitória', 'Caio']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima', 'Gomes',
+              'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes', 'Vieira',
+              'Barbosa', 'Rocha', 'Dias', 'Nascimento', 'Andrade', 'Moreira', 'Nunes', 'Marques', 'Machado',
+              'Mendes', 'Freitas', 'Cardoso', 'Ramos', 'Gonçalves', 'Santana', 'Teixeira', 'Araújo', 'Conceição',
+              'Magalhães', 'Brandão', 'Falcão', 'Guimarães', 'Assunção', 'Patrício', 'Cavalcanti', 'Sampaio']
+CIDADES = [('São Paulo', 'SP'), ('Rio de Janeiro', 'RJ'), ('Belo Horizonte', 'MG'), ('Salvador', 'BA'),
+           ('Fortaleza', 'CE'), ('Recife', 'PE'), ('Curitiba', 'PR'), ('Porto Alegre', 'RS'), ('Manaus', 'AM'),
+           ('Belém', 'PA'), ('Goiânia', 'GO'), ('São Luís', 'MA'), ('Maceió', 'AL'), ('Natal', 'RN'),
+           ('Teresina', 'PI'), ('João Pessoa', 'PB'), ('Florianópolis', 'SC'), ('Vitória', 'ES'), ('Cuiabá', 'MT'),
+           ('Campo Grande', 'MS'), ('Aracaju', 'SE'), ('Brasília', 'DF'), ('Campinas', 'SP'), ('Niterói', 'RJ')]
+LOGRADOUROS = ['Rua', 'Avenida', 'Travessa', 'Alameda', 'Praça']
+VIAS = ['das Flores', 'da Liberdade', 'Sete de Setembro', 'XV de Novembro', 'Dom Pedro II', 'São João',
+        'das Palmeiras', 'Santos Dumont', 'Tiradentes', 'Marechal Deodoro', 'do Comércio', 'Getúlio Vargas',
+        'Castro Alves', 'Machado de Assis', 'José de Alencar', 'Rui Barbosa', 'da Independência', 'Boa Vista']
+DOMINIOS = ['email.com', 'correio.com.br', 'provedor.net', 'exemplo.org']
+SUJEITOS = ['A Casa', 'O Rio', 'A Menina', 'O Segredo', 'As Cartas', 'O Jardim', 'A Noite', 'O Silêncio',
+            'A Viagem', 'O Relógio', 'As Vozes', 'O Último Verão', 'A Ilha', 'O Sertão', 'A Herança', 'O Mapa',
+            'A Estrada', 'O Farol', 'As Sombras', 'O Pássaro', 'A Memória', 'O Caderno', 'A Fronteira', 'O Navio',
+            'A Promessa', 'O Labirinto', 'As Águas', 'O Coração', 'A Cidade', 'O Espelho', 'A Canção', 'O Inverno']
+COMPLEMENTOS = ['de Vidro', 'do Sertão', 'da Meia-Noite', 'sem Nome', 'das Estrelas', 'do Norte', 'de Papel',
+                'da Serra', 'do Tempo', 'das Marés', 'de Outono', 'do Esquecimento', 'da Lua', 'de Areia',
+                'do Vento', 'da Floresta', 'de Ouro', 'do Mar', 'da Saudade', 'de Pedra', 'do Amanhã', 'da Aurora']
+PERSONAGENS = ['uma professora aposentada', 'um jovem pescador', 'duas irmãs', 'um detetive cansado',
+               'uma médica recém-formada', 'um menino curioso', 'uma família de imigrantes', 'um velho marinheiro',
+               'uma jornalista obstinada', 'um grupo de amigos', 'uma cientista', 'um músico sem rumo']
+ACOES = ['descobre', 'procura', 'tenta esconder', 'precisa reconstruir', 'herda', 'enfrenta', 'revisita',
+         'decide contar', 'perde', 'reencontra']
+OBJETOS = ['um segredo antigo', 'a casa da infância', 'uma carta nunca enviada', 'o passado da família',
+           'um amor esquecido', 'a verdade sobre o pai', 'um diário perdido', 'a própria identidade',
+           'um crime sem solução', 'as lembranças da guerra']
+CENARIOS = ['numa pequena cidade do interior', 'no litoral nordestino', 'em plena ditadura', 'no centro de São Paulo',
+            'às margens do São Francisco', 'numa fazenda do Pantanal', 'num Rio de Janeiro dos anos 50',
+            'numa aldeia da serra gaúcha', 'durante uma longa seca', 'em uma Belém chuvosa']
+FECHOS = ['Um romance sobre perdas e recomeços.', 'Uma narrativa delicada sobre memória e pertencimento.',
+          'Suspense e humor em doses iguais.', 'Vencedor de prêmios literários nacionais.',
+          'Uma história de coragem, afeto e reconciliação.', 'Um retrato sensível de uma época.']
+
+
+def cpf_formatado(base):
+    # base: os 9 primeiros dígitos; calcula os 2 verificadores como a Receita
+    digitos = [int(d) for d in f'{base:09d}']
+    for _ in range(2):
+        soma = sum(d * peso for d, peso in zip(digitos, range(len(digitos) + 1, 1, -1)))
+        digitos.append(soma * 10 % 11 % 10)
+    cpf = ''.join(map(str, digitos))
+    return f'{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}'
+
+
+def isbn13(numero):
+    # Prefixo 978 + grupo 65 (Brasil) + número sequencial, com dígito verificador válido
+    corpo = f'97865{numero:07d}'
+    soma = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(corpo))
+    return corpo + str((10 - soma % 10) % 10)
+
+
+def sem_acentos(texto):
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode().lower()
+
+
+def pesos_zipf(quantidade, expoente):
+    # Pesos acumulados 1/posição^expoente, para random.choices(cum_weights=...)
+    acumulado, total = [], 0.0
+    for posicao in range(1, quantidade + 1):
+        total += posicao ** -expoente
+        acumulado.append(total)
+    return acumulado
+
+
+def em_lotes(linhas):
+    linhas = iter(linhas)
+    while lote := list(itertools.islice(linhas, LOTE)):
+        yield lote
+
+
+def linhas_livros(rng, args, posicao_livro):
+    # exemplares acompanham a popularidade; recalcular_exemplares ainda garante que cubram os abertos
+    for id_livro in range(1, args.livros + 1):
+        titulo = f'{rng.choice(SUJEITOS)} {rng.choice(COMPLEMENTOS)}'
+        if rng.random() < 0.1:
+            titulo += f': Volume {rng.randint(2, 5)}'
+        autor = f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}'
+        resumo = (f'{rng.choice(PERSONAGENS).capitalize()} {rng.choice(ACOES)} {rng.choice(OBJETOS)} '
+                  f'{rng.choice(CENARIOS)}. {rng.choice(FECHOS)}')
+        posicao = posicao_livro[id_livro]
+        if posicao < args.livros // 100:
+            exemplares = rng.randint(4, 10)
+        elif posicao < args.livros // 10:
+            exemplares = rng.randint(2, 4)
+        else:
+            exemplares = rng.randint(1, 2)
+        if args.api == 'api_token':
+            yield id_livro, titulo, autor, isbn13(id_livro), resumo, True, exemplares, exemplares, 1
+        else:
+            yield id_livro, titulo, autor, isbn13(id_livro), resumo
+
+
+def linhas_usuarios(rng, args, senha_hash):
+    for id_usuario, base in enumerate(rng.sample(range(1, 10 ** 9), args.usuarios), start=1):
+        primeiro, sobrenome = rng.choice(NOMES), rng.choice(SOBRENOMES)
+        nome = f'{primeiro} {rng.choice(SOBRENOMES)} {sobrenome}'
+        cidade, uf = rng.choice(CIDADES)
+        endereco = f'{rng.choice(LOGRADOUROS)} {rng.choice(VIAS)}, {rng.randint(1, 3000)} - {cidade}/{uf}'
+        if args.api == 'api_token':
+            admin = id_usuario == 1
+            yield (id_usuario, 'admin' if admin else nome, cpf_formatado(base), endereco, senha_hash,
+                   'admin' if admin else 'usuario', 0, 1)
+        else:
+            email = f'{sem_acentos(primeiro)}.{sem_acentos(sobrenome)}{id_usuario}@{rng.choice(DOMINIOS)}'
+            yield id_usuario, nome, email, cpf_formatado(base), endereco
+
+
+def linhas_emprestimos(rng, args, referencia, ranking_livros):
+    # Livro sorteado pela posição no ranking de popularidade; os leitores também seguem uma Zipf, mais suave
+    formato = '%Y-%m-%d' if args.api == 'api_token' else '%d/%m/%Y'
+    # Datas por "dias antes da referência" (negativo = no futuro), formatadas uma vez só
+    datas = {dias: (referencia - timedelta(days=dias)).strftime(formato)
+             for dias in range(-PRAZO_DIAS, args.dias + 1)}
+    leitores = list(range(1, args.usuarios + 1))
+    rng.shuffle(leitores)
+    pesos_livros = pesos_zipf(args.livros, args.zipf)
+    pesos_leitores = pesos_zipf(args.usuarios, args.zipf_usuarios)
+    abertos = set()  # (livro, usuário) em aberto: o índice único ux_emprestimos_ativos não aceita repetição
+    gerados = 0
+    while gerados < args.emprestimos:
+        quantidade = min(LOTE, args.emprestimos - gerados)
+        livros = rng.choices(ranking_livros, cum_weights=pesos_livros, k=quantidade)
+        usuarios = rng.choices(leitores, cum_weights=pesos_leitores, k=quantidade)
+        for livro_id, usuario_id in zip(livros, usuarios):
+            # Ids em ordem cronológica, com os empréstimos espalhados por igual nos últimos `dias`
+            dias = args.dias - 1 - gerados * args.dias // args.emprestimos
+            gerados += 1
+            vencimento = dias - PRAZO_DIAS
+            if args.api != 'api_token':
+                yield datas[dias], datas[vencimento], livro_id, usuario_id
+                continue
+            if vencimento < 0:
+                # Ainda no prazo: a maioria segue aberta, alguns já voltaram
+                devolvido = None if rng.random() < 0.8 else rng.randint(0, dias)
+            elif rng.random() < args.atrasados:
+                devolvido = None
+            else:
+                # Devolvido entre 10 dias antes e 7 dias depois do vencimento, sem passar da referência
+                devolvido = min(dias, max(0, vencimento - rng.randint(-10, 7)))
+            if devolvido is None:
+                if (livro_id, usuario_id) in abertos:
+                    devolvido = max(0, vencimento)
+                else:
+                    abertos.add((livro_id, usuario_id))
+            yield (datas[dias], datas[vencimento], None if devolvido is None else datas[devolvido],
+                   livro_id, usuario_id, 1)
+
+
+def inserir(conexao, tabela, colunas, linhas):
+    inicio = time.perf_counter()
+    comando = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})"
+    total = 0
+    for lote in em_lotes(linhas):
+        conexao.exec_driver_sql(comando, lote)
+        total += len(lote)
+    duracao = time.perf_counter() - inicio
+    print(f'{tabela:<12}{total:>12} linhas {duracao:>8.1f}s {total / duracao:>10.0f} linhas/s')
+
+
+def carregar(args):
+    # Os modelos abrem o banco relativo à pasta atual
+    os.makedirs(args.pasta, exist_ok=True)
+    os.chdir(args.pasta)
+    sys.path.insert(0, os.path.join(PASTA_RAIZ, args.api))
+    import models_local
+    arquivo = models_local.engine.url.database
+    if os.path.exists(arquivo):
+        sys.exit(f'{os.path.abspath(arquivo)} já existe: apague o arquivo ou escolha outra --pasta')
+
+    rng = random.Random(args.semente)
+    referencia = date.fromisoformat(args.referencia) if args.referencia else date.today()
+    senha_hash = None
+    if args.api == 'api_token':
+        from senhas import gerar_hash
+        senha_hash = gerar_hash(args.senha)  # um hash só para todos: o scrypt levaria horas em 100 mil usuários
+
+    # Conexão só da carga: sem journal nem fsync (um banco novo que, se a carga falhar, é apagado e refeito)
+    perfil = dict(models_local.PERFIL_SQLITE, journal_mode='OFF', synchronous='OFF', foreign_keys='OFF')
+    engine_carga = models_local.criar_engine(f'sqlite:///{arquivo}', perfil=perfil,
+                                             pool={'pool_size': 1, 'max_overflow': 0, 'pool_timeout': 30})
+    inicio = time.perf_counter()
+    models_local.Base.metadata.create_all(engine_carga)
+    with engine_carga.begin() as conexao:
+        # Índices secundários saem antes da carga e voltam no fim: construir cada um de uma vez, ordenando,
+        # custa bem menos que mantê-lo a cada linha inserida
+        indices = conexao.exec_driver_sql(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").all()
+        for nome, _ in indices:
+            conexao.exec_driver_sql(f'DROP INDEX {nome}')
+
+        # Os livros entram em ordem aleatória no ranking de popularidade (o mais emprestado não é o id 1)
+        ranking_livros = list(range(1, args.livros + 1))
+        rng.shuffle(ranking_livros)
+        posicao_livro = [0] * (args.livros + 1)
+        for posicao, id_livro in enumerate(ranking_livros):
+            posicao_livro[id_livro] = posicao
+        if args.api == 'api_token':
+            inserir(conexao, 'livros', ('id_livro', 'titulo', 'autor', 'ISBN', 'resumo', 'status', 'exemplares',
+                                        'exemplares_disponiveis', 'versao'), linhas_livros(rng, args, posicao_livro))
+            inserir(conexao, 'usuarios', ('id_usuario', 'nome', 'CPF', 'endereco', 'senha_hash', 'papel',
+                                          'papel_versao', 'versao'), linhas_usuarios(rng, args, senha_hash))
+            inserir(conexao, 'emprestimos', ('data_emprestimo', 'data_devolucao', 'data_devolvido', 'livro_id',
+                                             'usuario_id', 'versao'), linhas_emprestimos(rng, args, referencia, ranking_livros))
+        else:
+            inserir(conexao, 'livros', ('id_livro', 'titulo', 'autor', 'ISBN', 'resumo'),
+                    linhas_livros(rng, args, posicao_livro))
+            inserir(conexao, 'usuarios', ('id_usuario', 'nome', 'email', 'CPF', 'endereco'),
+                    linhas_usuarios(rng, args, senha_hash))
+            inserir(conexao, 'emprestimos', ('data_emprestimo', 'data_devolucao', 'livro_id', 'usuario_id'),
+                    linhas_emprestimos(rng, args, referencia, ranking_livros))
+
+        etapa = time.perf_counter()
+        for _, sql in indices:
+            conexao.exec_driver_sql(sql)
+        print(f'índices {time.perf_counter() - etapa:.1f}s')
+        if args.api == 'api_token':
+            etapa = time.perf_counter()
+            models_local.recalcular_exemplares(conexao)
+            print(f'estoque {time.perf_counter() - etapa:.1f}s')
+    engine_carga.dispose()
+
+    # Busca textual, versões das tabelas e (api_token) estatísticas de circulação, como num banco migrado
+    etapa = time.perf_counter()
+    models_local.init_db()
+    print(f'init_db {time.perf_counter() - etapa:.1f}s')
+    print(f'total {time.perf_counter() - inicio:.1f}s -> {os.path.abspath(arquivo)}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pasta', required=True, help='pasta onde o banco da API é criado')
+    parser.add_argument('--api', choices=('api_local', 'api_token'), default='api_token')
+    parser.add_argument('--livros', type=int, default=1_000_000)
+    parser.add_argument('--usuarios', type=int, default=100_000)
+    parser.add_argument('--emprestimos', type=int, default=10_000_000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--referencia', help='data AAAA-MM-DD tratada como hoje (padrão: hoje)')
+    parser.add_argument('--dias', type=int, default=3 * 365, help='período coberto pelos empréstimos')
+    parser.add_argument('--zipf', type=float, default=1.1, help='expoente da popularidade dos livros')
+    parser.add_argument('--zipf-usuarios', type=float, default=0.6, help='expoente da assiduidade dos leitores')
+    parser.add_argument('--atrasados', type=float, default=0.05,
+                        help='fração dos empréstimos vencidos que segue em aberto (api_token)')
+    parser.add_argument('--senha', default='123456', help='senha de todos os usuários (api_token)')
+    args = parser.parse_args()
+    if not 0 < args.livros < 10 ** 7:
+        parser.error('--livros precisa ficar entre 1 e 9.999.999 (faixa do ISBN gerado)')
+    if args.dias <= PRAZO_DIAS:
+        parser.error(f'--dias precisa ser maior que o prazo de {PRAZO_DIAS} dias')
+    carregar(args)
+
+
+if __name__ == '__main__':
+    main()
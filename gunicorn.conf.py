@@ -0,0 +1,51 @@
+# gunicorn.conf.py
+# Servidor de produção (pre-fork) para as APIs Flask. Rodar de dentro da pasta da API, que é de onde
+# os modelos abrem o banco:
+#   cd api_token && gunicorn -c ../gunicorn.conf.py api_local:app
+#   cd api_local && gunicorn -c ../gunicorn.conf.py api_local:app
+#   cd api_vercel && gunicorn -c ../gunicorn.conf.py api_vercel:app
+# Todos os valores podem ser trocados por variável de ambiente (GUNICORN_*).
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Um processo por núcleo (mais um) e algumas threads em cada: o GIL limita um processo a um núcleo,
+# e as threads cobrem o tempo em que a requisição espera o banco ou o hash de senha
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# O master importa a aplicação uma vez (init_db, migrações, índices) e os workers herdam o código já
+# carregado por fork, em vez de cada um repetir a importação e disputar o DDL no banco
+preload_app = True
+
+# Keep-alive: o worker gthread mantém a conexão aberta entre requisições do mesmo cliente.
+# Atrás de um balanceador, use um valor maior que o tempo ocioso dele para não fechar conexões que ele
+# ainda considera vivas
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 2048))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Recicla cada worker depois de algumas milhares de requisições (com variação para não reiniciarem juntos)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+# GUNICORN_ACCESSLOG vazio desliga o log de acesso
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+errorlog = '-'
+
+# Módulos de modelos das APIs que criam uma engine na importação
+MODULOS_ENGINE = ('models_local', 'models_vercel')
+
+
+def post_fork(server, worker):
+    # As conexões abertas pelo master durante o preload (init_db) foram copiadas para o worker.
+    # dispose(close=False) descarta o pool herdado sem fechar as conexões do master; cada worker abre as suas.
+    # models_vercel só cria a engine na primeira requisição, então ela pode ainda não existir
+    for nome in MODULOS_ENGINE:
+        modulo = sys.modules.get(nome)
+        if modulo is not None and modulo.engine is not None:
+            modulo.engine.dispose(close=False)